@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+import os
+import sys
+import io
+import time
+import asyncio
+import argparse
+import threading
+import contextlib
+import statistics
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tdptk.FlashForgeSimulator import FlashForgeSimulator
+from tdptk.FlashForgeProtocol import FlashForgeProtocol
+from tdptk.ActionPrinterStatus import ActionPrinterStatus
+
+parser = argparse.ArgumentParser(description = "Measure upload throughput and command latency of the FlashForge protocol client against a simulated printer.")
+parser.add_argument("--latency", metavar = "secs", type = float, default = 0.01, help = "Simulated response latency. Defaults to %(default).3f secs.")
+parser.add_argument("--bandwidth", metavar = "kiB/s", type = float, help = "Simulated receive bandwidth of the printer. Unlimited by default.")
+parser.add_argument("--ack-delay", metavar = "secs", type = float, default = 0, help = "Simulated additional delay of chunk acknowledgements. Defaults to %(default).3f secs.")
+parser.add_argument("--ack-mode", choices = [ "index", "plain" ], default = "index", help = "How the simulated printer acknowledges chunks. Can be one of %(choices)s, defaults to %(default)s.")
+parser.add_argument("-s", "--size", metavar = "MiB", type = float, default = 4, help = "Size of the uploaded file. Defaults to %(default).1f MiB.")
+parser.add_argument("-w", "--windows", metavar = "list", default = "1,4,8,16", help = "Comma-separated upload window sizes to measure. Defaults to %(default)s.")
+parser.add_argument("-n", "--commands", metavar = "count", type = int, default = 200, help = "Number of commands sent to measure the command latency. Defaults to %(default)d.")
+parser.add_argument("-p", "--printers", metavar = "count", type = int, default = 20, help = "Number of simulated printers queried by the status action. Defaults to %(default)d.")
+parser.add_argument("-c", "--concurrency", metavar = "count", type = int, default = 8, help = "Concurrency of the status action, compared to querying one printer at a time. Defaults to %(default)d.")
+args = parser.parse_args(sys.argv[1:])
+
+def start_simulator():
+	# Every simulator runs its own event loop in a background thread
+	simulator = FlashForgeSimulator(port = 0, latency = args.latency, bandwidth = (args.bandwidth * 1024) if (args.bandwidth is not None) else None, ack_delay = args.ack_delay, ack_mode = args.ack_mode)
+	started = threading.Event()
+	thread = threading.Thread(target = lambda: asyncio.run(simulator.serve(started = started.set)), daemon = True)
+	thread.start()
+	started.wait()
+	return simulator
+
+print("Simulated printer: %.1f ms latency, %s, %.1f ms ack delay, %s acks" % (args.latency * 1000, ("%.0f kiB/sec" % (args.bandwidth)) if (args.bandwidth is not None) else "unlimited bandwidth", args.ack_delay * 1000, args.ack_mode))
+simulator = start_simulator()
+
+# send_file: upload throughput by window size
+content = os.urandom(round(args.size * 1024 * 1024))
+for window in [ int(window) for window in args.windows.split(",") ]:
+	with FlashForgeProtocol.connect_to_machine("127.0.0.1", port = simulator.port, log_traffic = False) as conn:
+		upload = conn.send_file("benchmark.gx", content, window = window)
+	print("send_file window %2d: %d chunks in %.2f secs: %.1f kiB/sec" % (window, upload.chunk_count, upload.duration_secs, upload.byte_count / 1024 / upload.duration_secs))
+
+# tx_rx: round trip time of single commands
+with FlashForgeProtocol.connect_to_machine("127.0.0.1", port = simulator.port, log_traffic = False) as conn:
+	round_trips = [ ]
+	for i in range(args.commands):
+		t0 = time.perf_counter()
+		conn.tx_rx("M105")
+		round_trips.append(time.perf_counter() - t0)
+round_trips.sort()
+median = statistics.median(round_trips)
+print("tx_rx M105: median %.2f ms, 95th percentile %.2f ms, %.2f ms above simulated latency" % (median * 1000, round_trips[int(0.95 * (len(round_trips) - 1))] * 1000, (median - args.latency) * 1000))
+
+# status: complete status sweep over many printers. run() would exit if a
+# printer failed, so the failures are counted instead.
+class StatusSweep(ActionPrinterStatus):
+	def run(self):
+		self.failed = asyncio.run(self._run())
+
+uris = [ "ff://127.0.0.1:%d" % (start_simulator().port) for i in range(args.printers) ]
+for concurrency in [ 1, args.concurrency ]:
+	status_args = argparse.Namespace(uri = uris, concurrency = concurrency, deadline = 60, timeout = 1.0, broker = None, verbose = 0)
+	t0 = time.perf_counter()
+	with contextlib.redirect_stdout(io.StringIO()):
+		sweep = StatusSweep("status", status_args)
+	t = time.perf_counter() - t0
+	print("status of %d printers, concurrency %2d: %.2f secs, %.1f ms per printer, %d failed" % (args.printers, concurrency, t, t / args.printers * 1000, sweep.failed))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tdptk.STLFile import STLFile, _STL_Header, _STL_Triangle
+
+parser = argparse.ArgumentParser(description = "Measure STL reading throughput on synthetic ASCII and binary input files.")
+parser.add_argument("-s", "--size", metavar = "MiB", type = int, default = 1024, help = "Size of the generated ASCII STL file. Defaults to %(default)d MiB.")
+parser.add_argument("-d", "--directory", metavar = "path", help = "Directory in which to create the input files. Defaults to the system temporary directory.")
+args = parser.parse_args(sys.argv[1:])
+
+# A block of random facets is repeated until the requested size is reached
+block_facets = 10000
+values = numpy.random.default_rng(0).uniform(-100, 100, size = (block_facets, 12)).astype(numpy.float32)
+facets = numpy.zeros(block_facets, dtype = _STL_Triangle.dtype)
+for (index, fieldname) in enumerate(_STL_Triangle.dtype.names[:12]):
+	facets[fieldname] = values[:, index]
+ascii_block = "".join("facet normal %e %e %e\n outer loop\n  vertex %e %e %e\n  vertex %e %e %e\n  vertex %e %e %e\n endloop\nendfacet\n" % tuple(row) for row in values.tolist()).encode()
+block_count = max(1, (args.size * 1024 * 1024) // len(ascii_block))
+facet_count = block_count * block_facets
+
+with tempfile.TemporaryDirectory(dir = args.directory) as tmpdir:
+	ascii_filename = os.path.join(tmpdir, "ascii.stl")
+	binary_filename = os.path.join(tmpdir, "binary.stl")
+	with open(ascii_filename, "wb") as f:
+		f.write(b"solid benchmark\n")
+		for i in range(block_count):
+			f.write(ascii_block)
+		f.write(b"endsolid benchmark\n")
+	with open(binary_filename, "wb") as f:
+		f.write(_STL_Header.pack({ "header": b"", "triangle_count": facet_count }))
+		binary_block = _STL_Triangle.pack_array(facets)
+		for i in range(block_count):
+			f.write(binary_block)
+
+	for (name, filename) in [ ("ASCII", ascii_filename), ("Binary", binary_filename) ]:
+		size = os.stat(filename).st_size
+		t0 = time.time()
+		stl = STLFile.read(filename)
+		# Touch all vertices so that memory-mapped data is actually read
+		checksum = float(stl.vertices.sum(dtype = numpy.float64))
+		t = time.time() - t0
+		assert(len(stl) == facet_count)
+		print("%-6s: %d facets, %.0f MiB in %.2f secs: %.1f MiB/sec, %.2f M facets/sec (checksum %.1f)" % (name, len(stl), size / 1024 / 1024, t, size / 1024 / 1024 / t, len(stl) / t / 1e6, checksum))
@@ -0,0 +1,171 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import sys
+import time
+import shlex
+import tempfile
+import threading
+import subprocess
+import contextlib
+import collections
+import concurrent.futures
+from .BaseAction import BaseAction
+from .POVRayRenderer import POVRayRenderer, POVRayStyle, POVRayMode
+from .POVRayGeometryCache import POVRayGeometryCache
+from .SceneGenerator import SceneGenerator
+
+def _generate_geometry(input_filename, filetype, cache_dir, lod_resolution, cull_resolution):
+	# Runs in a worker process of the parsing pool
+	t0 = time.time()
+	scene = SceneGenerator(input_filename, filetype = filetype, lod_resolution = lod_resolution, cull_resolution = cull_resolution)
+	geometry_include = scene.geometry_include(POVRayRenderer(), POVRayGeometryCache(cache_dir = cache_dir))
+	return (geometry_include, time.time() - t0)
+
+class ActionBatchRender(BaseAction):
+	RenderJob = collections.namedtuple("RenderJob", [ "input_filename", "output_filename" ])
+
+	def _output_filename(self, input_filename):
+		basename = os.path.splitext(os.path.basename(input_filename))[0]
+		return os.path.join(self._args.output_dir, "%s.%s" % (basename, self._args.extension))
+
+	def _read_manifest(self, filename):
+		# Every line of the manifest names an input file and, optionally,
+		# the output file to render it to
+		with open(filename) as f:
+			for (lineno, line) in enumerate(f, 1):
+				line = line.strip()
+				if (line == "") or line.startswith("#"):
+					continue
+				try:
+					fields = shlex.split(line)
+				except ValueError as e:
+					print("%s:%d: %s" % (filename, lineno, str(e)))
+					sys.exit(1)
+				if len(fields) == 1:
+					yield self.RenderJob(input_filename = fields[0], output_filename = self._output_filename(fields[0]))
+				elif len(fields) == 2:
+					yield self.RenderJob(input_filename = fields[0], output_filename = fields[1])
+				else:
+					print("%s:%d: more than two filenames given" % (filename, lineno))
+					sys.exit(1)
+
+	def _render_jobs(self):
+		jobs = [ self.RenderJob(input_filename = input_filename, output_filename = self._output_filename(input_filename)) for input_filename in self._args.input_filename ]
+		if self._args.manifest is not None:
+			jobs += list(self._read_manifest(self._args.manifest))
+		return jobs
+
+	def _report(self, job, text):
+		with self._print_lock:
+			print("%s: %s" % (job.input_filename, text))
+			sys.stdout.flush()
+
+	def _render(self, job, geometry_include, parse_time):
+		t0 = time.time()
+		try:
+			self._povray_renderer.render_image(job.output_filename, additional_povray_options = self._povray_options, trim_image = not self._args.no_trim, geometry_include = geometry_include, quiet = (self._args.verbose < 2))
+		except subprocess.CalledProcessError as e:
+			self._report(job, "POV-Ray failed with status %d" % (e.returncode))
+			if e.stderr is not None:
+				with self._print_lock:
+					sys.stdout.write(e.stderr.decode("utf-8", errors = "replace"))
+			return False
+		except Exception as e:
+			self._report(job, "rendering failed: %s: %s" % (e.__class__.__name__, str(e)))
+			return False
+		render_time = time.time() - t0
+		self._report(job, "parse %.2f secs, render %.2f secs -> %s" % (parse_time, render_time, job.output_filename))
+		return True
+
+	def run(self):
+		jobs = self._render_jobs()
+		if len(jobs) == 0:
+			print("No input files given.")
+			sys.exit(1)
+		self._povray_renderer = POVRayRenderer(width = self._args.dimensions[0], height = self._args.dimensions[1], oversample_factor = self._args.oversample, style = POVRayStyle(self._args.style), mode = POVRayMode(self._args.mode), views = self._args.views, verbosity = self._args.verbose)
+		# Two inputs with the same basename in different directories would
+		# otherwise silently render to the same output file
+		output_jobs = { }
+		for job in jobs:
+			for view in self._povray_renderer.views:
+				output_filename = self._povray_renderer.view_filename(job.output_filename, view)
+				key = os.path.realpath(output_filename)
+				if key in output_jobs:
+					print("%s and %s would both be rendered to %s; use a manifest to give them distinct output filenames." % (output_jobs[key].input_filename, job.input_filename, output_filename))
+					sys.exit(1)
+				output_jobs[key] = job
+				if (not self._args.force) and os.path.exists(output_filename):
+					print("Refusing to overwrite: %s" % (output_filename))
+					sys.exit(1)
+
+		self._print_lock = threading.Lock()
+		self._povray_options = self._args.povray + [ "Work_Threads=%d" % (self._args.threads) ]
+
+		if self._args.lod:
+			lod_resolution = round(max(self._args.dimensions) * self._args.oversample)
+		else:
+			lod_resolution = None
+		if self._args.cull:
+			# Culling removes what is hidden from the isometric camera and would
+			# leave holes in the geometry when it is seen from any other angle
+			iso_location = POVRayRenderer.isometric_view().location
+			if any(view.location != iso_location for view in self._povray_renderer.views):
+				print("--cull can only be used with the isometric view.")
+				sys.exit(1)
+			cull_resolution = round(max(self._args.dimensions) * self._args.oversample)
+		else:
+			cull_resolution = None
+		os.makedirs(self._args.output_dir, exist_ok = True)
+
+		t0 = time.time()
+		failed = 0
+		with contextlib.ExitStack() as stack:
+			if self._args.no_cache:
+				cache_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix = "tdptk_"))
+			else:
+				cache_dir = POVRayGeometryCache(cache_dir = self._args.cache_dir).cache_dir
+
+			# Scene generation runs in worker processes; as soon as the
+			# geometry of one input is ready, it is queued for rendering so
+			# that parsing and POV-Ray runs overlap
+			parse_pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers = self._args.parse_jobs))
+			render_pool = stack.enter_context(concurrent.futures.ThreadPoolExecutor(max_workers = self._args.jobs))
+			parse_futures = { parse_pool.submit(_generate_geometry, job.input_filename, self._args.filetype, cache_dir, lod_resolution, cull_resolution): job for job in jobs }
+			render_futures = [ ]
+			for future in concurrent.futures.as_completed(parse_futures):
+				job = parse_futures[future]
+				try:
+					(geometry_include, parse_time) = future.result()
+				except Exception as e:
+					self._report(job, "failed to generate scene: %s" % (str(e)))
+					failed += 1
+					continue
+				render_futures.append(render_pool.submit(self._render, job, geometry_include, parse_time))
+			for future in concurrent.futures.as_completed(render_futures):
+				if not future.result():
+					failed += 1
+
+		t1 = time.time()
+		print("Rendered %d of %d files in %.1f secs using %d POV-Ray process(es) with %d thread(s) each." % (len(jobs) - failed, len(jobs), t1 - t0, self._args.jobs, self._args.threads))
+		if failed > 0:
+			sys.exit(1)
@@ -0,0 +1,35 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import sys
+import asyncio
+from .BaseAction import BaseAction
+from .PrinterBroker import PrinterBroker
+from .Exceptions import PrinterBrokerException
+
+class ActionBroker(BaseAction):
+	def run(self):
+		broker = PrinterBroker(self._args.socket, default_timeout = self._args.timeout, idle_timeout = self._args.idle_timeout, verbosity = self._args.verbose)
+		try:
+			asyncio.run(broker.serve())
+		except PrinterBrokerException as e:
+			print("%s" % (str(e)))
+			sys.exit(1)
@@ -21,12 +21,12 @@
 
 import os
 import sys
-import tempfile
-import subprocess
 from .BaseAction import BaseAction
 from .XGCodeFile import XGCodeFile, XGCodeFlags
 from .GCodeInterpreter import GCodeBaseInterpreter, GCodeParser, GCodeInformationHook, GCodePOVRayHook, GCodeSpeedHook
 from .POVRayRenderer import POVRayRenderer, POVRayStyle
+from .PreviewRasterizer import PreviewRasterizer
+from .GeometryFilters import LODGeometryFilter, OcclusionGeometryFilter
 
 class ActionCreateGX(BaseAction):
 	def run(self):
@@ -38,8 +38,12 @@ class ActionCreateGX(BaseAction):
 		with open(self._args.gcode_filename) as f:
 			gcode_data = f.read()
 
-		# Render the G-code using POV-Ray so we have a preview bitmap
-		povray_renderer = POVRayRenderer(width = 80, height = 60, oversample_factor = 4, style = POVRayStyle.BlackWhite, verbosity = self._args.verbose)
+		# Render the G-code so we have a preview bitmap, either using the
+		# built-in rasterizer or POV-Ray
+		if self._args.preview == "builtin":
+			preview_renderer = PreviewRasterizer(width = 80, height = 60, oversample_factor = 4, style = POVRayStyle.BlackWhite, verbosity = self._args.verbose)
+		else:
+			preview_renderer = POVRayRenderer(width = 80, height = 60, oversample_factor = 4, style = POVRayStyle.BlackWhite, verbosity = self._args.verbose)
 
 		# Parse G-code to gather metadata about file and fill the POV-Ray renderer with data
 		interpreter = GCodeBaseInterpreter()
@@ -47,14 +51,23 @@ class ActionCreateGX(BaseAction):
 		speed = GCodeSpeedHook()
 		interpreter.add_hook(info)
 		interpreter.add_hook(speed)
-		interpreter.add_hook(GCodePOVRayHook(povray_renderer, info))
+		# The preview is tiny, so geometry below its pixel size is dropped.
+		# POV-Ray additionally only gets the cylinders which are not hidden,
+		# the built-in rasterizer does its own depth buffering anyways.
+		if self._args.preview == "builtin":
+			geometry_target = preview_renderer
+		else:
+			geometry_target = OcclusionGeometryFilter(preview_renderer, resolution = 80 * 4, verbosity = self._args.verbose)
+		lod_filter = LODGeometryFilter(geometry_target, resolution = 80 * 4, verbosity = self._args.verbose)
+		interpreter.add_hook(GCodePOVRayHook(lod_filter, info))
 		parser = GCodeParser(interpreter)
 		parser.parse_all(gcode_data)
+		lod_filter.flush()
 
-		with tempfile.NamedTemporaryFile(suffix = ".png") as png_outfile, tempfile.NamedTemporaryFile(suffix = ".bmp") as bmp_outfile:
-			povray_renderer.render_image(png_outfile.name, trim_image = True)
-			subprocess.check_call([ "convert", "-colorspace", "RGB", png_outfile.name, bmp_outfile.name ])
-			bitmap_data = bmp_outfile.read()
+		if self._args.preview == "builtin":
+			bitmap_data = preview_renderer.render().to_bmp()
+		else:
+			bitmap_data = preview_renderer.render_raster(trim_image = True).to_bmp()
 
 		flags = 0
 		if info.total_extruded_length.get(0, 0) > 0:
@@ -21,16 +21,20 @@
 
 import os
 import sys
+import math
 import json
+import collections
 from .BaseAction import BaseAction
 from .Exceptions import CannotDetermineFiletypeException
 from .XGCodeFile import XGCodeFile, XGCodeFlags
 from .GCodeInterpreter import GCodeBaseInterpreter, GCodeParser, GCodeInformationHook, GCodeSpeedHook
+from .STLFile import STLFile
 
 class ActionFileInfo(BaseAction):
 	_EXTENSIONS = {
 		".gx":		"gx",
 		".g":		"g",
+		".stl":		"stl",
 	}
 
 	def _create_parser(self):
@@ -59,60 +63,126 @@ class ActionFileInfo(BaseAction):
 		xgcode = XGCodeFile.read(filename)
 		(info, speed, parser) = self._create_parser()
 		parser.parse_all(xgcode.gcode_data.decode("ascii"))
-
-		print("Preview image   : %d bytes bitmap" % (len(xgcode.bitmap_data)))
-		print("G-code          : %d bytes machine data" % (len(xgcode.gcode_data)))
-		print("Flags           : %s" % (", ".join(flag.name for flag in xgcode.flags)))
-		print("Layer height    : %d microns (%d microns according to G-code)" % (xgcode.header.layer_height_microns, round(info.median_z_change * 1000)))
-		print("Perimeter shells: %d" % (xgcode.header.perimeter_shell_count))
-		hrs = xgcode.header.print_time_secs // 3600
-		mins = xgcode.header.print_time_secs % 3600 // 60
-		secs = xgcode.header.print_time_secs % 3600 % 60
-		print("Print time      : %d:%02d:%02d h:m:s (estimated %s h:m:s from G-code)" % (hrs, mins, secs, speed.print_time_hms))
-		print("Print speed     : %d mm/sec (%d mm/sec from G-code)" % (xgcode.header.print_speed_mm_per_sec, round(speed.max_feedrate_mm_per_sec)))
-		print("Bed temperature : %d°C (max %d°C according to G-code)" % (xgcode.header.platform_temp_deg_c, info.bed_max_temp))
-		if (self._args.verbose >= 2) or (XGCodeFlags.Use_Right_Extruder in xgcode.flags):
-			print()
-			print("Right Extruder:")
-			print("   Material    : %s" % (xgcode.material_right.name))
-			print("   Filament use: %.2fm (%.2fm according to G-code)" % (xgcode.header.filament_use_mm_right / 1000, info.total_extruded_length[0] / 1000))
-			print("   Temperature : %d°C (max %d°C according to G-code)" % (xgcode.header.extruder_temp_right_deg_c, info.tool_max_temp[0]))
-		if (self._args.verbose >= 2) or (XGCodeFlags.Use_Left_Extruder in xgcode.flags):
-			print()
-			print("Left Extruder:")
-			print("   Material    : %s" % (xgcode.material_left.name))
-			print("   Filament use: %.2fm (%.2fm according to G-code)" % (xgcode.header.filament_use_mm_left / 1000, info.total_extruded_length[1] / 1000))
-			print("   Temperature : %d°C (max %d°C according to G-code)" % (xgcode.header.extruder_temp_left_deg_c, info.tool_max_temp[1]))
 		self._write_speedplot(speed)
+		return {
+			"preview_bytes":				len(xgcode.bitmap_data),
+			"gcode_bytes":					len(xgcode.gcode_data),
+			"flags":						[ flag.name for flag in xgcode.flags ],
+			"layer_height_microns":			xgcode.header.layer_height_microns,
+			"gcode_layer_height_microns":	round(info.median_z_change * 1000),
+			"perimeter_shell_count":		xgcode.header.perimeter_shell_count,
+			"print_time_secs":				xgcode.header.print_time_secs,
+			"gcode_print_time_secs":		round(speed.print_time_secs),
+			"print_speed_mm_per_sec":		xgcode.header.print_speed_mm_per_sec,
+			"gcode_print_speed_mm_per_sec":	round(speed.max_feedrate_mm_per_sec),
+			"bed_temp_deg_c":				xgcode.header.platform_temp_deg_c,
+			"gcode_bed_temp_deg_c":			info.bed_max_temp,
+			"extruders": {
+				"right": {
+					"used":						XGCodeFlags.Use_Right_Extruder in xgcode.flags,
+					"material":					xgcode.material_right.name,
+					"filament_use_mm":			xgcode.header.filament_use_mm_right,
+					"gcode_filament_use_mm":	info.total_extruded_length[0],
+					"temp_deg_c":				xgcode.header.extruder_temp_right_deg_c,
+					"gcode_temp_deg_c":			info.tool_max_temp[0],
+				},
+				"left": {
+					"used":						XGCodeFlags.Use_Left_Extruder in xgcode.flags,
+					"material":					xgcode.material_left.name,
+					"filament_use_mm":			xgcode.header.filament_use_mm_left,
+					"gcode_filament_use_mm":	info.total_extruded_length[1],
+					"temp_deg_c":				xgcode.header.extruder_temp_left_deg_c,
+					"gcode_temp_deg_c":			info.tool_max_temp[1],
+				},
+			},
+		}
+
+	def _print_file_gx(self, result):
+		print("Preview image   : %d bytes bitmap" % (result["preview_bytes"]))
+		print("G-code          : %d bytes machine data" % (result["gcode_bytes"]))
+		print("Flags           : %s" % (", ".join(result["flags"])))
+		print("Layer height    : %d microns (%d microns according to G-code)" % (result["layer_height_microns"], result["gcode_layer_height_microns"]))
+		print("Perimeter shells: %d" % (result["perimeter_shell_count"]))
+		print("Print time      : %s h:m:s (estimated %s h:m:s from G-code)" % (self._hms(result["print_time_secs"]), self._hms(result["gcode_print_time_secs"])))
+		print("Print speed     : %d mm/sec (%d mm/sec from G-code)" % (result["print_speed_mm_per_sec"], result["gcode_print_speed_mm_per_sec"]))
+		print("Bed temperature : %d°C (max %d°C according to G-code)" % (result["bed_temp_deg_c"], result["gcode_bed_temp_deg_c"]))
+		for (name, extruder) in [ ("Right", result["extruders"]["right"]), ("Left", result["extruders"]["left"]) ]:
+			if (self._args.verbose >= 2) or extruder["used"]:
+				print()
+				print("%s Extruder:" % (name))
+				print("   Material    : %s" % (extruder["material"]))
+				print("   Filament use: %.2fm (%.2fm according to G-code)" % (extruder["filament_use_mm"] / 1000, extruder["gcode_filament_use_mm"] / 1000))
+				print("   Temperature : %d°C (max %d°C according to G-code)" % (extruder["temp_deg_c"], extruder["gcode_temp_deg_c"]))
 
 	def _run_file_g(self, filename):
 		(info, speed, parser) = self._create_parser()
 		with open(filename) as f:
 			parser.parse_all(f.read())
-		print("Bed temperature : %d°C" % (info.bed_max_temp))
-		print("Print time      : %s h:m:s" % (speed.print_time_hms))
-		print("Print speed     : %d mm/sec" % (round(speed.max_feedrate_mm_per_sec)))
-		for (tool, length) in sorted(info.total_extruded_length.items()):
-			print()
-			print("Extruder #%d" % (tool + 1))
-			print("   Filament use: %.2fm" % (info.total_extruded_length[tool] / 1000))
-			print("   Temperature : %d°C" % (info.tool_max_temp[tool]))
 		self._write_speedplot(speed)
+		return {
+			"bed_temp_deg_c":			info.bed_max_temp,
+			"print_time_secs":			round(speed.print_time_secs),
+			"print_speed_mm_per_sec":	round(speed.max_feedrate_mm_per_sec),
+			"extruders": [ {
+				"tool":					tool,
+				"filament_use_mm":		length,
+				"temp_deg_c":			info.tool_max_temp[tool],
+			} for (tool, length) in sorted(info.total_extruded_length.items()) ],
+		}
+
+	def _print_file_g(self, result):
+		print("Bed temperature : %d°C" % (result["bed_temp_deg_c"]))
+		print("Print time      : %s h:m:s" % (self._hms(result["print_time_secs"])))
+		print("Print speed     : %d mm/sec" % (result["print_speed_mm_per_sec"]))
+		for extruder in result["extruders"]:
+			print()
+			print("Extruder #%d" % (extruder["tool"] + 1))
+			print("   Filament use: %.2fm" % (extruder["filament_use_mm"] / 1000))
+			print("   Temperature : %d°C" % (extruder["temp_deg_c"]))
 
-	def _run_file(self, filename):
+	def _run_file_stl(self, filename):
+		stl = STLFile.read(filename)
+		(lower, upper) = stl.bounding_box()
+		volume_mm3 = stl.signed_volume()
+		filament_cross_section_mm2 = math.pi * (self._args.filament_diameter / 2) ** 2
+		return {
+			"facet_count":					len(stl),
+			"bounding_box_min_mm":			lower.tolist(),
+			"bounding_box_max_mm":			upper.tolist(),
+			"dimensions_mm":				(upper - lower).tolist(),
+			"surface_area_mm2":				stl.surface_area(),
+			"volume_mm3":					volume_mm3,
+			"mass_g":						abs(volume_mm3) / 1000 * self._args.density,
+			"filament_use_mm":				abs(volume_mm3) / filament_cross_section_mm2,
+			"non_manifold_edge_count":		stl.non_manifold_edge_count(),
+		}
+
+	def _print_file_stl(self, result):
+		print("Facets          : %d" % (result["facet_count"]))
+		print("Dimensions      : %.2f x %.2f x %.2f mm" % tuple(result["dimensions_mm"]))
+		print("Bounding box    : %s to %s mm" % (" / ".join("%.2f" % (value) for value in result["bounding_box_min_mm"]), " / ".join("%.2f" % (value) for value in result["bounding_box_max_mm"])))
+		print("Surface area    : %.2f cm²" % (result["surface_area_mm2"] / 100))
+		print("Volume          : %.2f cm³%s" % (result["volume_mm3"] / 1000, " (negative, facets are inverted)" if (result["volume_mm3"] < 0) else ""))
+		print("Solid mass      : %.1fg at %.2f g/cm³" % (result["mass_g"], self._args.density))
+		print("Solid filament  : %.2fm of %.2fmm filament" % (result["filament_use_mm"] / 1000, self._args.filament_diameter))
+		if result["non_manifold_edge_count"] == 0:
+			print("Manifold        : yes")
+		else:
+			print("Manifold        : no, %d non-manifold edges" % (result["non_manifold_edge_count"]))
+
+	@staticmethod
+	def _hms(secs):
+		return "%d:%02d:%02d" % (secs // 3600, secs % 3600 // 60, secs % 3600 % 60)
+
+	def _determine_filetype(self, filename):
 		if self._args.filetype == "auto":
 			(base, ext) = os.path.splitext(filename)
 			ext = ext.lower()
 			if ext not in self._EXTENSIONS:
 				raise CannotDetermineFiletypeException("Do not know what type of file '%s' extension is." % (ext))
-
-			filetype = self._EXTENSIONS[ext]
+			return self._EXTENSIONS[ext]
 		else:
-			filetype = self._args.filetype
-
-		method_name = "_run_file_%s" % (filetype)
-		method = getattr(self, method_name)
-		method(filename)
+			return self._args.filetype
 
 	def run(self):
 		if not self._args.force:
@@ -120,7 +190,16 @@ class ActionFileInfo(BaseAction):
 				print("Refusing to overwrite: %s" % (self._args.output_speedplot))
 				sys.exit(1)
 
+		results = [ ]
 		for filename in self._args.filename:
-			print(filename)
-			self._run_file(filename)
+			filetype = self._determine_filetype(filename)
+			result = getattr(self, "_run_file_%s" % (filetype))(filename)
+			if self._args.json:
+				results.append(collections.OrderedDict([ ("filename", filename), ("filetype", filetype) ] + list(result.items())))
+			else:
+				print(filename)
+				getattr(self, "_print_file_%s" % (filetype))(result)
+				print()
+		if self._args.json:
+			json.dump(results, sys.stdout, indent = 4)
 			print()
@@ -20,16 +20,10 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 from .BaseAction import BaseAction
-from .FlashForgeProtocol import FlashForgeProtocol
-from .PrinterURI import PrinterProtocol, PrinterURI
+from .PrinterBroker import PrinterBroker
 
 class ActionGerberCommand(BaseAction):
-	def _run_command(self, command):
-		uri = PrinterURI.parse(self._args.uri)
-		if uri.protocol == PrinterProtocol.FlashForge:
-			with FlashForgeProtocol.connect_to_machine(uri.host, port = uri.port, default_timeout = self._args.timeout) as conn:
-				print(conn.tx_rx(command))
-
 	def run(self):
-		for command in self._args.commands:
-			self._run_command(command)
+		with PrinterBroker.connect_to_printer(self._args.uri, broker_socket = self._args.broker, default_timeout = self._args.timeout) as conn:
+			for command in self._args.commands:
+				print(conn.tx_rx(command))
@@ -70,7 +70,7 @@ class ActionModelEstimate(BaseAction):
 		t0 = time.time()
 		with open(self._args.gcode_filename) as f:
 			self._gcode = f.read()
-		self._reference_plot = self._create_yxplot(BenchmarkingTools.read_benchmark_file(self._args.benchmark_filename))
+		self._reference_plot = self._create_yxplot(BenchmarkingTools.read_benchmark(self._args.benchmark_filename, printer = self._args.printer))
 
 		bounds = tuple((param.minvalue, param.maxvalue) for param in GCodeSpeedHook.ModelParameters)
 		result = scipy.optimize.differential_evolution(self._objective, bounds)
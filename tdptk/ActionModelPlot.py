@@ -63,7 +63,7 @@ class ActionModelPlot(BaseAction):
 	def run(self):
 		with open(self._args.gcode_filename) as f:
 			self._gcode = f.read()
-		self._reference_plot = BenchmarkingTools.read_benchmark_file(self._args.benchmark_filename)
+		self._reference_plot = BenchmarkingTools.read_benchmark(self._args.benchmark_filename, printer = self._args.printer)
 		if self._args.model is None:
 			model = { }
 		else:
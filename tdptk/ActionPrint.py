@@ -20,20 +20,53 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import os
+import sys
+import time
+import mmap
 from .BaseAction import BaseAction
 from .PrinterURI import PrinterURI, PrinterProtocol
-from .FlashForgeProtocol import FlashForgeProtocol
+from .FlashForgeProtocol import FlashForgeProtocol, UploadCheckpoint
+from .ReceiveBuffer import ReceiveBufferException
 
 class ActionPrint(BaseAction):
+	_BACKOFF_INITIAL_SECS = 1
+	_BACKOFF_MAX_SECS = 30
+
+	def _print_flashforge(self, uri, checkpoint):
+		with FlashForgeProtocol.connect_to_machine(uri.host, port = uri.port) as conn:
+			if not checkpoint.stored:
+				upload = conn.send_file(checkpoint.filename, checkpoint.content, window = self._args.window, checkpoint = checkpoint)
+				print("Uploaded %d bytes in %d chunks within %.1f secs: %.1f kiB/sec" % (upload.byte_count, upload.chunk_count, upload.duration_secs, upload.byte_count / 1024 / max(upload.duration_secs, 1e-6)))
+			# Sending M23 again could restart the job, so nothing is retried
+			# from here on
+			checkpoint.mark_print_started()
+			conn.start_print_file(checkpoint.filename)
+
 	def run(self):
 		with open(self._args.input_filename, "rb") as f:
-			data_file_content = f.read()
+			# The mapping outlives the file object and is released together
+			# with the last view into it
+			if os.fstat(f.fileno()).st_size > 0:
+				data_file_content = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+			else:
+				data_file_content = b""
 		filename = os.path.basename(self._args.input_filename)
 
 		uri = PrinterURI.parse(self._args.printer_uri)
 		if uri.protocol == PrinterProtocol.FlashForge:
-			with FlashForgeProtocol.connect_to_machine(uri.host, port = uri.port) as conn:
-				conn.send_file(filename, data_file_content)
-				conn.start_print_file(filename)
+			checkpoint = UploadCheckpoint(filename, data_file_content)
+			for retry in range(self._args.retries + 1):
+				try:
+					self._print_flashforge(uri, checkpoint)
+					break
+				except (ReceiveBufferException, OSError) as e:
+					if checkpoint.print_started:
+						print("Connection to printer lost (%s: %s) after the print of %s was started; check the printer, not retrying." % (e.__class__.__name__, str(e), checkpoint.filename))
+						sys.exit(1)
+					if retry == self._args.retries:
+						raise
+					backoff = min(self._BACKOFF_INITIAL_SECS * (2 ** retry), self._BACKOFF_MAX_SECS)
+					print("Connection to printer lost (%s: %s) at %s. Reconnecting in %d secs, retry %d of %d." % (e.__class__.__name__, str(e), str(checkpoint), backoff, retry + 1, self._args.retries))
+					time.sleep(backoff)
 		else:
 			raise NotImplementedError("Printing not implemented on '%s' protocol printer." % (uri.protocol.name))
@@ -22,8 +22,7 @@
 import time
 import json
 from .BaseAction import BaseAction
-from .FlashForgeProtocol import FlashForgeProtocol
-from .PrinterURI import PrinterProtocol, PrinterURI
+from .PrinterBroker import PrinterBroker
 
 class ActionPrinterCommand(BaseAction):
 	def _run_command(self, command):
@@ -46,8 +45,8 @@ class ActionPrinterCommand(BaseAction):
 				pos = self._conn.get_current_position()
 				t = time.time()
 				trel = t - t0
-				data = { "t": t, "trel": trel, "A": pos["A"] }
-				print("%.3f: %.3f" % (trel, pos["A"]))
+				data = { "t": t, "trel": trel, "A": pos.a }
+				print("%.3f: %.3f" % (trel, pos.a))
 				with open("benchmark.txt", "a") as f:
 					print(json.dumps(data), file = f)
 				time.sleep(1)
@@ -59,8 +58,6 @@ class ActionPrinterCommand(BaseAction):
 			self._run_command(command)
 
 	def run(self):
-		uri = PrinterURI.parse(self._args.uri)
-		if uri.protocol == PrinterProtocol.FlashForge:
-			with FlashForgeProtocol.connect_to_machine(uri.host, port = uri.port, default_timeout = self._args.timeout) as conn:
-				self._conn = conn
-				self._run_commands(self._args.commands)
+		with PrinterBroker.connect_to_printer(self._args.uri, broker_socket = self._args.broker, default_timeout = self._args.timeout) as conn:
+			self._conn = conn
+			self._run_commands(self._args.commands)
@@ -19,20 +19,51 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import sys
+import asyncio
 from .BaseAction import BaseAction
-from .FlashForgeProtocol import FlashForgeProtocol
-from .PrinterURI import PrinterProtocol, PrinterURI
+from .PrinterBroker import PrinterBroker
 
 class ActionPrinterStatus(BaseAction):
-	def _run_uri(self, uri_str):
-		uri = PrinterURI.parse(uri_str)
-		if uri.protocol == PrinterProtocol.FlashForge:
-			with FlashForgeProtocol.connect_to_machine(uri.host, port = uri.port) as conn:
-				print(conn.get_machine_information())
-				print(conn.get_machine_status())
+	async def _query(self, uri_str):
+		conn = await PrinterBroker.async_connect_to_printer(uri_str, broker_socket = self._args.broker, default_timeout = self._args.timeout, log_traffic = self._args.verbose >= 1)
+		async with conn:
+			information = await conn.get_machine_information()
+			status = await conn.get_machine_status()
+		return (information, status)
 
-	def run(self):
-		for uri_str in self._args.uri:
+	async def _query_uri(self, uri_str, semaphore):
+		# The deadline only starts once a connection slot is free
+		async with semaphore:
+			try:
+				result = await asyncio.wait_for(self._query(uri_str), timeout = self._args.deadline)
+				return (uri_str, result, None)
+			except asyncio.TimeoutError:
+				return (uri_str, None, "no response within %.1f secs" % (self._args.deadline))
+			except Exception as e:
+				# Anything a single printer does wrong, including an invalid
+				# URI, is reported for that printer only
+				return (uri_str, None, "%s: %s" % (e.__class__.__name__, str(e)))
+
+	async def _run(self):
+		semaphore = asyncio.Semaphore(self._args.concurrency)
+		failed = 0
+		for query in asyncio.as_completed([ self._query_uri(uri_str, semaphore) for uri_str in self._args.uri ]):
+			(uri_str, result, error) = await query
 			print("%s" % (uri_str))
-			self._run_uri(uri_str)
+			if error is None:
+				(information, status) = result
+				print(information)
+				print(status.progress)
+				print(status.temperatures)
+				print(status.state)
+			else:
+				print("Error: %s" % (error))
+				failed += 1
 			print()
+		return failed
+
+	def run(self):
+		failed = asyncio.run(self._run())
+		if failed > 0:
+			sys.exit(1)
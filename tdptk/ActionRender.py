@@ -22,47 +22,67 @@
 import os
 import sys
 from .BaseAction import BaseAction
-from .XGCodeFile import XGCodeFile
-from .GCodeInterpreter import GCodeBaseInterpreter, GCodeParser, GCodeInformationHook, GCodePOVRayHook
-from .POVRayRenderer import POVRayRenderer, POVRayStyle
-from .STLFile import STLFile
+from .POVRayRenderer import POVRayRenderer, POVRayStyle, POVRayMode
+from .POVRayGeometryCache import POVRayGeometryCache
+from .SceneGenerator import SceneGenerator
+from .GCodeInterpreter import GCodeLayerWindow
+from .MeshDecimation import MeshDecimationMode
 
 class ActionRender(BaseAction):
 	def run(self):
+		povray_renderer = POVRayRenderer(width = self._args.dimensions[0], height = self._args.dimensions[1], oversample_factor = self._args.oversample, style = POVRayStyle(self._args.style), mode = POVRayMode(self._args.mode), views = self._args.views, verbosity = self._args.verbose)
 		if not self._args.force:
-			if os.path.exists(self._args.output_filename):
-				print("Refusing to overwrite: %s" % (self._args.output_filename))
-				sys.exit(1)
+			if self._args.output_filename.endswith(".pov"):
+				output_filenames = [ self._args.output_filename ]
+			else:
+				output_filenames = [ povray_renderer.view_filename(self._args.output_filename, view) for view in povray_renderer.views ]
+			for output_filename in output_filenames:
+				if os.path.exists(output_filename):
+					print("Refusing to overwrite: %s" % (output_filename))
+					sys.exit(1)
 
-		if self._args.filetype == "auto":
-			filetype = os.path.splitext(self._args.input_filename)[1][1:]
+		if self._args.lod:
+			lod_resolution = round(max(self._args.dimensions) * self._args.oversample)
 		else:
-			filetype = self._args.filetype
-
-		if filetype == "gx":
-			xgcode = XGCodeFile.read(self._args.input_filename)
-			gcode_data = xgcode.gcode_data.decode("ascii")
-		elif filetype == "g":
-			with open(self._args.input_filename) as f:
-				gcode_data = f.read()
-		elif filetype == "stl":
-			stl = STLFile.read(self._args.input_filename)
+			lod_resolution = None
+		if self._args.cull:
+			# Culling removes what is hidden from the isometric camera and would
+			# leave holes in the geometry when it is seen from any other angle
+			iso_location = POVRayRenderer.isometric_view().location
+			if any(view.location != iso_location for view in povray_renderer.views):
+				print("--cull can only be used with the isometric view.")
+				sys.exit(1)
+			cull_resolution = round(max(self._args.dimensions) * self._args.oversample)
 		else:
-			raise NotImplementedError("Unknown input file type: %s" % (filetype))
-
-		povray_renderer = POVRayRenderer(width = self._args.dimensions[0], height = self._args.dimensions[1], oversample_factor = self._args.oversample, style = POVRayStyle(self._args.style), verbosity = self._args.verbose)
-		if filetype in [ "gx", "g" ]:
-			info = GCodeInformationHook()
-			parser = GCodeParser(GCodeBaseInterpreter(hooks = [ info, GCodePOVRayHook(povray_renderer, info) ]))
-			parser.parse_all(gcode_data)
-		elif filetype == "stl":
-			for triangle in stl:
-				povray_renderer.add_triangle((triangle.vertex1_x, triangle.vertex1_y, triangle.vertex1_z), (triangle.vertex2_x, triangle.vertex2_y, triangle.vertex2_z), (triangle.vertex3_x, triangle.vertex3_y, triangle.vertex3_z))
+			cull_resolution = None
+		if (self._args.layers is not None) or (self._args.z_range is not None):
+			(first_layer, last_layer) = self._args.layers or (None, None)
+			(min_z, max_z) = self._args.z_range or (None, None)
+			layer_window = GCodeLayerWindow(first_layer = first_layer, last_layer = last_layer, min_z = min_z, max_z = max_z)
 		else:
-			raise NotImplementedError("Unknown input file type: %s" % (filetype))
+			layer_window = None
+		if self._args.decimate == "none":
+			(decimation_mode, facet_budget) = (None, None)
+		else:
+			# About one facet per output pixel, half of them face away
+			decimation_mode = MeshDecimationMode(self._args.decimate)
+			facet_budget = round(self._args.dimensions[0] * self._args.dimensions[1] * (self._args.oversample ** 2) / 2)
+		scene = SceneGenerator(self._args.input_filename, filetype = self._args.filetype, lod_resolution = lod_resolution, cull_resolution = cull_resolution, layer_window = layer_window, smooth_normals = self._args.smooth, decimation_mode = decimation_mode, facet_budget = facet_budget, verbosity = self._args.verbose)
 
 		if self._args.output_filename.endswith(".pov"):
+			scene.add_geometry(povray_renderer)
 			with open(self._args.output_filename, "w") as f:
 				f.write(povray_renderer.render_source())
+			return
+
+		if self._args.no_cache:
+			scene.add_geometry(povray_renderer)
+			geometry_include = None
 		else:
-			povray_renderer.render_image(self._args.output_filename, additional_povray_options = self._args.povray, show_image = self._args.show, trim_image = not self._args.no_trim)
+			cache = POVRayGeometryCache(cache_dir = self._args.cache_dir, verbosity = self._args.verbose)
+			geometry_include = scene.geometry_include(povray_renderer, cache)
+
+		strips = self._args.strips
+		if (self._args.strip_slots is not None) and (strips == 1):
+			strips = len(self._args.strip_slots)
+		povray_renderer.render_image(self._args.output_filename, additional_povray_options = self._args.povray, show_image = self._args.show, trim_image = not self._args.no_trim, geometry_include = geometry_include, strips = strips, strip_slots = self._args.strip_slots)
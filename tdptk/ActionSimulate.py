@@ -0,0 +1,34 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import asyncio
+from .BaseAction import BaseAction
+from .FlashForgeSimulator import FlashForgeSimulator
+
+class ActionSimulate(BaseAction):
+	def run(self):
+		(host, port) = self._args.listen
+		bandwidth = (self._args.bandwidth * 1024) if (self._args.bandwidth is not None) else None
+		simulator = FlashForgeSimulator(host = host, port = port, latency = self._args.latency, bandwidth = bandwidth, ack_delay = self._args.ack_delay, ack_mode = self._args.ack_mode, loss = self._args.loss, disconnect = self._args.disconnect, print_duration = self._args.print_duration, seed = self._args.seed, verbosity = self._args.verbose + 1)
+		try:
+			asyncio.run(simulator.serve())
+		except KeyboardInterrupt:
+			pass
@@ -0,0 +1,35 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import asyncio
+import collections
+from .BaseAction import BaseAction
+from .TelemetryPoller import TelemetryPoller
+
+class ActionTelemetry(BaseAction):
+	def run(self):
+		intervals = collections.OrderedDict()
+		for series in TelemetryPoller.SERIES:
+			interval = getattr(self._args, series + "_interval")
+			if interval > 0:
+				intervals[series] = interval
+		poller = TelemetryPoller(self._args.output_directory, self._args.uri, intervals, broker_socket = self._args.broker, default_timeout = self._args.timeout, verbosity = self._args.verbose)
+		asyncio.run(poller.run())
@@ -19,29 +19,55 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
 import json
+from .TelemetryStore import TelemetryStore
+from .Exceptions import TelemetryException
 
 class BenchmarkingTools():
 	@classmethod
-	def read_benchmark_file(cls, filename):
+	def _extract_run(cls, samples):
+		# Keeps the samples from the first one with a positive extruder
+		# position up to the one before it returns to zero
 		points = {
 			"x": [ ],
 			"y": [ ],
 		}
-		with open(filename) as f:
-			filestate = "pre_data"
-			for line in f:
-				line = json.loads(line)
-				(x, y) = (line["trel"], line["A"])
+		filestate = "pre_data"
+		for (x, y) in samples:
+			if (filestate == "pre_data") and (y > 0):
+				filestate = "data"
 
-				if (filestate == "pre_data") and (y > 0):
-					filestate = "data"
+			if (filestate == "data") and (y == 0):
+				break
 
-				if (filestate == "data") and (y == 0):
-					break
+			if filestate == "data":
+				points["x"].append(x)
+				points["y"].append(y)
+		return points
+
+	@classmethod
+	def read_benchmark_file(cls, filename):
+		with open(filename) as f:
+			samples = ((line["trel"], line["A"]) for line in map(json.loads, f))
+			return cls._extract_run(samples)
 
-				if filestate == "data":
-					points["x"].append(x)
-					points["y"].append(y)
-			return points
+	@classmethod
+	def read_telemetry(cls, directory, printer = None, t_from = None, t_to = None):
+		store = TelemetryStore(directory)
+		if printer is None:
+			printers = store.printers
+			if len(printers) != 1:
+				raise TelemetryException("Telemetry of %d printers in %s, need to choose one of: %s" % (len(printers), directory, ", ".join(printers)))
+			printer = printers[0]
+		position = store.query(printer, "position", t_from = t_from, t_to = t_to)
+		trel = position["t"] - position["t"][0] if (len(position["t"]) > 0) else position["t"]
+		return cls._extract_run(zip(trel.tolist(), position["a"].tolist()))
 
+	@classmethod
+	def read_benchmark(cls, path, printer = None):
+		# Either a JSON benchmark file or a telemetry directory
+		if os.path.isdir(path):
+			return cls.read_telemetry(path, printer = printer)
+		else:
+			return cls.read_benchmark_file(path)
@@ -22,6 +22,12 @@
 class TDPTKException(Exception): pass
 class CannotDetermineFiletypeException(TDPTKException): pass
 class PrinterCommunicationException(TDPTKException): pass
+class PrinterBrokerException(PrinterCommunicationException): pass
 
 class GcodeException(TDPTKException): pass
 class MalformedGcodeException(GcodeException): pass
+
+class STLException(TDPTKException): pass
+class MalformedSTLException(STLException): pass
+
+class TelemetryException(TDPTKException): pass
@@ -20,207 +20,367 @@
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
 import re
+import time
 import socket
+import asyncio
 import collections
 import zlib
-from .MultiRegex import MultiRegex
-from .ReceiveBuffer import ReceiveBuffer
+from .ReceiveBuffer import ReceiveBufferException, ReceiveBufferProtocol
 from .Exceptions import PrinterCommunicationException
 from .NamedStruct import NamedStruct
+from .FlashForgeResponses import FlashForgeResponses, MachineStatus
 
-PrintProgress = collections.namedtuple("PrintProgress", [ "progress", "total" ])
+UploadStatistics = collections.namedtuple("UploadStatistics", [ "byte_count", "chunk_count", "duration_secs", "window" ])
 
 class FlashForgeCommunicationException(PrinterCommunicationException): pass
 
 class GCodeChunk():
 	_CHUNK_MAGIC = 0x5a5aa5a5
+	CHUNK_SIZE = 4096
+	_PADDING = memoryview(bytes(CHUNK_SIZE))
 
-	ChunkFrame = NamedStruct((
+	ChunkHeader = NamedStruct((
 		("L",		"magic"),
 		("L",		"index"),
 		("L",		"length"),
 		("L",		"crc"),
-		("4096s",	"data"),
 	), struct_extra = ">")
 
-	def __init__(self, chunk_index, chunk_data):
+	def __init__(self, chunk_index, chunk_data, crc = None):
 		self._index = chunk_index
 		self._data = chunk_data
+		self._crc = crc if (crc is not None) else zlib.crc32(chunk_data)
 
-	def __bytes__(self):
-		data = {
-			"magic":	self._CHUNK_MAGIC,
-			"index":	self._index,
-			"length":	len(self._data),
-			"crc":		zlib.crc32(self._data),
-			"data":		self._data,
-		}
-		return self.ChunkFrame.pack(data)
+	@classmethod
+	def frame(cls, header_buffer, chunk_index, chunk_data, crc):
+		# Returns the frame as a list of buffers: the header packed into the
+		# given, reusable buffer, the unmodified chunk data and zero padding
+		# up to the full chunk size
+		cls.ChunkHeader.pack_into(header_buffer, 0, (cls._CHUNK_MAGIC, chunk_index, len(chunk_data), crc))
+		return [ header_buffer, chunk_data, cls._PADDING[len(chunk_data):] ]
 
-class FlashForgeProtocol():
-	_MachineInformation = collections.namedtuple("MachineInformation", [ "machine_type", "machine_name", "firmware", "serial_number", "dimension_x", "dimension_y", "dimension_z", "tool_count", "mac_address" ])
-	_M27Regex = re.compile(r"SD printing byte (?P<progress>\d+)/(?P<total>\d+)")
-	_M115Regex = MultiRegex(collections.OrderedDict((
-		("m115_xyz", re.compile(r"X: (?P<x>\d+) Y: (?P<y>\d+) Z: (?P<z>\d+)")),
-		("m115_int", re.compile(r"(?P<key>Tool Count): (?P<value>\d+)")),
-		("m115_string", re.compile(r"(?P<key>[^:]+): (?P<value>.*)")),
-		("m115_unknown", re.compile(r".*")),
-	)))
-
-	def __init__(self, conn, default_timeout = 1.0):
-		self._conn = conn
+	def __bytes__(self):
+		return b"".join(self.frame(bytearray(self.ChunkHeader.size), self._index, self._data, self._crc))
+
+class UploadCheckpoint():
+	# Records how far an upload got so that it can be retried over a new
+	# connection. M28 always recreates the file on the printer, so an
+	# interrupted transfer restarts at chunk 0; only a file that was
+	# completely stored is never uploaded again. Content may be any buffer
+	# (e.g., an mmap), chunks are views into it and never copied.
+	def __init__(self, filename, content, chunk_size = GCodeChunk.CHUNK_SIZE):
+		self._filename = filename
+		self._content = memoryview(content).cast("B")
+		self._chunk_size = chunk_size
+		self._crcs = [ None ] * self.chunk_count
+		self._acknowledged_chunks = 0
+		self._stored = False
+		self._print_started = False
+		self._attempts = 0
+
+	@property
+	def filename(self):
+		return self._filename
+
+	@property
+	def content(self):
+		return self._content
+
+	@property
+	def chunk_count(self):
+		return (len(self._content) + self._chunk_size - 1) // self._chunk_size
+
+	@property
+	def acknowledged_chunks(self):
+		return self._acknowledged_chunks
+
+	@acknowledged_chunks.setter
+	def acknowledged_chunks(self, value):
+		assert(0 <= value <= self.chunk_count)
+		self._acknowledged_chunks = value
+
+	@property
+	def stored(self):
+		return self._stored
+
+	@property
+	def print_started(self):
+		return self._print_started
+
+	@property
+	def attempts(self):
+		return self._attempts
+
+	def chunk_data(self, index):
+		return self._content[self._chunk_size * index : self._chunk_size * (index + 1)]
+
+	def chunk_crc(self, index):
+		# Computed on first transmission, retries reuse it
+		if self._crcs[index] is None:
+			self._crcs[index] = zlib.crc32(self.chunk_data(index))
+		return self._crcs[index]
+
+	def begin_attempt(self):
+		self._attempts += 1
+		self._acknowledged_chunks = 0
+
+	def mark_stored(self):
+		self._acknowledged_chunks = self.chunk_count
+		self._stored = True
+
+	def mark_print_started(self):
+		self._print_started = True
+
+	def __str__(self):
+		return "%s: %d of %d chunks acknowledged%s%s" % (self._filename, self._acknowledged_chunks, self.chunk_count, ", stored" if self._stored else "", ", print started" if self._print_started else "")
+
+class AsyncFlashForgeProtocol():
+	_ChunkAckRegex = re.compile(r"ok(\s+N?(?P<index>\d+))?.*")
+
+	def __init__(self, stream, default_timeout = 1.0, log_traffic = True):
+		self._stream = stream
 		self._default_timeout = default_timeout
-		self._rxbuf = ReceiveBuffer.create_for_socket(self._conn)
+		self._log_traffic = log_traffic
+		# Cleared while a command awaits its response, so that an
+		# interrupted command is not mistaken for the next one's response
+		self._synchronized = True
 
 	@classmethod
-	def connect_to_machine(cls, hostname, port = 8899, default_timeout = 1.0):
-		conn = socket.create_connection((hostname, port), timeout = default_timeout)
-		return cls(conn = conn, default_timeout = default_timeout)
+	async def connect_to_machine(cls, hostname, port = 8899, default_timeout = 1.0, log_traffic = True):
+		(transport, stream) = await asyncio.wait_for(asyncio.get_running_loop().create_connection(ReceiveBufferProtocol, hostname, port), timeout = default_timeout)
+		return cls(stream, default_timeout = default_timeout, log_traffic = log_traffic)
+
+	@classmethod
+	async def from_socket(cls, conn, default_timeout = 1.0, log_traffic = True):
+		(transport, stream) = await asyncio.get_running_loop().create_connection(ReceiveBufferProtocol, sock = conn)
+		return cls(stream, default_timeout = default_timeout, log_traffic = log_traffic)
+
+	@property
+	def connected(self):
+		return self._stream.connected
+
+	def _log(self, direction, text):
+		if self._log_traffic:
+			print("%s %s" % (direction, text))
+
+	async def _readline(self, timeout = None):
+		# Timeouts are measured on the monotonic clock of the event loop
+		if timeout is None:
+			timeout = self._default_timeout
+		line = await self._stream.readline(timeout)
+		# Garbage on the line is left to the response parsers to reject
+		return line.decode("utf-8", errors = "replace")
 
-	def tx_rx(self, cmd, timeout = None):
+	async def _drain(self, timeout = None):
 		if timeout is None:
 			timeout = self._default_timeout
-		print("-> %s" % (cmd))
+		try:
+			await asyncio.wait_for(self._stream.drain(), timeout = timeout)
+		except asyncio.TimeoutError:
+			raise TimeoutError("Printer did not accept data within %.3f secs." % (timeout))
+
+	async def tx_rx(self, cmd, timeout = None):
+		self._log("->", cmd)
 		text_cmd = "~" + cmd + "\r\n"
 		binary_cmd = text_cmd.encode("ascii")
-		self._conn.send(binary_cmd)
+		self._synchronized = False
+		self._stream.write(binary_cmd)
+		await self._drain()
 
 		response_lines = [ ]
 		while True:
-			response_line = self._rxbuf.waitline(timeout = timeout).decode("utf-8")
-			print("<- %s" % (response_line))
+			response_line = await self._readline(timeout = timeout)
+			self._log("<-", response_line)
 			if response_line == "ok":
+				self._synchronized = True
 				return response_lines
 			response_lines.append(response_line)
 
-	def tx_rx_binary(self, binary_cmd, timeout = None):
-		print("-> %s" % (str(binary_cmd)))
-		self._conn.send(binary_cmd)
-		response_line = self._rxbuf.waitline(timeout = timeout).decode("utf-8")
-		print("<- %s" % (response_line))
+	async def tx_rx_binary(self, binary_cmd, timeout = None):
+		self._log("->", str(binary_cmd))
+		self._synchronized = False
+		self._stream.write(binary_cmd)
+		await self._drain()
+		response_line = await self._readline(timeout = timeout)
+		self._log("<-", response_line)
+		self._synchronized = True
 		return response_line
 
-	def start_communication(self):
-		response = self.tx_rx("M601 S1")
+	async def start_communication(self):
+		response = await self.tx_rx("M601 S1")
 		if response != [ "CMD M601 Received.", "Control Success." ]:
 			raise FlashForgeCommunicationException("Failed to take control of printer.")
 
-	def end_communication(self):
-		response = self.tx_rx("M602")
+	async def end_communication(self):
+		response = await self.tx_rx("M602")
 		if response != [ "CMD M602 Received.", "Control Release." ]:
 			raise FlashForgeCommunicationException("Failed to release control of printer.")
 
-	def set_led_color(self, r, g, b):
+	async def set_led_color(self, r, g, b):
 		assert(0 <= r <= 255)
 		assert(0 <= g <= 255)
 		assert(0 <= b <= 255)
-		self.tx_rx("M146 r%d g%d b%d F0" % (r, g, b))
+		await self.tx_rx("M146 r%d g%d b%d F0" % (r, g, b))
 
-	def set_led_status(self, on_off):
+	async def set_led_status(self, on_off):
 		if on_off:
-			self.set_led_color(255, 0, 0)
+			await self.set_led_color(255, 0, 0)
 		else:
-			self.set_led_color(0, 0, 0)
-
-	def get_machine_information(self):
-		class MachineInformationCallback():
-			_KEY_MAP = {
-				"Machine Type":		"machine_type",
-				"Machine Name":		"machine_name",
-				"Firmware":			"firmware",
-				"SN":				"serial_number",
-				"X":				"dimension_x",
-				"Y":				"dimension_y",
-				"Z":				"dimension_z",
-				"Tool Count":		"tool_count",
-				"Mac Address":		"mac_address",
-			}
-
-			def __init__(self):
-				self._values = { }
-
-			def _set(self, key, value):
-				key = self._KEY_MAP.get(key, key)
-				self._values[key] = value
-
-			@property
-			def values(self):
-				return self._values
-
-			def _match_m115_xyz(self, line, name, match):
-				self._set("X", int(match["x"]))
-				self._set("Y", int(match["y"]))
-				self._set("Z", int(match["z"]))
-
-			def _match_m115_string(self, line, name, match):
-				self._set(match["key"], match["value"])
-
-			def _match_m115_int(self, line, name, match):
-				self._set(match["key"], int(match["value"]))
-
-			def _match_m115_unknown(self, line, name, match):
-				print("Warning: M115 command not understood: '%s'" % (line))
-
-		mic = MachineInformationCallback()
-		for line in self.tx_rx("M115")[1:]:
-			line = line.rstrip("\r\n")
-			self._M115Regex.fullmatch(line, mic, groupdict = True)
-
-		return self._MachineInformation(**mic.values)
-
-	def get_machine_progress(self):
-		print_progress = self.tx_rx("M27")
-		match = self._M27Regex.fullmatch(print_progress[1])
-		if match is None:
-			raise FlashForgeCommunicationException("M27 yielded unexpected response: %s" % (str(print_progress)))
-		return PrintProgress(**{ key: int(value) for (key, value) in match.groupdict().items() })
-
-	def get_machine_status(self):
-		print_progress = self.tx_rx("M27")
-		print(self.tx_rx("M119"))
-		self.tx_rx("M105")
-
-	def get_current_position(self):
-		response = self.tx_rx("M114")
-		axes = response[1].split()
-		result = { }
-		for axis_value in axes:
-			(axis, value) = axis_value.split(":", maxsplit = 1)
-			value = float(value)
-			result[axis] = value
-		return result
-
-	def move_home(self):
-		self.tx_rx("G28")
-
-	def send_file(self, filename, content):
-		self.tx_rx("M28 %d 0:/user/%s" % (len(content), filename))
-		chunk_size = 4096
-		for chunk_index in range((len(content) + chunk_size - 1) // chunk_size):
-			chunk_data = content[chunk_size * chunk_index : chunk_size * (chunk_index + 1)]
-			chunk = GCodeChunk(chunk_index, chunk_data)
-			self.tx_rx_binary(bytes(chunk))
-		self.tx_rx("M29")
-
-	def start_print_file(self, filename):
-		self.tx_rx("M23 0:/user/%s" % (filename))
-
-	def resume_print(self):
-		self.tx_rx("M24")
-
-	def pause_print(self):
-		self.tx_rx("M25")
-
-	def cancel_print(self):
-		self.tx_rx("M26")
+			await self.set_led_color(0, 0, 0)
+
+	async def get_machine_information(self):
+		return FlashForgeResponses.parse_machine_information((await self.tx_rx("M115"))[1:])
+
+	async def get_machine_progress(self):
+		return FlashForgeResponses.parse_progress((await self.tx_rx("M27"))[1:])
+
+	async def get_temperatures(self):
+		return FlashForgeResponses.parse_temperatures((await self.tx_rx("M105"))[1:])
+
+	async def get_machine_state(self):
+		return FlashForgeResponses.parse_machine_state((await self.tx_rx("M119"))[1:])
+
+	async def get_current_position(self):
+		return FlashForgeResponses.parse_position((await self.tx_rx("M114"))[1:])
+
+	async def get_machine_status(self):
+		return MachineStatus(progress = await self.get_machine_progress(), temperatures = await self.get_temperatures(), state = await self.get_machine_state())
+
+	async def move_home(self):
+		await self.tx_rx("G28")
+
+	async def _wait_chunk_ack(self, in_flight, timeout):
+		# Acknowledgements that carry a chunk index are matched against it
+		# and acknowledge all chunks up to that index. Others, as well as
+		# unexpected responses, acknowledge the oldest chunk in flight like
+		# in stop-and-wait mode; returns if the chunk index was matched.
+		response_line = await self._readline(timeout = timeout)
+		match = self._ChunkAckRegex.fullmatch(response_line)
+		if (match is not None) and (match["index"] is not None) and (int(match["index"]) in in_flight):
+			acked_index = int(match["index"])
+			while (len(in_flight) > 0) and (in_flight[0] <= acked_index):
+				in_flight.popleft()
+			return True
+		if (match is None) or (match["index"] is not None):
+			print("Warning: unexpected response to chunk %d: %s" % (in_flight[0], response_line))
+		in_flight.popleft()
+		return False
+
+	async def send_file(self, filename, content, window = 1, checkpoint = None):
+		# Up to "window" chunks are sent before waiting for their
+		# acknowledgements. Since an acknowledgement that does not name its
+		# chunk cannot tell which chunk it belongs to, the first one makes
+		# the rest of the transfer stop-and-wait. Chunks cannot be sent
+		# again within one M28 transfer, a missing acknowledgement therefore
+		# fails the upload. Progress is recorded in the checkpoint, if one is
+		# given.
+		if checkpoint is None:
+			checkpoint = UploadCheckpoint(filename, content)
+		checkpoint.begin_attempt()
+		t0 = time.monotonic()
+		await self.tx_rx("M28 %d 0:/user/%s" % (len(checkpoint.content), filename))
+		self._synchronized = False
+		chunk_count = checkpoint.chunk_count
+		in_flight = collections.deque()
+		next_index = 0
+
+		# The transport may keep a reference to a header buffer until it has
+		# sent it. A buffer is only reused once its chunk was acknowledged,
+		# which is the case for chunk n - window when chunk n is sent.
+		header_buffers = [ bytearray(GCodeChunk.ChunkHeader.size) for i in range(window) ]
+		while (next_index < chunk_count) or (len(in_flight) > 0):
+			while (next_index < chunk_count) and (len(in_flight) < window):
+				# Written one by one since the transport sends each buffer
+				# right away when nothing is queued, without joining them
+				for buffer in GCodeChunk.frame(header_buffers[next_index % len(header_buffers)], next_index, checkpoint.chunk_data(next_index), checkpoint.chunk_crc(next_index)):
+					self._stream.write(buffer)
+				in_flight.append(next_index)
+				next_index += 1
+			await self._drain()
+			if not await self._wait_chunk_ack(in_flight, timeout = self._default_timeout):
+				if window > 1:
+					print("Warning: printer does not acknowledge chunks by index, continuing stop-and-wait after chunk %d." % (next_index - len(in_flight) - 1))
+					window = 1
+			checkpoint.acknowledged_chunks = next_index - len(in_flight)
+		await self.tx_rx("M29")
+		checkpoint.mark_stored()
+		return UploadStatistics(byte_count = len(checkpoint.content), chunk_count = chunk_count, duration_secs = time.monotonic() - t0, window = window)
+
+	async def start_print_file(self, filename):
+		await self.tx_rx("M23 0:/user/%s" % (filename))
+
+	async def resume_print(self):
+		await self.tx_rx("M24")
+
+	async def pause_print(self):
+		await self.tx_rx("M25")
+
+	async def cancel_print(self):
+		await self.tx_rx("M26")
+
+	async def __aenter__(self):
+		# __aexit__ is not called when taking control fails
+		try:
+			await self.start_communication()
+		except:
+			await self.close()
+			raise
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		try:
+			# Releasing control over a broken connection or after an
+			# interrupted command would only hide the original error behind
+			# another timeout or an unexpected response
+			if self._synchronized and ((exc_type is None) or (not issubclass(exc_type, (ReceiveBufferException, OSError)))):
+				await self.end_communication()
+		finally:
+			await self.close()
+
+	async def close(self):
+		await self._stream.close()
+
+class FlashForgeProtocol():
+	# Blocking interface to AsyncFlashForgeProtocol that runs every call to
+	# completion on a private event loop
+	def __init__(self, conn, default_timeout = 1.0, log_traffic = True):
+		self._loop = asyncio.new_event_loop()
+		try:
+			self._protocol = self._loop.run_until_complete(AsyncFlashForgeProtocol.from_socket(conn, default_timeout = default_timeout, log_traffic = log_traffic))
+		except:
+			self._loop.close()
+			raise
+
+	@classmethod
+	def connect_to_machine(cls, hostname, port = 8899, default_timeout = 1.0, log_traffic = True):
+		conn = socket.create_connection((hostname, port), timeout = default_timeout)
+		return cls(conn = conn, default_timeout = default_timeout, log_traffic = log_traffic)
+
+	def __getattr__(self, name):
+		method = getattr(self._protocol, name)
+		if not asyncio.iscoroutinefunction(method):
+			return method
+		def run_to_completion(*args, **kwargs):
+			return self._loop.run_until_complete(method(*args, **kwargs))
+		return run_to_completion
 
 	def __enter__(self):
-		self.start_communication()
+		# __exit__ is not called when taking control fails, so the transport
+		# and the event loop are closed here
+		try:
+			self.start_communication()
+		except:
+			self.close()
+			raise
 		return self
 
-	def __exit__(self, *args):
-		self.end_communication()
-		self.close()
+	def __exit__(self, exc_type, exc_value, traceback):
+		try:
+			self._loop.run_until_complete(self._protocol.__aexit__(exc_type, exc_value, traceback))
+		finally:
+			self._loop.close()
 
 	def close(self):
-		pass
+		if not self._loop.is_closed():
+			self._loop.run_until_complete(self._protocol.close())
+			self._loop.close()
@@ -0,0 +1,131 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import collections
+from .Exceptions import PrinterCommunicationException
+
+class FlashForgeResponseException(PrinterCommunicationException): pass
+
+MachineInformation = collections.namedtuple("MachineInformation", [ "machine_type", "machine_name", "firmware", "serial_number", "dimension_x", "dimension_y", "dimension_z", "tool_count", "mac_address" ])
+PrintProgress = collections.namedtuple("PrintProgress", [ "progress", "total" ])
+Temperatures = collections.namedtuple("Temperatures", [ "extruder", "extruder_target", "bed", "bed_target" ])
+Position = collections.namedtuple("Position", [ "x", "y", "z", "a", "b" ])
+MachineState = collections.namedtuple("MachineState", [ "machine_status", "move_mode", "endstops", "status", "led", "current_file" ])
+MachineStatus = collections.namedtuple("MachineStatus", [ "progress", "temperatures", "state" ])
+
+class FlashForgeResponses():
+	# Parsers for the response lines of query commands, without the leading
+	# "CMD Mxxx Received." line. Every response type has one regex that
+	# alternates between all line types; the outermost named group that
+	# matched (lastgroup) tells which one it was.
+	_M115_KEYS = {
+		"Machine Type":		"machine_type",
+		"Machine Name":		"machine_name",
+		"Firmware":			"firmware",
+		"SN":				"serial_number",
+		"Tool Count":		"tool_count",
+		"Mac Address":		"mac_address",
+	}
+	_M115Regex = re.compile(r"(?P<xyz>X: (?P<x>\d+) Y: (?P<y>\d+) Z: (?P<z>\d+))|(?P<tool_count>Tool Count: (?P<tool_count_value>\d+))|(?P<string>(?P<key>[^:]+): (?P<value>.*))")
+	_M119Regex = re.compile(r"(?P<endstop>Endstop: (?P<endstop_value>.*))|(?P<machine_status>MachineStatus: (?P<machine_status_value>.*))|(?P<move_mode>MoveMode: (?P<move_mode_value>.*))|(?P<status>Status: (?P<status_value>.*))|(?P<led>LED: (?P<led_value>\d+))|(?P<current_file>CurrentFile: ?(?P<current_file_value>.*))")
+	_FlagRegex = re.compile(r"(?P<name>[^\s:]+):\s*(?P<value>-?\d+)")
+	_M105Regex = re.compile(r"(?P<sensor>T0|B):\s*(?P<current>-?[\d.]+)\s*/\s*(?P<target>-?[\d.]+)")
+	_M114Regex = re.compile(r"(?P<axis>[XYZAB]):\s*(?P<value>-?[\d.]+)")
+	_M27Regex = re.compile(r"SD printing byte (?P<progress>\d+)/(?P<total>\d+)")
+
+	@classmethod
+	def _line(cls, command, lines, index = 0):
+		if len(lines) <= index:
+			raise FlashForgeResponseException("%s yielded unexpected response: %s" % (command, str(lines)))
+		return lines[index]
+
+	@classmethod
+	def parse_machine_information(cls, lines):
+		# M115; lines that are not understood are ignored
+		values = dict.fromkeys(MachineInformation._fields)
+		for line in lines:
+			match = cls._M115Regex.fullmatch(line.rstrip("\r\n"))
+			if match is None:
+				continue
+			if match.lastgroup == "xyz":
+				(values["dimension_x"], values["dimension_y"], values["dimension_z"]) = (int(match["x"]), int(match["y"]), int(match["z"]))
+			elif match.lastgroup == "tool_count":
+				values["tool_count"] = int(match["tool_count_value"])
+			elif match["key"] in cls._M115_KEYS:
+				values[cls._M115_KEYS[match["key"]]] = match["value"]
+		return MachineInformation(**values)
+
+	@classmethod
+	def parse_progress(cls, lines):
+		# M27
+		match = cls._M27Regex.fullmatch(cls._line("M27", lines))
+		if match is None:
+			raise FlashForgeResponseException("M27 yielded unexpected response: %s" % (str(lines)))
+		return PrintProgress(progress = int(match["progress"]), total = int(match["total"]))
+
+	@classmethod
+	def parse_temperatures(cls, lines):
+		# M105
+		readings = { match["sensor"]: (float(match["current"]), float(match["target"])) for match in cls._M105Regex.finditer(cls._line("M105", lines)) }
+		if ("T0" not in readings) or ("B" not in readings):
+			raise FlashForgeResponseException("M105 yielded unexpected response: %s" % (str(lines)))
+		return Temperatures(extruder = readings["T0"][0], extruder_target = readings["T0"][1], bed = readings["B"][0], bed_target = readings["B"][1])
+
+	@classmethod
+	def parse_position(cls, lines):
+		# M114; axes the printer does not report are NaN
+		axes = { match["axis"]: float(match["value"]) for match in cls._M114Regex.finditer(cls._line("M114", lines)) }
+		if len(axes) == 0:
+			raise FlashForgeResponseException("M114 yielded unexpected response: %s" % (str(lines)))
+		return Position(*(axes.get(axis, float("nan")) for axis in "XYZAB"))
+
+	@classmethod
+	def _parse_flags(cls, text):
+		return { match["name"]: int(match["value"]) for match in cls._FlagRegex.finditer(text) }
+
+	@classmethod
+	def parse_machine_state(cls, lines):
+		# M119
+		values = {
+			"machine_status":	None,
+			"move_mode":		None,
+			"endstops":			{ },
+			"status":			{ },
+			"led":				None,
+			"current_file":		None,
+		}
+		for line in lines:
+			match = cls._M119Regex.fullmatch(line)
+			if match is None:
+				continue
+			kind = match.lastgroup
+			if kind == "endstop":
+				values["endstops"] = cls._parse_flags(match["endstop_value"])
+			elif kind == "status":
+				values["status"] = cls._parse_flags(match["status_value"])
+			elif kind == "led":
+				values["led"] = (match["led_value"] != "0")
+			elif kind == "current_file":
+				values["current_file"] = match["current_file_value"] or None
+			else:
+				values[kind] = match[kind + "_value"].strip()
+		return MachineState(**values)
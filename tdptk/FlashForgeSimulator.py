@@ -0,0 +1,261 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import time
+import random
+import asyncio
+import zlib
+from .FlashForgeProtocol import GCodeChunk
+
+class _SimulatorConnection():
+	def __init__(self, reader, writer, bandwidth):
+		self.reader = reader
+		self.writer = writer
+		self._bandwidth = bandwidth
+		self._link_free_at = 0
+		self._responses = asyncio.Queue()
+		self._sender = asyncio.create_task(self._send_responses())
+
+	async def throttle(self, length):
+		# Received data occupies the simulated link for length / bandwidth
+		# seconds; while it is busy, nothing else is read from the socket
+		if self._bandwidth is None:
+			return
+		now = time.monotonic()
+		self._link_free_at = max(self._link_free_at, now) + (length / self._bandwidth)
+		if self._link_free_at > now:
+			await asyncio.sleep(self._link_free_at - now)
+
+	def respond(self, delay, text):
+		# Responses are sent in order, a response is never sent before the
+		# ones queued before it
+		self._responses.put_nowait((time.monotonic() + delay, text))
+
+	async def _send_responses(self):
+		while True:
+			(send_at, text) = await self._responses.get()
+			delay = send_at - time.monotonic()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			if not self.writer.is_closing():
+				self.writer.write(text.encode("utf-8"))
+			self._responses.task_done()
+
+	async def flush(self):
+		# Waits until all queued responses were sent
+		await self._responses.join()
+
+	def close(self):
+		self._sender.cancel()
+		self.writer.close()
+
+class FlashForgeSimulator():
+	# Simulates a FlashForge printer on a TCP port, speaking the same dialect
+	# as FlashForgeProtocol. Network conditions are simulated by delaying
+	# responses ("latency"), additionally delaying chunk acknowledgements
+	# ("ack_delay"), limiting how fast data is received ("bandwidth", bytes
+	# per second), dropping responses ("loss", probability per response)
+	# and closing the connection ("disconnect", probability per received
+	# command or chunk). Uploaded files are checked but only their size is
+	# kept; a print takes print_duration seconds regardless of the file.
+	_COMMAND_RE = re.compile(r"(?P<cmd>[A-Z]\d+)(\s+(?P<args>.*))?")
+	_M28_RE = re.compile(r"(?P<size>\d+)\s+0:/user/(?P<filename>.+)")
+
+	def __init__(self, host = "127.0.0.1", port = 8899, latency = 0, bandwidth = None, ack_delay = 0, ack_mode = "index", loss = 0, disconnect = 0, print_duration = 600, seed = None, verbosity = 0):
+		assert(ack_mode in [ "index", "plain" ])
+		self._host = host
+		self._port = port
+		self._latency = latency
+		self._bandwidth = bandwidth
+		self._ack_delay = ack_delay
+		self._ack_mode = ack_mode
+		self._loss = loss
+		self._disconnect = disconnect
+		self._print_duration = print_duration
+		self._random = random.Random(seed)
+		self._verbosity = verbosity
+		self._files = { }
+		self._job = None
+		self._led = True
+
+	@property
+	def port(self):
+		return self._port
+
+	def _lost(self):
+		return (self._loss > 0) and (self._random.random() < self._loss)
+
+	def _disconnected(self, conn):
+		if (self._disconnect > 0) and (self._random.random() < self._disconnect):
+			if self._verbosity >= 1:
+				print("Simulating disconnect")
+			conn.writer.transport.abort()
+			return True
+		return False
+
+	def _respond_later(self, conn, delay, text):
+		if self._lost():
+			if self._verbosity >= 1:
+				print("Simulating lost response: %s" % (text.strip()))
+			return
+		conn.respond(delay, text)
+
+	def _job_progress(self):
+		# Fraction of the current print job that is done
+		if self._job is None:
+			return 0
+		elapsed = self._job["elapsed"]
+		if self._job["resumed_at"] is not None:
+			elapsed += time.monotonic() - self._job["resumed_at"]
+		return min(1, elapsed / self._print_duration) if (self._print_duration > 0) else 1
+
+	def _machine_status(self):
+		if self._job is None:
+			return "READY"
+		elif self._job_progress() >= 1:
+			return "BUILDING_COMPLETED"
+		elif self._job["resumed_at"] is None:
+			return "PAUSED"
+		else:
+			return "BUILDING_FROM_SD"
+
+	def _set_running(self, running):
+		if self._job is None:
+			return
+		if running and (self._job["resumed_at"] is None):
+			self._job["resumed_at"] = time.monotonic()
+		elif (not running) and (self._job["resumed_at"] is not None):
+			self._job["elapsed"] += time.monotonic() - self._job["resumed_at"]
+			self._job["resumed_at"] = None
+
+	def _execute(self, conn, cmd, args):
+		# Returns the response lines between the command echo and "ok"
+		if cmd == "M601":
+			return [ "Control Success." ]
+		elif cmd == "M602":
+			return [ "Control Release." ]
+		elif cmd == "M115":
+			return [ "Machine Type: Flashforge Simulator", "Machine Name: Simulator", "Firmware: v0.0.0", "SN: SIM%05d" % (self._port), "X: 150 Y: 150 Z: 150", "Tool Count: 1", "Mac Address: 00:00:00:00:00:00", "" ]
+		elif cmd == "M27":
+			size = self._job["size"] if (self._job is not None) else 0
+			return [ "SD printing byte %d/%d" % (round(self._job_progress() * size), size) ]
+		elif cmd == "M105":
+			if self._machine_status() in [ "BUILDING_FROM_SD", "PAUSED" ]:
+				return [ "T0:210 /210 B:60 /60" ]
+			else:
+				return [ "T0:25 /0 B:24 /0" ]
+		elif cmd == "M114":
+			progress = self._job_progress()
+			return [ "X:%.2f Y:%.2f Z:%.2f A:%.2f B:0" % (75, 75, 50 * progress, 1000 * progress) ]
+		elif cmd == "M119":
+			status = self._machine_status()
+			return [ "Endstop: X-max:0 Y-max:0 Z-min:%d" % (status == "READY"), "MachineStatus: %s" % (status), "MoveMode: %s" % ("MOVING" if (status == "BUILDING_FROM_SD") else "READY"), "Status: S:1 L:0 J:0 F:0", "LED: %d" % (self._led), "CurrentFile: %s" % (self._job["filename"] if (self._job is not None) else "") ]
+		elif cmd == "M146":
+			self._led = not args.startswith("r0 g0 b0")
+			return [ ]
+		elif cmd == "M23":
+			filename = args.split("0:/user/", maxsplit = 1)[-1]
+			if filename not in self._files:
+				return [ "open failed, File: %s" % (filename) ]
+			self._job = { "filename": filename, "size": self._files[filename], "elapsed": 0, "resumed_at": time.monotonic() }
+			return [ "File opened: %s Size: %d" % (filename, self._files[filename]), "File selected" ]
+		elif cmd == "M24":
+			self._set_running(True)
+			return [ ]
+		elif cmd == "M25":
+			self._set_running(False)
+			return [ ]
+		elif cmd == "M26":
+			self._job = None
+			return [ ]
+		else:
+			return [ ]
+
+	async def _receive_upload(self, conn, filename, size):
+		# Receives chunks until the file is complete. Returns False if the
+		# connection was closed, which also happens after a bad chunk: the
+		# frames that follow it cannot be told apart from commands.
+		chunk_count = (size + GCodeChunk.CHUNK_SIZE - 1) // GCodeChunk.CHUNK_SIZE
+		frame_size = GCodeChunk.ChunkHeader.size + GCodeChunk.CHUNK_SIZE
+		crc = 0
+		for index in range(chunk_count):
+			frame = await conn.reader.readexactly(frame_size)
+			await conn.throttle(frame_size)
+			if self._disconnected(conn):
+				return False
+			header = GCodeChunk.ChunkHeader.unpack_head(frame)
+			data = frame[GCodeChunk.ChunkHeader.size : GCodeChunk.ChunkHeader.size + header.length]
+			if (header.magic != GCodeChunk._CHUNK_MAGIC) or (header.index != index) or (header.crc != zlib.crc32(data)):
+				if self._verbosity >= 1:
+					print("Bad chunk %d (expected %d) of %s, closing connection" % (header.index, index, filename))
+				conn.respond(self._latency, "Error: bad chunk %d (expected %d)\r\n" % (header.index, index))
+				await conn.flush()
+				return False
+			crc = zlib.crc32(data, crc)
+			ack = ("ok N%d\r\n" % (index)) if (self._ack_mode == "index") else "ok\r\n"
+			self._respond_later(conn, self._latency + self._ack_delay, ack)
+		self._files[filename] = size
+		if self._verbosity >= 1:
+			print("Received %s: %d bytes in %d chunks, CRC %08x" % (filename, size, chunk_count, crc))
+		return True
+
+	async def _handle_client(self, reader, writer):
+		conn = _SimulatorConnection(reader, writer, self._bandwidth)
+		try:
+			while True:
+				line = await reader.readuntil(b"\n")
+				await conn.throttle(len(line))
+				if self._disconnected(conn):
+					return
+				match = self._COMMAND_RE.fullmatch(line.decode("ascii", errors = "replace").strip().lstrip("~"))
+				if match is None:
+					continue
+				(cmd, args) = (match["cmd"], match["args"] or "")
+				if self._verbosity >= 2:
+					print("-> %s %s" % (cmd, args))
+				if cmd == "M28":
+					upload = self._M28_RE.fullmatch(args)
+					if upload is None:
+						self._respond_later(conn, self._latency, "CMD M28 Received.\r\nError: malformed M28\r\nok\r\n")
+						continue
+					self._respond_later(conn, self._latency, "CMD M28 Received.\r\nWriting to file: 0:/user/%s\r\nok\r\n" % (upload["filename"]))
+					if not await self._receive_upload(conn, upload["filename"], int(upload["size"])):
+						return
+				elif cmd == "M29":
+					self._respond_later(conn, self._latency, "CMD M29 Received.\r\nDone saving file.\r\nok\r\n")
+				else:
+					response = [ "CMD %s Received." % (cmd) ] + self._execute(conn, cmd, args) + [ "ok" ]
+					self._respond_later(conn, self._latency, "".join(response_line + "\r\n" for response_line in response))
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			conn.close()
+
+	async def serve(self, started = None):
+		server = await asyncio.start_server(self._handle_client, self._host, self._port)
+		self._port = server.sockets[0].getsockname()[1]
+		if self._verbosity >= 1:
+			print("Simulated printer listening on %s:%d" % (self._host, self._port))
+		if started is not None:
+			started()
+		async with server:
+			await server.serve_forever()
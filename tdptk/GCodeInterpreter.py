@@ -151,11 +151,34 @@ class GCodeHook():
 	def command(self, command):
 		pass
 
+class GCodeLayerWindow():
+	def __init__(self, first_layer = None, last_layer = None, min_z = None, max_z = None):
+		self._first_layer = first_layer
+		self._last_layer = last_layer
+		self._min_z = min_z
+		self._max_z = max_z
+
+	def before(self, layer, z):
+		return ((self._first_layer is not None) and (layer < self._first_layer)) or ((self._min_z is not None) and (z < self._min_z - 1e-6))
+
+	def after(self, layer, z):
+		return ((self._last_layer is not None) and (layer > self._last_layer)) or ((self._max_z is not None) and (z > self._max_z + 1e-6))
+
+	def __str__(self):
+		return "layers %s:%s z %s:%s" % (self._first_layer, self._last_layer, self._min_z, self._max_z)
+
 class GCodeBaseInterpreter():
-	def __init__(self, hooks = None):
+	_LAYER_Z_EPSILON = 1e-3
+
+	def __init__(self, hooks = None, window = None):
 		self._pos = { }
 		self._pos_absolute = False
 		self._tool = 0
+		self._layer = -1
+		self._layer_z = None
+		self._window = window
+		self._fast_forwarding = window is not None
+		self._finished = False
 		if hooks is None:
 			self._hooks = [ ]
 		else:
@@ -181,29 +204,77 @@ class GCodeBaseInterpreter():
 	def tool(self):
 		return self._tool
 
+	@property
+	def layer(self):
+		return self._layer
+
+	@property
+	def layer_z(self):
+		return self._layer_z
+
+	@property
+	def fast_forwarding(self):
+		# Before the layer window is reached, only the position state is
+		# tracked and hooks are not called
+		return self._fast_forwarding
+
+	@property
+	def finished(self):
+		# Set once the layer window has been passed, nothing that follows
+		# needs to be interpreted anymore
+		return self._finished
+
 	def _fire_hooks(self, hook_name, *args):
 		for hook in self._hooks:
 			method = getattr(hook, hook_name)
 			method(*args)
 
+	def _enter_layer(self, z):
+		# A new layer starts whenever extrusion happens above the current
+		# layer height
+		if (self._layer_z is None) or (z > self._layer_z + self._LAYER_Z_EPSILON):
+			self._layer += 1
+			self._layer_z = z
+			if self._window is not None:
+				if self._window.after(self._layer, self._layer_z):
+					self._fast_forwarding = False
+					self._finished = True
+				else:
+					self._fast_forwarding = self._window.before(self._layer, self._layer_z)
+
 	def _movement(self, old_pos, new_pos):
 		extruded_length = new_pos["E"] - old_pos["E"]
+		if extruded_length > 0:
+			self._enter_layer(new_pos["Z"])
+		if self._fast_forwarding or self._finished:
+			return
 		max_feedrate = new_pos["F"]
 		self._fire_hooks("movement", old_pos, new_pos, max_feedrate)
 		if extruded_length > 0:
 			self._fire_hooks("extrude", self.tool, old_pos, new_pos, extruded_length, max_feedrate)
 
+	def move(self, axes):
+		new_pos = dict(self.pos)
+		for (axis, pos) in axes.items():
+			if self._pos_absolute:
+				new_pos[axis] = pos
+			else:
+				new_pos[axis] += pos
+		self._movement(self.pos, new_pos)
+		self.pos = new_pos
+
 	def command(self, command):
-		self._fire_hooks("command", command)
+		if self._finished:
+			return
+		if self._fast_forwarding:
+			# Slicers keep state such as the printing region in comments,
+			# which hooks still need to see
+			if command.have_comment:
+				self._fire_hooks("command", command)
+		else:
+			self._fire_hooks("command", command)
 		if command.cmd in [ GCodes.RapidMovement, GCodes.ControlledMovement ]:
-			new_pos = dict(self.pos)
-			for (axis, pos) in command.float_dict.items():
-				if self._pos_absolute:
-					new_pos[axis] = pos
-				else:
-					new_pos[axis] += pos
-			self._movement(self.pos, new_pos)
-			self.pos = new_pos
+			self.move(command.float_dict)
 		elif command.cmd == GCodes.UseAbsolutePositioning:
 			self._pos_absolute = True
 		elif command.cmd == GCodes.UseRelativePositioning:
@@ -214,7 +285,10 @@ class GCodeBaseInterpreter():
 				self.pos[axis] = pos
 		elif command.cmd == GCodes.SetActiveExtruder:
 			self._tool = int(command["T"])
-			self._fire_hooks("tool_change", self._tool)
+			if not self._fast_forwarding:
+				self._fire_hooks("tool_change", self._tool)
+		elif self._fast_forwarding:
+			pass
 		elif command.cmd == GCodes.SetExtruderNozzleTemperature:
 			tool = int(command.get("T", 0))
 			temperature = float(command["S"])
@@ -239,6 +313,15 @@ class GCodeParser():
 
 	def parse_all(self, gcode):
 		for line in gcode.split("\n"):
+			if self._interpreter.finished:
+				break
+			if self._interpreter.fast_forwarding and (";" not in line):
+				# Movement commands are interpreted directly without creating a
+				# GCodeCommand while fast-forwarding to a layer window
+				fields = line.split()
+				if (len(fields) > 0) and (fields[0] in [ "G0", "G1" ]):
+					self._interpreter.move({ item[0]: float(item[1:]) for item in fields[1:] })
+					continue
 			self.parse(line)
 
 class PrintingRegion(enum.Enum):
@@ -317,10 +400,11 @@ class GCodeInformationHook(GCodeHook):
 		self._total_extruded_length[tool] += extruded_length
 
 class GCodePOVRayHook(GCodeHook):
-	def __init__(self, povray_renderer, info_hook):
+	def __init__(self, povray_renderer, info_hook, regions = (PrintingRegion.Shell, PrintingRegion.Infill)):
 		super().__init__(self)
 		self._renderer = povray_renderer
 		self._info_hook = info_hook
+		self._regions = tuple(regions)
 		self._stats = {
 			"extrude_commands":		0,
 			"wrong_region":			0,
@@ -330,10 +414,14 @@ class GCodePOVRayHook(GCodeHook):
 	def stats(self):
 		return self._stats
 
+	@property
+	def regions(self):
+		return self._regions
+
 	def extrude(self, tool, old_pos, new_pos, extruded_length, max_feedrate):
 		self._stats["extrude_commands"] += 1
 
-		if self._info_hook.region not in [ PrintingRegion.Shell, PrintingRegion.Infill ]:
+		if self._info_hook.region not in self._regions:
 			self._stats["wrong_region"] += 1
 			return
 
@@ -0,0 +1,153 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import numpy
+from .PreviewRasterizer import PreviewRasterizer
+
+class GeometryFilter():
+	# A stage between GCodePOVRayHook and a renderer: all cylinders are
+	# collected first and a reduced set is forwarded to the renderer on
+	# flush(), since filtering requires knowledge of the whole model
+	def __init__(self, renderer):
+		self._renderer = renderer
+		self._cylinders = [ ]
+
+	@property
+	def cylinder_diameter(self):
+		return self._renderer.cylinder_diameter
+
+	@cylinder_diameter.setter
+	def cylinder_diameter(self, value):
+		self._renderer.cylinder_diameter = value
+
+	def add_cylinder(self, old_pos, new_pos):
+		self._cylinders.append(((old_pos["X"], old_pos["Y"], old_pos["Z"]), (new_pos["X"], new_pos["Y"], new_pos["Z"])))
+
+	def add_triangle(self, vertex1, vertex2, vertex3):
+		self._renderer.add_triangle(vertex1, vertex2, vertex3)
+
+	def _filter(self, segments):
+		raise NotImplementedError(self.__class__.__name__)
+
+	def flush(self):
+		if len(self._cylinders) > 0:
+			segments = self._filter(numpy.array(self._cylinders, dtype = numpy.float64))
+			for (old, new) in segments.tolist():
+				self._renderer.add_cylinder(dict(zip("XYZ", old)), dict(zip("XYZ", new)))
+		self._cylinders = [ ]
+		if isinstance(self._renderer, GeometryFilter):
+			self._renderer.flush()
+
+class LODGeometryFilter(GeometryFilter):
+	_MAX_ENCLOSURE_GRID_CELLS = 1 << 27
+
+	def __init__(self, renderer, resolution, drop_enclosed = True, verbosity = 0):
+		super().__init__(renderer)
+		self._resolution = resolution
+		self._drop_enclosed = drop_enclosed
+		self._verbosity = verbosity
+
+	def _enclosed_cells(self, segments, lower, cell_size, grid_shape):
+		# Sample all segments at cell size steps to find out which cells of
+		# the voxel grid are occupied at all
+		lengths = numpy.linalg.norm(segments[:, 1] - segments[:, 0], axis = 1)
+		steps = numpy.ceil(lengths / cell_size).astype(int) + 1
+		seg_index = numpy.repeat(numpy.arange(len(segments)), steps)
+		first_sample = numpy.repeat(numpy.cumsum(steps) - steps, steps)
+		t = (numpy.arange(len(seg_index)) - first_sample) / numpy.maximum(steps[seg_index] - 1, 1)
+		samples = segments[seg_index, 0] + t[:, None] * (segments[seg_index, 1] - segments[seg_index, 0])
+		cells = numpy.clip(numpy.floor((samples - lower) / cell_size).astype(numpy.int64), 0, numpy.array(grid_shape) - 1)
+		occupied = numpy.zeros(grid_shape, dtype = bool)
+		occupied[tuple(cells.T)] = True
+
+		# A cell is enclosed (and therefore invisible at this resolution)
+		# when all six of its neighbors are occupied as well
+		enclosed = occupied.copy()
+		enclosed[0, :, :] = enclosed[-1, :, :] = False
+		enclosed[:, 0, :] = enclosed[:, -1, :] = False
+		enclosed[:, :, 0] = enclosed[:, :, -1] = False
+		enclosed[1:-1, :, :] &= occupied[:-2, :, :] & occupied[2:, :, :]
+		enclosed[:, 1:-1, :] &= occupied[:, :-2, :] & occupied[:, 2:, :]
+		enclosed[:, :, 1:-1] &= occupied[:, :, :-2] & occupied[:, :, 2:]
+		return enclosed.reshape(-1)
+
+	@staticmethod
+	def _cell_keys(cells, grid_shape):
+		return numpy.ravel_multi_index(tuple(numpy.moveaxis(cells, -1, 0)), grid_shape)
+
+	def _filter(self, segments):
+		points = segments.reshape(-1, 3)
+		lower = points.min(axis = 0)
+		extent = points.max(axis = 0) - lower
+		cell_size = max(extent.max() / self._resolution, 1e-6)
+		grid_shape = tuple(int(value) for value in numpy.floor(extent / cell_size).astype(int) + 1)
+
+		# Snap all end points to the center of their voxel. Segments that
+		# collapse into a single voxel are below pixel size and vanish,
+		# consecutive segments stay connected since they share end points.
+		cells = numpy.floor((segments - lower) / cell_size).astype(numpy.int64)
+		keys = self._cell_keys(cells, grid_shape)
+		keys = numpy.sort(keys[keys[:, 0] != keys[:, 1]], axis = 1)
+		keys = numpy.unique(keys, axis = 0)
+
+		if self._drop_enclosed and (len(keys) > 0) and (numpy.prod(grid_shape) <= self._MAX_ENCLOSURE_GRID_CELLS):
+			enclosed = self._enclosed_cells(segments, lower, cell_size, grid_shape)
+			keys = keys[~(enclosed[keys[:, 0]] & enclosed[keys[:, 1]])]
+
+		if self._verbosity >= 1:
+			print("Level of detail: %d cylinders reduced to %d using %.3fmm voxels." % (len(segments), len(keys), cell_size))
+
+		# Cylinders thinner than a voxel would leave gaps between the snapped
+		# rows of extrusions
+		if self._renderer.cylinder_diameter < cell_size:
+			self._renderer.cylinder_diameter = cell_size
+
+		cells = numpy.stack(numpy.unravel_index(keys, grid_shape), axis = -1)
+		return lower + (cells + 0.5) * cell_size
+
+class OcclusionGeometryFilter(GeometryFilter):
+	def __init__(self, renderer, resolution, verbosity = 0):
+		super().__init__(renderer)
+		self._resolution = resolution
+		self._verbosity = verbosity
+
+	def _filter(self, segments):
+		# Rasterize all cylinders into a depth buffer as seen from the fixed
+		# camera of the POV-Ray scene
+		cylinder_radius = self._renderer.cylinder_diameter / 2
+		(projected, scale) = PreviewRasterizer.project(segments.reshape(-1, 3), self._resolution, self._resolution, margin = cylinder_radius)
+		projected = projected.reshape(-1, 2, 3)
+		radius = max(cylinder_radius * scale, 0.5)
+		zbuffer = numpy.full(self._resolution * self._resolution, numpy.inf)
+		for (_, pixel, depth, _) in PreviewRasterizer.stamp(projected, radius, self._resolution, self._resolution):
+			numpy.minimum.at(zbuffer, pixel, depth)
+
+		# A cylinder is kept when at least one of its pixels is at the front.
+		# The tolerance accounts for rounding to pixels and for neighboring
+		# extrusions which touch the visible surface.
+		tolerance = radius + 1
+		visible = numpy.zeros(len(segments), dtype = bool)
+		for (seg_index, pixel, depth, _) in PreviewRasterizer.stamp(projected, radius, self._resolution, self._resolution):
+			visible[seg_index[depth <= zbuffer[pixel] + tolerance]] = True
+
+		if self._verbosity >= 1:
+			print("Occlusion culling: %d of %d cylinders visible at %dx%d." % (numpy.count_nonzero(visible), len(segments), self._resolution, self._resolution))
+		return segments[visible]
@@ -0,0 +1,135 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import enum
+import numpy
+from .STLFile import STLFile
+
+class MeshDecimationMode(enum.Enum):
+	Cluster = "cluster"
+	Quadric = "quadric"
+
+class MeshDecimator():
+	# Vertex clustering: all vertices within one cell of a uniform grid are
+	# merged into a single one and facets that collapse are dropped. The
+	# merged vertex is either the mean of the cluster or, in quadric mode,
+	# the position that minimizes the quadric error of all adjacent facet
+	# planes (Lindstrom, "Out-of-Core Simplification of Large Polygonal
+	# Models", 2000), which keeps edges and corners sharp.
+	_MAX_ITERATIONS = 8
+
+	def __init__(self, mode = MeshDecimationMode.Quadric, verbosity = 0):
+		assert(isinstance(mode, MeshDecimationMode))
+		self._mode = mode
+		self._verbosity = verbosity
+
+	@staticmethod
+	def _cluster_ids(vertices, cell_size):
+		cells = numpy.floor((vertices - vertices.min(axis = 0)) / cell_size).astype(numpy.int64)
+		grid_shape = tuple(cells.max(axis = 0) + 1)
+		keys = numpy.ravel_multi_index(tuple(cells.T), grid_shape)
+		(unique_keys, cluster_ids) = numpy.unique(keys, return_inverse = True)
+		return (cluster_ids, len(unique_keys))
+
+	@staticmethod
+	def _cluster_sum(cluster_ids, cluster_count, values):
+		values = values.reshape(len(values), -1)
+		return numpy.stack([ numpy.bincount(cluster_ids, weights = values[:, i], minlength = cluster_count) for i in range(values.shape[1]) ], axis = 1)
+
+	def _cluster_means(self, vertices, cluster_ids, cluster_count):
+		counts = numpy.bincount(cluster_ids, minlength = cluster_count)
+		return self._cluster_sum(cluster_ids, cluster_count, vertices) / counts[:, None]
+
+	def _cluster_quadrics(self, mesh, cluster_ids, cluster_count, cell_size):
+		means = self._cluster_means(mesh.vertices, cluster_ids, cluster_count)
+
+		# Area-weighted plane quadric of every facet, n n^T and d n with the
+		# plane n x + d = 0, accumulated for the clusters of its corners
+		corners = mesh.vertices[mesh.faces]
+		normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+		doubled_area = numpy.linalg.norm(normals, axis = 1)
+		valid = doubled_area > 0
+		normals[valid] /= doubled_area[valid, None]
+		distances = -numpy.einsum("ij,ij->i", normals, corners[:, 0])
+		weights = doubled_area / 2
+		quadric_a = (normals[:, :, None] * normals[:, None, :]) * weights[:, None, None]
+		quadric_b = (normals * distances[:, None]) * weights[:, None]
+		a = numpy.zeros((cluster_count, 3, 3))
+		b = numpy.zeros((cluster_count, 3))
+		for corner in range(3):
+			corner_clusters = cluster_ids[mesh.faces[:, corner]]
+			a += self._cluster_sum(corner_clusters, cluster_count, quadric_a).reshape(-1, 3, 3)
+			b += self._cluster_sum(corner_clusters, cluster_count, quadric_b)
+
+		# Minimize the error relative to the cluster mean; a small
+		# regularization pulls badly conditioned solutions (flat or linear
+		# regions) towards the mean
+		scale = numpy.trace(a, axis1 = 1, axis2 = 2)
+		regularized = a + (1e-3 * numpy.maximum(scale, 1e-12))[:, None, None] * numpy.eye(3)
+		residual = -(b + numpy.einsum("kij,kj->ki", a, means))
+		positions = means + numpy.linalg.solve(regularized, residual[:, :, None])[:, :, 0]
+
+		# Solutions far outside of their cell are outliers, keep the mean
+		outlier = numpy.linalg.norm(positions - means, axis = 1) > cell_size
+		positions[outlier] = means[outlier]
+		return positions
+
+	def _collapse(self, mesh, cell_size):
+		(cluster_ids, cluster_count) = self._cluster_ids(mesh.vertices, cell_size)
+
+		# Drop facets that collapsed to an edge or a point and duplicate
+		# facets that result from merging
+		faces = cluster_ids[mesh.faces]
+		faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+		(unique_faces, first_index) = numpy.unique(numpy.sort(faces, axis = 1), axis = 0, return_index = True)
+		faces = faces[numpy.sort(first_index)]
+		return (cluster_ids, cluster_count, faces)
+
+	def decimate(self, mesh, facet_budget):
+		if len(mesh.faces) <= facet_budget:
+			return mesh
+
+		# A grid cell on the surface yields about two facets, which gives an
+		# initial guess for the cell size from the surface area; it is
+		# increased until the budget is met. Vertex positions do not
+		# influence the facet count, so they are computed only once.
+		corners = mesh.vertices[mesh.faces]
+		surface_area = numpy.linalg.norm(numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis = 1).sum() / 2
+		cell_size = max(numpy.sqrt(2 * surface_area / facet_budget), 1e-6)
+		for iteration in range(self._MAX_ITERATIONS):
+			if iteration > 0:
+				cell_size *= numpy.sqrt(len(faces) / facet_budget) * 1.02
+			(cluster_ids, cluster_count, faces) = self._collapse(mesh, cell_size)
+			if self._verbosity >= 1:
+				print("Decimation (%s): %d facets reduced to %d using %.3fmm cells." % (self._mode.value, len(mesh.faces), len(faces), cell_size))
+			if len(faces) <= facet_budget:
+				break
+		else:
+			print("Warning: decimation stopped at %d facets after %d iterations, the budget was %d facets." % (len(faces), self._MAX_ITERATIONS, facet_budget))
+
+		if self._mode == MeshDecimationMode.Quadric:
+			vertices = self._cluster_quadrics(mesh, cluster_ids, cluster_count, cell_size)
+		else:
+			vertices = self._cluster_means(mesh.vertices, cluster_ids, cluster_count)
+
+		# Only keep vertices that are still referenced
+		(used_vertices, faces) = numpy.unique(faces, return_inverse = True)
+		return STLFile.IndexedMesh(vertices = vertices[used_vertices], faces = faces.reshape(-1, 3))
@@ -23,19 +23,78 @@
 #
 #	File UUID 34de558f-8b40-4899-a9d9-66e46d7d07a4
 
+import re
 import collections
 import struct
+import numpy
 
 class NamedStruct():
+	_DTYPE_BYTE_ORDER = {
+		"<":	"<",
+		">":	">",
+		"!":	">",
+		"=":	"=",
+		"@":	"=",
+	}
+	_DTYPE_TYPES = {
+		"c":	"S1",
+		"b":	"i1",
+		"B":	"u1",
+		"?":	"?",
+		"h":	"i2",
+		"H":	"u2",
+		"i":	"i4",
+		"I":	"u4",
+		"l":	"i4",
+		"L":	"u4",
+		"q":	"i8",
+		"Q":	"u8",
+		"e":	"f2",
+		"f":	"f4",
+		"d":	"f8",
+	}
+	_FIELDTYPE_RE = re.compile(r"(?P<count>\d*)(?P<type>[a-zA-Z?])")
+
 	def __init__(self, fields, struct_extra = "<"):
 		struct_format = struct_extra + ("".join(fieldtype for (fieldtype, fieldname) in fields))
 		self._struct = struct.Struct(struct_format)
 		self._collection = collections.namedtuple("Fields", [ fieldname for (fieldtype, fieldname) in fields ])
+		self._fields = fields
+		self._struct_extra = struct_extra
+		self._dtype = None
 
 	@property
 	def size(self):
 		return self._struct.size
 
+	@property
+	def dtype(self):
+		# NumPy structured dtype with the same memory layout as the struct,
+		# derived on first use
+		if self._dtype is None:
+			byte_order = self._DTYPE_BYTE_ORDER.get(self._struct_extra[:1], "=")
+			dtype_fields = [ ]
+			for (fieldtype, fieldname) in self._fields:
+				match = self._FIELDTYPE_RE.fullmatch(fieldtype)
+				if (match is None) or (match["type"] not in self._DTYPE_TYPES and match["type"] != "s"):
+					raise NotImplementedError("No NumPy equivalent for struct field type '%s' of field %s." % (fieldtype, fieldname))
+				if match["type"] == "s":
+					dtype_fields.append((fieldname, "S%d" % (int(match["count"] or "1"))))
+				else:
+					if match["count"] not in [ "", "1" ]:
+						raise NotImplementedError("Repeated struct field type '%s' of field %s has no single value." % (fieldtype, fieldname))
+					dtype_fields.append((fieldname, byte_order + self._DTYPE_TYPES[match["type"]]))
+			dtype = numpy.dtype(dtype_fields, align = self._struct_extra[:1] in [ "@", "" ])
+			if dtype.itemsize != self._struct.size:
+				raise NotImplementedError("NumPy dtype size %d does not match struct size %d." % (dtype.itemsize, self._struct.size))
+			self._dtype = dtype
+		return self._dtype
+
+	def _record_count(self, buffer, count, offset):
+		if count is None:
+			count = (memoryview(buffer).nbytes - offset) // self._struct.size
+		return count
+
 	def create_fields(self, data):
 		fields = self._collection(**data)
 		return fields
@@ -47,6 +106,13 @@ class NamedStruct():
 			fields = data
 		return self._struct.pack(*fields)
 
+	def pack_into(self, buffer, offset, data):
+		if isinstance(data, dict):
+			fields = self.create_fields(data)
+		else:
+			fields = data
+		self._struct.pack_into(buffer, offset, *fields)
+
 	def unpack(self, data):
 		values = self._struct.unpack(data)
 		fields = self._collection(*values)
@@ -60,3 +126,26 @@ class NamedStruct():
 			f.seek(at_offset)
 		data = f.read(self._struct.size)
 		return self.unpack(data)
+
+	def unpack_array(self, buffer, count = None, offset = 0):
+		# Zero-copy view of consecutive records in any object supporting the
+		# buffer protocol (bytes, bytearray, mmap, memoryview). Without a
+		# count, as many complete records as the buffer holds are returned.
+		return numpy.frombuffer(buffer, dtype = self.dtype, count = self._record_count(buffer, count, offset), offset = offset)
+
+	def iter_unpack(self, buffer, count = None, offset = 0):
+		count = self._record_count(buffer, count, offset)
+		data = memoryview(buffer).cast("B")[offset : offset + (count * self._struct.size)]
+		for values in self._struct.iter_unpack(data):
+			yield self._collection(*values)
+
+	def pack_array(self, records):
+		# Structured arrays are converted to the record layout in bulk, other
+		# iterables are packed record by record
+		if isinstance(records, numpy.ndarray):
+			packed = numpy.empty(len(records), dtype = self.dtype)
+			for fieldname in self.dtype.names:
+				packed[fieldname] = records[fieldname]
+			return packed.tobytes()
+		else:
+			return b"".join(self.pack(record) for record in records)
@@ -0,0 +1,77 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import json
+import hashlib
+import tempfile
+
+class POVRayGeometryCache():
+	_FORMAT_VERSION = 1
+
+	def __init__(self, cache_dir = None, verbosity = 0):
+		if cache_dir is None:
+			cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "tdptk", "povray")
+		self._cache_dir = cache_dir
+		self._verbosity = verbosity
+
+	@property
+	def cache_dir(self):
+		return self._cache_dir
+
+	def key(self, input_data, **parameters):
+		# The key covers the raw input as well as everything that influences
+		# which geometry is generated from it (e.g., which printing regions
+		# are included), but nothing that only affects the final rendering
+		parameters = dict(parameters)
+		parameters["format_version"] = self._FORMAT_VERSION
+		keyhash = hashlib.sha256()
+		keyhash.update(json.dumps(parameters, sort_keys = True).encode("utf-8"))
+		keyhash.update(input_data)
+		return keyhash.hexdigest()
+
+	def filename(self, key):
+		return os.path.join(self._cache_dir, "%s.inc" % (key))
+
+	def lookup(self, key):
+		filename = self.filename(key)
+		if os.path.isfile(filename):
+			if self._verbosity >= 1:
+				print("Using cached geometry: %s" % (filename))
+			return filename
+		return None
+
+	def store(self, key, povray_renderer):
+		filename = self.filename(key)
+		os.makedirs(self._cache_dir, exist_ok = True)
+
+		# Write to a temporary file first so that concurrent renderers never
+		# see a partially written include file
+		with tempfile.NamedTemporaryFile(mode = "w", dir = self._cache_dir, prefix = ".", suffix = ".inc.tmp", delete = False) as f:
+			try:
+				f.write(povray_renderer.render_geometry())
+			except:
+				os.unlink(f.name)
+				raise
+		os.replace(f.name, filename)
+		if self._verbosity >= 1:
+			print("Stored geometry in cache: %s" % (filename))
+		return filename
@@ -19,13 +19,18 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
 import math
+import queue
 import subprocess
 import tempfile
 import enum
-import json
+import collections
+import concurrent.futures
+import numpy
 import mako.template
 from .CmdlineEscape import CmdlineEscape
+from .RasterImage import RasterImage
 
 class POVRayStyle(enum.Enum):
 	BlackWhite = "bw"
@@ -35,6 +40,8 @@ class POVRayMode(enum.Enum):
 	Default = "default"
 	Fast = "fast"
 
+POVRayView = collections.namedtuple("POVRayView", [ "name", "location", "sky", "light_rotation" ])
+
 _TEMPLATE = mako.template.Template("""\
 #version 3.7;
 #include "colors.inc"
@@ -57,16 +64,33 @@ background { color White }
 ${error("Unknown color style '%s'" % (style))}
 %endif
 
+%if len(views) == 1:
+#declare tdp_camera_location = <${views[0].location[0]}, ${views[0].location[1]}, ${views[0].location[2]}>;
+#declare tdp_camera_sky = <${views[0].sky[0]}, ${views[0].sky[1]}, ${views[0].sky[2]}>;
+#declare tdp_light_rotation = ${views[0].light_rotation};
+%else:
+#switch (frame_number)
+%for (frame, view) in enumerate(views, 1):
+	#case (${frame})
+		#declare tdp_camera_location = <${view.location[0]}, ${view.location[1]}, ${view.location[2]}>;
+		#declare tdp_camera_sky = <${view.sky[0]}, ${view.sky[1]}, ${view.sky[2]}>;
+		#declare tdp_light_rotation = ${view.light_rotation};
+	#break
+%endfor
+#end
+%endif
+
 camera {
 	orthographic
-	location <10, 10, 10>
+	location tdp_camera_location
+	sky tdp_camera_sky
 	right x * image_width / image_height
 	look_at  <0, 0, 0>
 	angle 60
 }
 
 %if style == "BlackWhite":
-light_source { <1000, 1000, 1000> color White }
+light_source { <1000, 1000, 1000> color White rotate <0, tdp_light_rotation, 0> }
 %elif style == "Color":
 light_source {
 	<15, 7, 15>	color White	spotlight
@@ -80,20 +104,20 @@ light_source {
 		reflection on
 	}
 %endif
+	rotate <0, tdp_light_rotation, 0>
 }
 %else:
 ${error("Unknown color style '%s'" % (style))}
 %endif
 
+%if geometry_include is None:
+${geometry}
+%else:
+#include "${geometry_include}"
+%endif
+
 #declare tdp_object = object {
-	union {
-%for ((x1, y1, z1), (x2, y2, z2)) in cylinders:
-		cylinder{ <${x1}, ${z1}, ${y1}>, <${x2}, ${z2}, ${y2}>, ${cylinder_diameter / 2} }
-%endfor
-%for ((x1, y1, z1), (x2, y2, z2), (x3, y3, z3)) in triangles:
-		triangle{ <${x1}, ${z1}, ${y1}>, <${x2}, ${z2}, ${y2}>,  <${x3}, ${z3}, ${y3}> }
-%endfor
-	}
+	tdp_geometry
 	texture {
 %if style == "BlackWhite":
 		pigment { color rgb<0.5, 0.5, 0.5> }
@@ -138,20 +162,108 @@ ${error("Unknown color style '%s'" % (style))}
 tdp_object
 """, strict_undefined = True)
 
+_GEOMETRY_TEMPLATE = mako.template.Template("""\
+#declare tdp_geometry = union {
+%for ((x1, y1, z1), (x2, y2, z2)) in cylinders:
+	cylinder{ <${x1}, ${z1}, ${y1}>, <${x2}, ${z2}, ${y2}>, ${cylinder_diameter / 2} }
+%endfor
+%for ((x1, y1, z1), (x2, y2, z2), (x3, y3, z3)) in triangles:
+	triangle{ <${x1}, ${z1}, ${y1}>, <${x2}, ${z2}, ${y2}>,  <${x3}, ${z3}, ${y3}> }
+%endfor
+%for (vertices, faces, normals) in meshes:
+	mesh2 {
+		vertex_vectors {
+			${len(vertices)},
+%for (x, y, z) in vertices:
+			<${x}, ${z}, ${y}>,
+%endfor
+		}
+%if normals is not None:
+		normal_vectors {
+			${len(normals)},
+%for (x, y, z) in normals:
+			<${x}, ${z}, ${y}>,
+%endfor
+		}
+%endif
+		face_indices {
+			${len(faces)},
+%for (a, b, c) in faces:
+			<${a}, ${b}, ${c}>,
+%endfor
+		}
+	}
+%endfor
+}
+""", strict_undefined = True)
+
 class POVRayRenderer():
-	def __init__(self, width = 800, height = 600, cylinder_diameter = 0.4, oversample_factor = 1, style = POVRayStyle.BlackWhite, mode = POVRayMode.Default, verbosity = 0):
+	# All cameras are at the same distance from the origin as the default
+	# isometric one at <10, 10, 10> so that the scale of all views is equal
+	_CAMERA_DISTANCE = 10 * math.sqrt(3)
+
+	def __init__(self, width = 800, height = 600, cylinder_diameter = 0.4, oversample_factor = 1, style = POVRayStyle.BlackWhite, mode = POVRayMode.Default, views = None, verbosity = 0):
 		super().__init__()
 		assert(isinstance(style, POVRayStyle))
 		assert(isinstance(mode, POVRayMode))
+		if views is None:
+			views = [ self.isometric_view() ]
+		assert(len(views) > 0)
 		self._width = width
 		self._height = height
 		self._cylinder_diameter = cylinder_diameter
 		self._oversample_factor = oversample_factor
 		self._style = style
 		self._mode = mode
+		self._views = views
 		self._verbosity = verbosity
 		self._cylinders = [ ]
 		self._triangles = [ ]
+		self._meshes = [ ]
+
+	@classmethod
+	def isometric_view(cls, rotation = 0, name = "iso"):
+		# Rotation happens around the vertical axis, the light source is
+		# rotated along so that the object appears to be turned
+		angle = math.radians(rotation)
+		location = (10 * (math.cos(angle) + math.sin(angle)), 10, 10 * (math.cos(angle) - math.sin(angle)))
+		return POVRayView(name = name, location = location, sky = (0, 1, 0), light_rotation = rotation)
+
+	@classmethod
+	def parse_views(cls, text):
+		# Comma-separated list of view names, e.g., "iso,top,turntable:8"
+		views = [ ]
+		for view_name in text.split(","):
+			view_name = view_name.strip()
+			if view_name == "iso":
+				views.append(cls.isometric_view())
+			elif view_name == "top":
+				views.append(POVRayView(name = "top", location = (0, cls._CAMERA_DISTANCE, 0), sky = (0, 0, 1), light_rotation = 0))
+			elif view_name == "front":
+				views.append(POVRayView(name = "front", location = (0, 0, -cls._CAMERA_DISTANCE), sky = (0, 1, 0), light_rotation = 0))
+			elif view_name == "side":
+				views.append(POVRayView(name = "side", location = (cls._CAMERA_DISTANCE, 0, 0), sky = (0, 1, 0), light_rotation = 0))
+			elif view_name.startswith("turntable:"):
+				frame_count = int(view_name[10:])
+				if frame_count < 1:
+					raise ValueError("Turntable needs at least one frame: %s" % (view_name))
+				digits = len(str(frame_count - 1))
+				views += [ cls.isometric_view(rotation = 360 * frame / frame_count, name = "turntable%0*d" % (digits, frame)) for frame in range(frame_count) ]
+			else:
+				raise ValueError("Unknown view: %s" % (view_name))
+		return views
+
+	@property
+	def views(self):
+		return self._views
+
+	def view_filename(self, filename, view):
+		# With several views, each is written to its own file that carries
+		# the name of the view
+		if len(self._views) == 1:
+			return filename
+		(base, extension) = os.path.splitext(filename)
+		return "%s_%s%s" % (base, view.name, extension)
 
 	def add_cylinder(self, old_pos, new_pos):
 		old = (old_pos["X"], old_pos["Y"], old_pos["Z"])
@@ -163,34 +275,143 @@ class POVRayRenderer():
 	def add_triangle(self, vertex1, vertex2, vertex3):
 		self._triangles.append((vertex1, vertex2, vertex3))
 
-	def render_source(self):
-		def error_fnc(text):
-			raise Exception(text)
+	def add_mesh(self, vertices, faces, vertex_normals = None):
+		# Indexed triangle mesh that is emitted as a single mesh2 object;
+		# normals, when given, are per vertex and share the face indices
+		self._meshes.append((vertices, faces, vertex_normals))
+
+	@property
+	def cylinder_diameter(self):
+		return self._cylinder_diameter
+
+	@cylinder_diameter.setter
+	def cylinder_diameter(self, value):
+		self._cylinder_diameter = value
+
+	def render_geometry(self):
 		if self._verbosity >= 1:
-			print("%d cylinders (diameter %.2fmm) and %d triangles to render." % (len(self._cylinders), self._cylinder_diameter, len(self._triangles)))
+			print("%d cylinders (diameter %.2fmm) and %d triangles to render." % (len(self._cylinders), self._cylinder_diameter, len(self._triangles) + sum(len(faces) for (vertices, faces, normals) in self._meshes)))
+		meshes = [ (numpy.asarray(vertices).tolist(), numpy.asarray(faces).tolist(), None if (normals is None) else numpy.asarray(normals).tolist()) for (vertices, faces, normals) in self._meshes ]
 		args = {
-			"scaling_factor":		5.5,
 			"cylinders":			self._cylinders,
 			"triangles":			self._triangles,
+			"meshes":				meshes,
 			"cylinder_diameter":	self._cylinder_diameter,
+		}
+		return _GEOMETRY_TEMPLATE.render(**args)
+
+	def render_source(self, geometry_include = None):
+		def error_fnc(text):
+			raise Exception(text)
+		args = {
+			"scaling_factor":		5.5,
+			"geometry_include":		geometry_include,
+			"geometry":				self.render_geometry() if (geometry_include is None) else None,
 			"style":				self._style.name,
+			"views":				self._views,
 			"error":				error_fnc,
 			"use_photons":			False,
 		}
 		return _TEMPLATE.render(**args)
 
-	def render_image(self, image_filename, additional_povray_options = None, show_image = False, trim_image = False):
+	def _run_povray(self, povray_options, pov_filename, povray_cwd, quiet):
+		# Returns one image per view. A single view is written as PPM to
+		# stdout; several views are rendered as frames of one animation,
+		# which POV-Ray can only write to individual files.
+		with tempfile.TemporaryDirectory(prefix = "tdptk_") as frame_dir:
+			if len(self._views) == 1:
+				povray_options = povray_options + [ "Output_File_Name=-" ]
+			else:
+				povray_options = povray_options + [ "Initial_Frame=1", "Final_Frame=%d" % (len(self._views)), "Output_File_Name=%s" % (os.path.join(frame_dir, "frame")) ]
+			povray_cmdline = [ "povray" ] + povray_options + [ pov_filename ]
+			if self._verbosity >= 3:
+				print("Command: %s" % (CmdlineEscape().cmdline(povray_cmdline)))
+			povray_stderr = subprocess.PIPE if quiet else None
+			povray_stdout = subprocess.run(povray_cmdline, stdout = subprocess.PIPE, stderr = povray_stderr, check = True, cwd = povray_cwd).stdout
+			if len(self._views) == 1:
+				return [ RasterImage.from_ppm(povray_stdout) ]
+
+			# Frame numbers in the filenames are zero-padded, so sorting
+			# them yields the order of the views
+			frame_filenames = sorted(os.listdir(frame_dir))
+			if len(frame_filenames) != len(self._views):
+				raise ValueError("POV-Ray rendered %d frames for %d views." % (len(frame_filenames), len(self._views)))
+			images = [ ]
+			for frame_filename in frame_filenames:
+				with open(os.path.join(frame_dir, frame_filename), "rb") as f:
+					images.append(RasterImage.from_ppm(f.read()))
+			return images
+
+	@staticmethod
+	def default_strip_slots(slot_count):
+		# Distribute the CPUs available to us evenly among the slots
+		cpus = sorted(os.sched_getaffinity(0))
+		slot_count = max(1, min(slot_count, len(cpus)))
+		return [ set(cpus[i :: slot_count]) for i in range(slot_count) ]
+
+	def _render_strips(self, povray_options, pov_filename, povray_cwd, quiet, strips, strip_slots):
+		# Split the frame into horizontal strips that are rendered by
+		# separate POV-Ray processes, each pinned to one slot of CPUs. Every
+		# strip must contain at least two rows since POV-Ray interprets a
+		# Start_Row/End_Row value of 1 as a fraction of the image height.
+		height = round(self._height * self._oversample_factor)
+		strips = max(1, min(strips, height // 2))
+		if strip_slots is None:
+			strip_slots = self.default_strip_slots(strips)
+		boundaries = [ round(height * i / strips) for i in range(strips + 1) ]
+
+		free_slots = queue.Queue()
+		for slot in strip_slots:
+			free_slots.put(slot)
+
+		def render_strip(first_row, last_row):
+			strip_options = list(povray_options)
+			if first_row > 0:
+				strip_options.append("Start_Row=%d" % (first_row + 1))
+			if last_row < height:
+				strip_options.append("End_Row=%d" % (last_row))
+			slot = free_slots.get()
+			try:
+				if not any(option.lower().startswith("work_threads=") for option in strip_options):
+					strip_options.append("Work_Threads=%d" % (len(slot)))
+				# The CPU affinity is per thread on Linux and inherited by
+				# POV-Ray, so pinning this worker thread pins the process
+				# from its start
+				os.sched_setaffinity(0, slot)
+				images = self._run_povray(strip_options, pov_filename, povray_cwd, quiet)
+			finally:
+				free_slots.put(slot)
+
+			# Depending on the POV-Ray version, the partial output either
+			# contains only the rendered rows or the full frame
+			strip_pixels = [ ]
+			for image in images:
+				if image.height == height:
+					strip_pixels.append(image.pixels[first_row : last_row])
+				elif image.height == last_row - first_row:
+					strip_pixels.append(image.pixels)
+				else:
+					raise ValueError("POV-Ray strip rendering of rows %d to %d returned image of unexpected height %d." % (first_row, last_row, image.height))
+			return strip_pixels
+
+		with concurrent.futures.ThreadPoolExecutor(max_workers = len(strip_slots)) as executor:
+			strip_futures = [ executor.submit(render_strip, boundaries[i], boundaries[i + 1]) for i in range(strips) ]
+			strip_pixels = [ future.result() for future in strip_futures ]
+			return [ RasterImage(numpy.concatenate([ pixels[view_index] for pixels in strip_pixels ], axis = 0)) for view_index in range(len(self._views)) ]
+
+	def render_rasters(self, additional_povray_options = None, show_image = False, trim_image = False, geometry_include = None, quiet = False, strips = 1, strip_slots = None):
 		bg_color = {
-			POVRayStyle.BlackWhite:		"black",
-			POVRayStyle.Color:			"white",
+			POVRayStyle.BlackWhite:		(0, 0, 0),
+			POVRayStyle.Color:			(255, 255, 255),
 		}[self._style]
 
-		with tempfile.NamedTemporaryFile(suffix = ".pov", mode = "w") as pov_file, tempfile.NamedTemporaryFile(suffix = ".png") as png_file:
+		with tempfile.NamedTemporaryFile(suffix = ".pov", mode = "w") as pov_file:
+			# POV-Ray writes a PPM image to stdout, which we decode in-process
 			povray_options = [
 				"Width=%d" % (round(self._width * self._oversample_factor)),
 				"Height=%d" % (round(self._height * self._oversample_factor)),
 				"Output_to_File=true",
-				"Output_File_Name=%s" % (png_file.name),
+				"Output_File_Type=P",
 			]
 			if not show_image:
 				povray_options += [
@@ -213,32 +434,30 @@ class POVRayRenderer():
 				]
 			if additional_povray_options is not None:
 				povray_options += additional_povray_options
-			pov_file.write(self.render_source())
+			if geometry_include is None:
+				pov_file.write(self.render_source())
+				povray_cwd = None
+			else:
+				# POV-Ray is run from within the directory of the geometry
+				# include file so that its file I/O restrictions permit
+				# reading it
+				pov_file.write(self.render_source(geometry_include = os.path.basename(geometry_include)))
+				povray_cwd = os.path.dirname(os.path.abspath(geometry_include))
 			pov_file.flush()
-			povray_cmdline = [ "povray" ] + povray_options + [ pov_file.name ]
-			if self._verbosity >= 3:
-				print("Command: %s" % (CmdlineEscape().cmdline(povray_cmdline)))
-			subprocess.check_call(povray_cmdline)
-
-			if not trim_image:
-				subprocess.check_call([ "convert", "-resize", "%dx%d" % (self._width, self._height), "+repage", png_file.name, image_filename ])
+			if strips > 1:
+				images = self._render_strips(povray_options, pov_file.name, povray_cwd, quiet, strips, strip_slots)
 			else:
-				with tempfile.NamedTemporaryFile(suffix = ".png") as trimmed_png_file:
-
-					# First we trim the image
-					subprocess.check_call([ "convert", "-trim", "+repage", png_file.name, trimmed_png_file.name ])
+				images = self._run_povray(povray_options, pov_file.name, povray_cwd, quiet)
 
-					# Then we get the current extents of that image
-					image_data = json.loads(subprocess.check_output([ "convert", trimmed_png_file.name, "json:-" ]))[0]["image"]
-					cropped_geometry = (image_data["geometry"]["width"], image_data["geometry"]["height"])
+		if trim_image:
+			# Trim the images, then pad them to the correct aspect ratio
+			images = [ image.trim().pad_to_aspect(self._width, self._height, bg_color) for image in images ]
+		return [ image.resize(self._width, self._height) for image in images ]
 
-					# Now find out how we have to pad it to get the correct aspect ratio
-					cropped_aspect = cropped_geometry[0] / cropped_geometry[1]
-					desired_aspect = self._width / self._height
-					if cropped_aspect > desired_aspect:
-						desired_geometry = (cropped_geometry[0], round(cropped_geometry[0] / self._width * self._height))
-					else:
-						desired_geometry = (round(cropped_geometry[1] * self._width / self._height), cropped_geometry[1])
+	def render_raster(self, additional_povray_options = None, show_image = False, trim_image = False, geometry_include = None, quiet = False, strips = 1, strip_slots = None):
+		return self.render_rasters(additional_povray_options = additional_povray_options, show_image = show_image, trim_image = trim_image, geometry_include = geometry_include, quiet = quiet, strips = strips, strip_slots = strip_slots)[0]
 
-					# Then pad it first and then resize to final dimensions
-					subprocess.check_call([ "convert", "-gravity", "center", "-background", bg_color, trimmed_png_file.name, "-extent", "%dx%d" % (desired_geometry[0], desired_geometry[1]), "-resize", "%dx%d" % (self._width, self._height), "+repage", image_filename ])
+	def render_image(self, image_filename, additional_povray_options = None, show_image = False, trim_image = False, geometry_include = None, quiet = False, strips = 1, strip_slots = None):
+		images = self.render_rasters(additional_povray_options = additional_povray_options, show_image = show_image, trim_image = trim_image, geometry_include = geometry_include, quiet = quiet, strips = strips, strip_slots = strip_slots)
+		for (view, image) in zip(self._views, images):
+			image.write(self.view_filename(image_filename, view))
@@ -0,0 +1,174 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import math
+import numpy
+from .POVRayRenderer import POVRayStyle
+from .RasterImage import RasterImage
+
+class PreviewRasterizer():
+	# Screen axes and view direction of the orthographic POV-Ray camera at
+	# <10, 10, 10>, expressed in G-code coordinates (POV-Ray swaps Y and Z).
+	_SCREEN_X = numpy.array([ -1, 1, 0 ]) / math.sqrt(2)
+	_SCREEN_Y = numpy.array([ -1, -1, 2 ]) / math.sqrt(6)
+	_VIEW_DEPTH = numpy.array([ -1, -1, -1 ]) / math.sqrt(3)
+	_MAX_SAMPLES_PER_PASS = 1 << 20
+
+	_STYLES = {
+		POVRayStyle.BlackWhite: {
+			"background":	(0, 0, 0),
+			"color":		(0.5, 0.5, 0.5),
+			"phong":		0.5,
+			"phong_size":	40,
+		},
+		POVRayStyle.Color: {
+			"background":	(1, 1, 1),
+			"color":		(0.853, 0.124, 0.109),
+			"phong":		0.7,
+			"phong_size":	40,
+		},
+	}
+
+	def __init__(self, width = 80, height = 60, cylinder_diameter = 0.4, oversample_factor = 4, style = POVRayStyle.BlackWhite, verbosity = 0):
+		assert(isinstance(style, POVRayStyle))
+		self._width = width
+		self._height = height
+		self._cylinder_diameter = cylinder_diameter
+		self._oversample_factor = oversample_factor
+		self._style = style
+		self._verbosity = verbosity
+		self._cylinders = [ ]
+
+	@property
+	def cylinder_diameter(self):
+		return self._cylinder_diameter
+
+	@cylinder_diameter.setter
+	def cylinder_diameter(self, value):
+		self._cylinder_diameter = value
+
+	def add_cylinder(self, old_pos, new_pos):
+		old = (old_pos["X"], old_pos["Y"], old_pos["Z"])
+		new = (new_pos["X"], new_pos["Y"], new_pos["Z"])
+		if old != new:
+			self._cylinders.append((old, new))
+
+	@classmethod
+	def project(cls, points, width, height, margin = 0):
+		screen = numpy.stack([ points @ cls._SCREEN_X, points @ cls._SCREEN_Y, points @ cls._VIEW_DEPTH ], axis = 1)
+
+		# Fit the projected bounding box into the image, which is what the
+		# trimming of the POV-Ray output achieves as well
+		lower = screen[:, :2].min(axis = 0) - margin
+		upper = screen[:, :2].max(axis = 0) + margin
+		extent = numpy.maximum(upper - lower, 1e-6)
+		scale = min((width - 1) / extent[0], (height - 1) / extent[1])
+		center = (lower + upper) / 2
+
+		projected = numpy.empty_like(screen)
+		projected[:, 0] = (width - 1) / 2 + (screen[:, 0] - center[0]) * scale
+		projected[:, 1] = (height - 1) / 2 - (screen[:, 1] - center[1]) * scale
+		projected[:, 2] = screen[:, 2] * scale
+		return (projected, scale)
+
+	@staticmethod
+	def _kernel(radius):
+		r = math.floor(radius)
+		(oy, ox) = numpy.mgrid[-r : r + 1, -r : r + 1]
+		inside = (ox ** 2 + oy ** 2) <= radius ** 2
+		return numpy.stack([ ox[inside], oy[inside] ], axis = 1)
+
+	@classmethod
+	def _stamp_chunk(cls, segments, first_index, radius, width, height):
+		(start, end) = (segments[:, 0], segments[:, 1])
+		delta = end - start
+		length = numpy.hypot(delta[:, 0], delta[:, 1])
+		steps = numpy.ceil(length / radius).astype(int) + 1
+
+		# Sample every segment densely enough so that the disks stamped at
+		# each sample point form a closed stroke
+		seg_index = numpy.repeat(numpy.arange(len(segments)), steps)
+		first_sample = numpy.repeat(numpy.cumsum(steps) - steps, steps)
+		t = (numpy.arange(len(seg_index)) - first_sample) / numpy.maximum(steps[seg_index] - 1, 1)
+		samples = start[seg_index] + t[:, None] * delta[seg_index]
+
+		with numpy.errstate(invalid = "ignore", divide = "ignore"):
+			direction = numpy.where(length[:, None] > 0, delta[:, :2] / length[:, None], 0)[seg_index]
+		axial = numpy.any(direction != 0, axis = 1)
+
+		for (ox, oy) in cls._kernel(radius):
+			# Distance from the cylinder axis, which determines the surface
+			# normal towards the viewer
+			lateral = numpy.where(axial, numpy.abs(direction[:, 0] * oy - direction[:, 1] * ox), math.hypot(ox, oy)) / radius
+			nz = numpy.sqrt(numpy.clip(1 - lateral ** 2, 0, 1))
+			x = numpy.round(samples[:, 0] + ox).astype(int)
+			y = numpy.round(samples[:, 1] + oy).astype(int)
+			inside = (x >= 0) & (x < width) & (y >= 0) & (y < height) & (lateral <= 1)
+			pixel = y[inside] * width + x[inside]
+			depth = samples[inside, 2] - nz[inside] * radius
+			yield (first_index + seg_index[inside], pixel, depth, nz[inside])
+
+	@classmethod
+	def stamp(cls, segments, radius, width, height):
+		# Yields the pixels covered by the projected cylinders as tuples of
+		# (segment index, pixel index, depth, surface normal towards the
+		# viewer). Segments are processed in chunks to bound memory usage.
+		lengths = numpy.hypot(*(segments[:, 1, :2] - segments[:, 0, :2]).T)
+		sample_count = numpy.cumsum(numpy.ceil(lengths / radius) + 1)
+		boundaries = numpy.unique(numpy.searchsorted(sample_count, numpy.arange(cls._MAX_SAMPLES_PER_PASS, sample_count[-1], cls._MAX_SAMPLES_PER_PASS)))
+		for (first_index, chunk) in zip([ 0 ] + list(boundaries), numpy.split(segments, boundaries)):
+			if len(chunk) > 0:
+				yield from cls._stamp_chunk(chunk, first_index, radius, width, height)
+
+	def render(self):
+		style = self._STYLES[self._style]
+		background = numpy.array(style["background"], dtype = numpy.float32)
+		if len(self._cylinders) == 0:
+			return RasterImage.from_float(numpy.tile(background, (self._height, self._width, 1)))
+
+		width = round(self._width * self._oversample_factor)
+		height = round(self._height * self._oversample_factor)
+		if self._verbosity >= 1:
+			print("Rasterizing %d cylinders (diameter %.2fmm) at %dx%d." % (len(self._cylinders), self._cylinder_diameter, width, height))
+
+		points = numpy.array(self._cylinders, dtype = numpy.float64).reshape(-1, 3)
+		(projected, scale) = self.project(points, width, height, margin = self._cylinder_diameter / 2)
+		segments = projected.reshape(-1, 2, 3)
+		radius = max(self._cylinder_diameter / 2 * scale, 0.5)
+
+		zbuffer = numpy.full(width * height, numpy.inf)
+		normal_z = numpy.zeros(width * height)
+		for (_, pixel, depth, nz) in self.stamp(segments, radius, width, height):
+			numpy.minimum.at(zbuffer, pixel, depth)
+			visible = depth <= zbuffer[pixel]
+			normal_z[pixel[visible]] = nz[visible]
+
+		# Simple headlight shading with depth cueing so that layers further
+		# away appear darker
+		hit = numpy.isfinite(zbuffer)
+		(near, far) = (zbuffer[hit].min(), zbuffer[hit].max())
+		depth_cue = 1 - 0.4 * (zbuffer[hit] - near) / max(far - near, 1e-6)
+		nz = normal_z[hit]
+		intensity = (0.15 + 0.85 * nz) * depth_cue
+		pixels = numpy.tile(background, (width * height, 1))
+		pixels[hit] = numpy.array(style["color"])[None, :] * intensity[:, None] + style["phong"] * (nz ** style["phong_size"])[:, None]
+		image = RasterImage.from_float(pixels.reshape(height, width, 3))
+		return image.resize(self._width, self._height)
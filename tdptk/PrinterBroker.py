@@ -0,0 +1,318 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import time
+import json
+import signal
+import asyncio
+from .FlashForgeProtocol import FlashForgeProtocol, AsyncFlashForgeProtocol, FlashForgeCommunicationException
+from .FlashForgeResponses import FlashForgeResponseException, MachineInformation, PrintProgress, Temperatures, Position, MachineState, MachineStatus
+from .PrinterURI import PrinterProtocol, PrinterURI
+from .ReceiveBuffer import ReceiveBufferException, ReceiveBufferTimeout, ReceiveBufferClosed
+from .Exceptions import PrinterBrokerException
+
+class PrinterBroker():
+	# Keeps one connection per printer under control (M601) and executes
+	# protocol calls from clients on it. Clients connect to a Unix socket
+	# and send one JSON object per line, each answered by one JSON line:
+	#   { "uri": "ff://printer", "method": "tx_rx", "args": [ "M119" ], "kwargs": { } }
+	#   { "result": [ ... ] } or { "exception": "ReceiveBufferTimeout", "message": "..." }
+	# Calls to the same printer are serialized, calls to different printers
+	# run concurrently. Control is released once a printer was idle for a
+	# while, so that other software can talk to it again.
+	METHODS = set([ "tx_rx", "set_led_color", "set_led_status", "get_machine_information", "get_machine_progress", "get_machine_status", "get_temperatures", "get_machine_state", "get_current_position", "move_home", "start_print_file", "resume_print", "pause_print", "cancel_print" ])
+	_NAMEDTUPLES = { namedtuple.__name__: namedtuple for namedtuple in [ MachineInformation, PrintProgress, Temperatures, Position, MachineState, MachineStatus ] }
+	_EXCEPTIONS = {
+		"ReceiveBufferTimeout":				ReceiveBufferTimeout,
+		"ReceiveBufferClosed":				ReceiveBufferClosed,
+		"FlashForgeCommunicationException":	FlashForgeCommunicationException,
+		"FlashForgeResponseException":		FlashForgeResponseException,
+		"PrinterBrokerException":			PrinterBrokerException,
+	}
+	# Connection errors are passed on as OSError like without a broker
+	_EXCEPTIONS.update({ exception.__name__: exception for exception in [ OSError, TimeoutError, ConnectionError, ConnectionRefusedError, ConnectionResetError, ConnectionAbortedError, BrokenPipeError ] })
+
+	class _PrinterSession():
+		def __init__(self, uri):
+			self.uri = uri
+			self.name = "%s://%s:%d" % (uri.protocol.value, uri.host, uri.port)
+			self.lock = asyncio.Lock()
+			self.conn = None
+			self.last_used = time.monotonic()
+
+	def __init__(self, socket_path, default_timeout = 1.0, idle_timeout = 60, verbosity = 0):
+		self._socket_path = socket_path
+		self._default_timeout = default_timeout
+		self._idle_timeout = idle_timeout
+		self._verbosity = verbosity
+		self._sessions = { }
+
+	@classmethod
+	def default_socket_path(cls):
+		if "TDPTK_BROKER" in os.environ:
+			return os.environ["TDPTK_BROKER"]
+		runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "/tmp")
+		return os.path.join(runtime_dir, "tdptk-broker-%d.sock" % (os.getuid()))
+
+	@classmethod
+	def connect_to_printer(cls, uri_str, broker_socket = None, default_timeout = 1.0):
+		# Blocking connection to a printer that is used as a context manager,
+		# either through a broker or directly
+		if broker_socket is not None:
+			return BrokeredPrinter(broker_socket, uri_str, default_timeout = default_timeout)
+		uri = PrinterURI.parse(uri_str)
+		if uri.protocol != PrinterProtocol.FlashForge:
+			raise NotImplementedError("Communication not implemented on '%s' protocol printer." % (uri.protocol.name))
+		return FlashForgeProtocol.connect_to_machine(uri.host, port = uri.port, default_timeout = default_timeout)
+
+	@classmethod
+	async def async_connect_to_printer(cls, uri_str, broker_socket = None, default_timeout = 1.0, log_traffic = True):
+		if broker_socket is not None:
+			return await AsyncBrokeredPrinter.connect(broker_socket, uri_str, default_timeout = default_timeout)
+		uri = PrinterURI.parse(uri_str)
+		if uri.protocol != PrinterProtocol.FlashForge:
+			raise NotImplementedError("Communication not implemented on '%s' protocol printer." % (uri.protocol.name))
+		return await AsyncFlashForgeProtocol.connect_to_machine(uri.host, port = uri.port, default_timeout = default_timeout, log_traffic = log_traffic)
+
+	@classmethod
+	def encode_result(cls, result):
+		if isinstance(result, tuple) and (type(result).__name__ in cls._NAMEDTUPLES):
+			return { "namedtuple": type(result).__name__, "fields": { key: cls.encode_result(value) for (key, value) in result._asdict().items() } }
+		return result
+
+	@classmethod
+	def decode_result(cls, result):
+		if isinstance(result, dict) and ("namedtuple" in result) and (result["namedtuple"] in cls._NAMEDTUPLES):
+			return cls._NAMEDTUPLES[result["namedtuple"]](**{ key: cls.decode_result(value) for (key, value) in result["fields"].items() })
+		return result
+
+	@classmethod
+	def decode_exception(cls, response):
+		exception_class = cls._EXCEPTIONS.get(response["exception"])
+		if exception_class is None:
+			return PrinterBrokerException("%s: %s" % (response["exception"], response["message"]))
+		return exception_class(response["message"])
+
+	async def _discard_connection(self, session, release_control):
+		conn = session.conn
+		session.conn = None
+		try:
+			if release_control:
+				await conn.end_communication()
+		except (ReceiveBufferException, OSError, FlashForgeCommunicationException):
+			pass
+		finally:
+			await conn.close()
+
+	async def _get_connection(self, session):
+		if (session.conn is not None) and (not session.conn.connected):
+			if self._verbosity >= 1:
+				print("%s: connection closed by printer" % (session.name))
+			await self._discard_connection(session, release_control = False)
+		if session.conn is None:
+			uri = session.uri
+			if uri.protocol != PrinterProtocol.FlashForge:
+				raise NotImplementedError("Broker not implemented for '%s' protocol printer." % (uri.protocol.name))
+			conn = await AsyncFlashForgeProtocol.connect_to_machine(uri.host, port = uri.port, default_timeout = self._default_timeout, log_traffic = self._verbosity >= 2)
+			try:
+				await conn.start_communication()
+			except:
+				await conn.close()
+				raise
+			session.conn = conn
+			if self._verbosity >= 1:
+				print("%s: took control of printer" % (session.name))
+		return session.conn
+
+	async def _call(self, request):
+		if request.get("method") not in self.METHODS:
+			raise PrinterBrokerException("Method not supported by broker: %s" % (request.get("method")))
+		# Different spellings of the same printer, such as ff://host and
+		# ff://host:8899, must share one session
+		uri = PrinterURI.parse(request["uri"])
+		key = (uri.protocol, uri.host, uri.port)
+		if key not in self._sessions:
+			self._sessions[key] = self._PrinterSession(uri)
+		session = self._sessions[key]
+		async with session.lock:
+			conn = await self._get_connection(session)
+			try:
+				result = await getattr(conn, request["method"])(*request.get("args", [ ]), **request.get("kwargs", { }))
+			except (ReceiveBufferException, OSError):
+				# The session is in an unknown state, start over on the next
+				# request
+				await self._discard_connection(session, release_control = False)
+				raise
+			finally:
+				session.last_used = time.monotonic()
+		return result
+
+	async def _handle_client(self, reader, writer):
+		try:
+			while True:
+				line = await reader.readline()
+				if len(line) == 0:
+					break
+				try:
+					request = json.loads(line)
+					if self._verbosity >= 1:
+						print("%s: %s %s" % (request.get("uri"), request.get("method"), str(request.get("args", [ ]))))
+					response = { "result": self.encode_result(await self._call(request)) }
+				except Exception as e:
+					response = { "exception": e.__class__.__name__, "message": str(e) }
+				writer.write((json.dumps(response) + "\n").encode("utf-8"))
+				await writer.drain()
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	async def _release_idle_sessions(self):
+		while True:
+			await asyncio.sleep(min(self._idle_timeout, 5))
+			now = time.monotonic()
+			for session in list(self._sessions.values()):
+				if (session.conn is not None) and (not session.lock.locked()) and (now - session.last_used >= self._idle_timeout):
+					async with session.lock:
+						if self._verbosity >= 1:
+							print("%s: idle, releasing control of printer" % (session.name))
+						await self._discard_connection(session, release_control = True)
+
+	async def _remove_stale_socket(self):
+		# A socket file is only left over when its broker is gone; taking
+		# over the socket of a running broker would leave that one holding
+		# control over its printers
+		if not os.path.exists(self._socket_path):
+			return
+		try:
+			(reader, writer) = await asyncio.open_unix_connection(self._socket_path)
+		except (ConnectionRefusedError, FileNotFoundError):
+			os.unlink(self._socket_path)
+			return
+		writer.close()
+		raise PrinterBrokerException("Another broker is already listening on %s" % (self._socket_path))
+
+	async def serve(self):
+		await self._remove_stale_socket()
+		# Only the owner may connect, the socket is created with mode 0600
+		umask = os.umask(0o177)
+		try:
+			server = await asyncio.start_unix_server(self._handle_client, path = self._socket_path)
+		finally:
+			os.umask(umask)
+		stopped = asyncio.Event()
+		loop = asyncio.get_running_loop()
+		for signum in [ signal.SIGINT, signal.SIGTERM ]:
+			loop.add_signal_handler(signum, stopped.set)
+		print("Broker listening on %s" % (self._socket_path))
+		idle_task = asyncio.create_task(self._release_idle_sessions())
+		try:
+			async with server:
+				await stopped.wait()
+		finally:
+			idle_task.cancel()
+			for session in self._sessions.values():
+				if session.conn is not None:
+					await self._discard_connection(session, release_control = True)
+			os.unlink(self._socket_path)
+
+class AsyncBrokeredPrinter():
+	# Stands in for an AsyncFlashForgeProtocol, but forwards all calls to a
+	# broker that holds control over the printer
+	def __init__(self, reader, writer, uri, default_timeout = 1.0):
+		self._reader = reader
+		self._writer = writer
+		self._uri = uri
+		self._default_timeout = default_timeout
+
+	@classmethod
+	async def connect(cls, socket_path, uri, default_timeout = 1.0):
+		(reader, writer) = await asyncio.wait_for(asyncio.open_unix_connection(socket_path), timeout = default_timeout)
+		return cls(reader, writer, uri, default_timeout = default_timeout)
+
+	async def _round_trip(self, request):
+		self._writer.write((json.dumps(request) + "\n").encode("utf-8"))
+		await self._writer.drain()
+		line = await self._reader.readline()
+		if len(line) == 0:
+			raise ReceiveBufferClosed("Broker closed connection.")
+		return json.loads(line)
+
+	async def call(self, method, *args, **kwargs):
+		# The timeout covers the whole round trip through the broker. A late
+		# response would be mistaken for the next one, so the connection to
+		# the broker is closed on timeout.
+		request = { "uri": self._uri, "method": method, "args": args, "kwargs": kwargs }
+		timeout = kwargs.get("timeout") or self._default_timeout
+		try:
+			response = await asyncio.wait_for(self._round_trip(request), timeout = timeout)
+		except asyncio.TimeoutError:
+			self._writer.close()
+			raise ReceiveBufferTimeout("Broker did not answer within %.3f secs." % (timeout))
+		if "exception" in response:
+			raise PrinterBroker.decode_exception(response)
+		return PrinterBroker.decode_result(response["result"])
+
+	def __getattr__(self, name):
+		if name not in PrinterBroker.METHODS:
+			raise AttributeError(name)
+		async def call_method(*args, **kwargs):
+			return await self.call(name, *args, **kwargs)
+		return call_method
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.close()
+
+	async def close(self):
+		self._writer.close()
+		await self._writer.wait_closed()
+
+class BrokeredPrinter():
+	# Blocking interface to AsyncBrokeredPrinter, analogous to
+	# FlashForgeProtocol
+	def __init__(self, socket_path, uri, default_timeout = 1.0):
+		self._loop = asyncio.new_event_loop()
+		try:
+			self._printer = self._loop.run_until_complete(AsyncBrokeredPrinter.connect(socket_path, uri, default_timeout = default_timeout))
+		except:
+			self._loop.close()
+			raise
+
+	def __getattr__(self, name):
+		method = getattr(self._printer, name)
+		def run_to_completion(*args, **kwargs):
+			return self._loop.run_until_complete(method(*args, **kwargs))
+		return run_to_completion
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def close(self):
+		if not self._loop.is_closed():
+			self._loop.run_until_complete(self._printer.close())
+			self._loop.close()
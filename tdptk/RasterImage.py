@@ -0,0 +1,216 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import re
+import zlib
+import struct
+import subprocess
+import numpy
+from .NamedStruct import NamedStruct
+
+_BMP_FileHeader = NamedStruct((
+	("2s",		"magic"),
+	("L",		"file_size"),
+	("H",		"reserved1"),
+	("H",		"reserved2"),
+	("L",		"offset_pixels"),
+))
+
+_BMP_InfoHeader = NamedStruct((
+	("L",		"header_size"),
+	("l",		"width"),
+	("l",		"height"),
+	("H",		"planes"),
+	("H",		"bits_per_pixel"),
+	("L",		"compression"),
+	("L",		"image_size"),
+	("l",		"x_pixels_per_meter"),
+	("l",		"y_pixels_per_meter"),
+	("L",		"colors_used"),
+	("L",		"colors_important"),
+))
+
+class RasterImage():
+	_PPM_HEADER_RE = re.compile(rb"P6\s+(?:#[^\n]*\n\s*)*(?P<width>\d+)\s+(?:#[^\n]*\n\s*)*(?P<height>\d+)\s+(?:#[^\n]*\n\s*)*(?P<maxval>\d+)\s")
+	_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+	def __init__(self, pixels):
+		assert(pixels.ndim == 3)
+		assert(pixels.shape[2] == 3)
+		self._pixels = pixels
+
+	@classmethod
+	def create(cls, width, height, color = (0, 0, 0)):
+		pixels = numpy.empty((height, width, 3), dtype = numpy.uint8)
+		pixels[:, :] = color
+		return cls(pixels)
+
+	@classmethod
+	def from_float(cls, pixels):
+		return cls(numpy.clip(numpy.round(pixels * 255), 0, 255).astype(numpy.uint8))
+
+	@classmethod
+	def from_ppm(cls, data):
+		match = cls._PPM_HEADER_RE.match(data)
+		if match is None:
+			raise ValueError("Not a binary PPM image.")
+		(width, height, maxval) = (int(match["width"]), int(match["height"]), int(match["maxval"]))
+		dtype = numpy.uint8 if (maxval < 256) else numpy.dtype(">u2")
+		pixels = numpy.frombuffer(data, dtype = dtype, count = width * height * 3, offset = match.end())
+		if maxval != 255:
+			pixels = (pixels.astype(numpy.uint32) * 255 + maxval // 2) // maxval
+		return cls(pixels.astype(numpy.uint8).reshape(height, width, 3))
+
+	@property
+	def width(self):
+		return self._pixels.shape[1]
+
+	@property
+	def height(self):
+		return self._pixels.shape[0]
+
+	@property
+	def pixels(self):
+		return self._pixels
+
+	@staticmethod
+	def _resize_axis(pixels, dst_size):
+		# Resize along the first axis. Each destination pixel is the
+		# area-weighted average of all source pixels it covers. This is a box
+		# filter when downsampling and degrades gracefully to nearest neighbor
+		# when upsampling.
+		src_size = pixels.shape[0]
+		if src_size == dst_size:
+			return pixels
+		if src_size % dst_size == 0:
+			# Integer factor, the common case for oversampled renderings
+			factor = src_size // dst_size
+			return pixels.reshape(dst_size, factor, *pixels.shape[1:]).mean(axis = 1, dtype = numpy.float32)
+
+		# Every destination pixel covers at most ceil(scale) + 1 source
+		# pixels, so only that many weighted rows are summed up
+		scale = src_size / dst_size
+		edges = numpy.arange(dst_size + 1) * scale
+		first = numpy.floor(edges[:-1]).astype(int)
+		resized = numpy.zeros((dst_size, ) + pixels.shape[1:], dtype = numpy.float32)
+		for offset in range(int(numpy.ceil(scale)) + 1):
+			index = first + offset
+			overlap = numpy.minimum(edges[1:], index + 1) - numpy.maximum(edges[:-1], index)
+			weight = numpy.where(index < src_size, numpy.clip(overlap, 0, None) / scale, 0).astype(numpy.float32)
+			resized += weight.reshape((dst_size, ) + (1, ) * (pixels.ndim - 1)) * pixels.take(numpy.minimum(index, src_size - 1), axis = 0)
+		return resized
+
+	def resize(self, width, height):
+		if (width, height) == (self.width, self.height):
+			return self
+		pixels = self._resize_axis(self._pixels, height)
+		pixels = self._resize_axis(pixels.transpose(1, 0, 2), width).transpose(1, 0, 2)
+		return self.__class__(numpy.clip(numpy.round(pixels), 0, 255).astype(numpy.uint8))
+
+	def trim(self):
+		# Like ImageMagick's "-trim", remove all border rows and columns that
+		# have the same color as the top left corner pixel
+		content = numpy.any(self._pixels != self._pixels[0, 0], axis = 2)
+		rows = numpy.flatnonzero(content.any(axis = 1))
+		cols = numpy.flatnonzero(content.any(axis = 0))
+		if len(rows) == 0:
+			return self
+		return self.__class__(self._pixels[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1])
+
+	def pad_to_aspect(self, width, height, color):
+		# Pad the image centered so that it has the aspect ratio of
+		# width:height
+		if self.width / self.height > width / height:
+			padded_size = (self.width, round(self.width / width * height))
+		else:
+			padded_size = (round(self.height * width / height), self.height)
+		if padded_size == (self.width, self.height):
+			return self
+		padded = self.create(padded_size[0], padded_size[1], color = color)
+		x = (padded_size[0] - self.width) // 2
+		y = (padded_size[1] - self.height) // 2
+		padded.pixels[y : y + self.height, x : x + self.width] = self._pixels
+		return padded
+
+	def to_ppm(self):
+		return ("P6\n%d %d\n255\n" % (self.width, self.height)).encode("ascii") + self._pixels.tobytes()
+
+	def to_png(self, compression_level = 6):
+		def png_chunk(chunk_type, chunk_data):
+			return struct.pack(">L", len(chunk_data)) + chunk_type + chunk_data + struct.pack(">L", zlib.crc32(chunk_type + chunk_data))
+
+		# Every scanline uses the "up" filter, which is cheap to compute for
+		# the whole image at once and compresses rendered images well
+		rows = self._pixels.reshape(self.height, 3 * self.width)
+		filtered = numpy.empty((self.height, 1 + 3 * self.width), dtype = numpy.uint8)
+		filtered[:, 0] = 2
+		filtered[0, 1:] = rows[0]
+		filtered[1:, 1:] = rows[1:] - rows[:-1]
+
+		ihdr = struct.pack(">LLBBBBB", self.width, self.height, 8, 2, 0, 0, 0)
+		return self._PNG_SIGNATURE + png_chunk(b"IHDR", ihdr) + png_chunk(b"IDAT", zlib.compress(filtered.tobytes(), compression_level)) + png_chunk(b"IEND", b"")
+
+	def to_bmp(self):
+		# 24 bit uncompressed, rows stored bottom-up in BGR order and padded
+		# to a multiple of four bytes
+		stride = (3 * self.width + 3) // 4 * 4
+		rows = numpy.zeros((self.height, stride), dtype = numpy.uint8)
+		rows[:, : 3 * self.width] = self._pixels[::-1, :, ::-1].reshape(self.height, 3 * self.width)
+		pixel_data = rows.tobytes()
+
+		offset_pixels = _BMP_FileHeader.size + _BMP_InfoHeader.size
+		file_header = _BMP_FileHeader.pack({
+			"magic":				b"BM",
+			"file_size":			offset_pixels + len(pixel_data),
+			"reserved1":			0,
+			"reserved2":			0,
+			"offset_pixels":		offset_pixels,
+		})
+		info_header = _BMP_InfoHeader.pack({
+			"header_size":			_BMP_InfoHeader.size,
+			"width":				self.width,
+			"height":				self.height,
+			"planes":				1,
+			"bits_per_pixel":		24,
+			"compression":			0,
+			"image_size":			len(pixel_data),
+			"x_pixels_per_meter":	2835,
+			"y_pixels_per_meter":	2835,
+			"colors_used":			0,
+			"colors_important":		0,
+		})
+		return file_header + info_header + pixel_data
+
+	def write(self, filename):
+		extension = os.path.splitext(filename)[1].lower()
+		if extension == ".png":
+			data = self.to_png()
+		elif extension == ".bmp":
+			data = self.to_bmp()
+		elif extension == ".ppm":
+			data = self.to_ppm()
+		else:
+			# Let ImageMagick take care of any other file format
+			subprocess.run([ "convert", "ppm:-", filename ], input = self.to_ppm(), check = True)
+			return
+		with open(filename, "wb") as f:
+			f.write(data)
@@ -22,25 +22,35 @@
 import time
 import socket
 import select
+import asyncio
 
 class ReceiveBufferException(Exception): pass
 class ReceiveBufferTimeout(ReceiveBufferException): pass
 class ReceiveBufferClosed(ReceiveBufferException): pass
 
 class ReceiveBuffer():
-	def __init__(self, nonblocking_read_callback, block_until_readable_bytes_callback, default_timeout = 1.0, line_splitter = b"\r\n"):
-		self._nonblocking_read_callback = nonblocking_read_callback
+	# Received data lives in one preallocated buffer between the "head"
+	# (first unconsumed byte) and "tail" (end of received data) offsets.
+	# Consuming data only advances the head and the delimiter search
+	# resumes where the previous one stopped, so that a response that
+	# arrives in many small pieces is scanned only once.
+	def __init__(self, nonblocking_read_into_callback, block_until_readable_bytes_callback, default_timeout = 1.0, line_splitter = b"\r\n", read_chunk_size = 4096):
+		self._nonblocking_read_into_callback = nonblocking_read_into_callback
 		self._block_until_readable_bytes_callback = block_until_readable_bytes_callback
 		self._line_splitter = line_splitter
-		self._rx_buffer = bytearray()
+		self._read_chunk_size = read_chunk_size
+		self._rx_buffer = bytearray(2 * read_chunk_size)
+		self._head = 0
+		self._tail = 0
+		self._scan_offset = 0
 		self._default_timeout = default_timeout
 		self._closed = False
 
 	@classmethod
 	def create_for_socket(cls, conn, read_chunk_size = 4096, **kwargs):
-		nonblocking_read_callback = lambda: conn.recv(read_chunk_size)
+		nonblocking_read_into_callback = lambda buffer: conn.recv_into(buffer)
 		def block_until_readable_bytes_callback(length, abs_timeout):
-			timeout = abs_timeout - time.time()
+			timeout = abs_timeout - time.monotonic()
 			if timeout <= 0:
 				# Time already passed
 				return False
@@ -48,54 +58,184 @@ class ReceiveBuffer():
 			return len(rsock) != 0
 
 		kwargs.update({
-			"nonblocking_read_callback": nonblocking_read_callback,
+			"nonblocking_read_into_callback": nonblocking_read_into_callback,
 			"block_until_readable_bytes_callback": block_until_readable_bytes_callback,
+			"read_chunk_size": read_chunk_size,
 		})
 		return cls(**kwargs)
 
+	@property
+	def buffered_bytes(self):
+		return self._tail - self._head
+
+	def _make_room(self):
+		# Ensures that at least one read chunk fits behind the tail, first by
+		# moving unconsumed data to the front and only then by growing
+		if len(self._rx_buffer) - self._tail >= self._read_chunk_size:
+			return
+		if self._head > 0:
+			length = self._tail - self._head
+			self._rx_buffer[:length] = self._rx_buffer[self._head : self._tail]
+			self._scan_offset -= self._head
+			self._head = 0
+			self._tail = length
+		if len(self._rx_buffer) - self._tail < self._read_chunk_size:
+			self._rx_buffer.extend(bytes(len(self._rx_buffer)))
+
+	def get_buffer(self):
+		# Returns a view of the free space behind the received data, into
+		# which up to one read chunk is received; the view must be released
+		# before buffer_updated() is called
+		self._make_room()
+		return memoryview(self._rx_buffer)[self._tail : self._tail + self._read_chunk_size]
+
+	def buffer_updated(self, length):
+		self._tail += length
+
+	def _receive(self):
+		with self.get_buffer() as view:
+			length = self._nonblocking_read_into_callback(view)
+		if length == 0:
+			# Remote closed connection.
+			self._closed = True
+			raise ReceiveBufferClosed("Peer closed connection.")
+		self.buffer_updated(length)
+
+	def _consume(self, end, skip = 0):
+		# Data is returned as a copy because the buffer is reused as soon as
+		# the next data is received
+		result = bytes(self._rx_buffer[self._head : end])
+		self._head = end + skip
+		if self._head == self._tail:
+			self._head = 0
+			self._tail = 0
+		self._scan_offset = self._head
+		return result
+
 	def _wait_for_condition(self, splitter_condition, wait_for_bytes, timeout = None):
 		if self._closed:
 			raise ReceiveBufferClosed("Peer closed connection.")
 
 		if timeout is None:
 			timeout = self._default_timeout
-		abs_timeout = time.time() + timeout
+		abs_timeout = time.monotonic() + timeout
 
-		while (not self._closed) and (time.time() < abs_timeout):
-			split_line = splitter_condition(self._rx_buffer)
-			if len(split_line) == 2:
-				(result, self._rx_buffer) = split_line
+		while (not self._closed) and (time.monotonic() < abs_timeout):
+			result = splitter_condition()
+			if result is not None:
 				return result
 
-			remaining_bytes = wait_for_bytes(self._rx_buffer)
+			remaining_bytes = wait_for_bytes()
 			if self._block_until_readable_bytes_callback(remaining_bytes, abs_timeout):
-				new_data = self._nonblocking_read_callback()
-				if len(new_data) == 0:
-					# Remote closed connection.
-					self._closed = True
-					raise ReceiveBufferClosed("Peer closed connection.")
-				self._rx_buffer += new_data
+				self._receive()
 
 		# Timeout
 		raise ReceiveBufferTimeout("Timeout after %.3f secs" % (timeout))
 
 	def waitbytes(self, length, timeout = None):
-		def splitter_condition(rx_buffer):
-			if len(rx_buffer) < length:
-				return (rx_buffer, )
+		def splitter_condition():
+			if self.buffered_bytes < length:
+				return None
 			else:
-				return (rx_buffer[:length], rx_buffer[length:])
-		def wait_for_bytes(rx_buffer):
-			return length - len(rx_buffer)
+				return self._consume(self._head + length)
+		def wait_for_bytes():
+			return length - self.buffered_bytes
 		return self._wait_for_condition(splitter_condition = splitter_condition, wait_for_bytes = wait_for_bytes, timeout = timeout)
 
+	def pop_line(self):
+		# Returns the next complete line without its delimiter or None
+		index = self._rx_buffer.find(self._line_splitter, self._scan_offset, self._tail)
+		if index == -1:
+			# The delimiter may straddle the end of the received data
+			self._scan_offset = max(self._head, self._tail - len(self._line_splitter) + 1)
+			return None
+		else:
+			return self._consume(index, skip = len(self._line_splitter))
+
 	def waitline(self, timeout = None):
-		def splitter_condition(rx_buffer):
-			return rx_buffer.split(self._line_splitter, maxsplit = 1)
-		def wait_for_bytes(rx_buffer):
+		def wait_for_bytes():
 			return len(self._line_splitter)
-		return self._wait_for_condition(splitter_condition = splitter_condition, wait_for_bytes = wait_for_bytes, timeout = timeout)
+		return self._wait_for_condition(splitter_condition = self.pop_line, wait_for_bytes = wait_for_bytes, timeout = timeout)
+
+class ReceiveBufferProtocol(asyncio.BufferedProtocol):
+	# asyncio counterpart of ReceiveBuffer.create_for_socket(): the transport
+	# receives directly into the buffer of a ReceiveBuffer and lines are
+	# scanned for incrementally. Also provides flow control for writing.
+	def __init__(self, line_splitter = b"\r\n", read_chunk_size = 4096):
+		self._rx_buffer = ReceiveBuffer(nonblocking_read_into_callback = None, block_until_readable_bytes_callback = None, line_splitter = line_splitter, read_chunk_size = read_chunk_size)
+		self._transport = None
+		self._receive_view = None
+		self._data_received = asyncio.Event()
+		self._writable = asyncio.Event()
+		self._writable.set()
+		self._closed = False
+		self._connection_lost = asyncio.get_running_loop().create_future()
+
+	@property
+	def connected(self):
+		return (not self._closed) and (not self._transport.is_closing())
+
+	def connection_made(self, transport):
+		self._transport = transport
+
+	def get_buffer(self, sizehint):
+		# The previous view is released so that the buffer may be compacted
+		# or grown
+		if self._receive_view is not None:
+			self._receive_view.release()
+		self._receive_view = self._rx_buffer.get_buffer()
+		return self._receive_view
+
+	def buffer_updated(self, nbytes):
+		self._receive_view.release()
+		self._receive_view = None
+		self._rx_buffer.buffer_updated(nbytes)
+		self._data_received.set()
+
+	def eof_received(self):
+		self._closed = True
+		self._data_received.set()
+		return False
+
+	def connection_lost(self, exc):
+		self._closed = True
+		self._data_received.set()
+		self._writable.set()
+		if not self._connection_lost.done():
+			self._connection_lost.set_result(None)
+
+	def pause_writing(self):
+		self._writable.clear()
+
+	def resume_writing(self):
+		self._writable.set()
+
+	def write(self, data):
+		self._transport.write(data)
+
+	async def drain(self):
+		if self._closed:
+			raise ConnectionResetError("Connection lost.")
+		await self._writable.wait()
+
+	async def readline(self, timeout):
+		loop = asyncio.get_running_loop()
+		abs_timeout = loop.time() + timeout
+		while True:
+			line = self._rx_buffer.pop_line()
+			if line is not None:
+				return line
+			if self._closed:
+				raise ReceiveBufferClosed("Peer closed connection.")
+			self._data_received.clear()
+			try:
+				await asyncio.wait_for(self._data_received.wait(), timeout = max(abs_timeout - loop.time(), 0))
+			except asyncio.TimeoutError:
+				raise ReceiveBufferTimeout("Timeout after %.3f secs" % (timeout))
 
+	async def close(self):
+		self._transport.close()
+		await self._connection_lost
 
 if __name__ == "__main__":
 	(host, port) = ("127.0.0.1", 9999)
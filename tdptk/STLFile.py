@@ -19,7 +19,13 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
+import re
+import mmap
+import collections
+import numpy
 from .NamedStruct import NamedStruct
+from .Exceptions import MalformedSTLException
 
 _STL_Header = NamedStruct((
 	("80s",		"header"),
@@ -42,23 +48,195 @@ _STL_Triangle = NamedStruct((
 	("H",		"attribute_byte_count"),
 ))
 
+# Vertices and normals of a facet record viewed as arrays
+_STL_GEOMETRY_DTYPE = numpy.dtype({
+	"names":		[ "normal", "vertices" ],
+	"formats":		[ ("<f4", (3, )), ("<f4", (3, 3)) ],
+	"offsets":		[ 0, 12 ],
+	"itemsize":		_STL_Triangle.size,
+})
+
 class STLFile():
-	def __init__(self):
-		self._triangles = [ ]
+	IndexedMesh = collections.namedtuple("IndexedMesh", [ "vertices", "faces" ])
+	_ASCII_CHUNK_SIZE = 16 * 1024 * 1024
+	_ASCII_SOLID_RE = re.compile(rb"(?:end)?solid[^\n]*")
+	# Maps all letters except "e" (which occurs in exponents) and all
+	# whitespace to spaces
+	_ASCII_STRIP_TABLE = bytes.maketrans(b"abcdfghijklmnopqrstuvwxyz\t\r\n", b" " * 28)
+
+	def __init__(self, facets = None):
+		if facets is None:
+			facets = numpy.zeros(0, dtype = _STL_Triangle.dtype)
+		self._facets = facets
+		self._appended = [ ]
 
 	def append(self, triangle):
-		self._triangles.append(triangle)
+		self._appended.append(tuple(triangle))
+
+	@classmethod
+	def is_ascii(cls, filename):
+		# Binary files may start with "solid" as well, but then their size
+		# matches the facet count in the header
+		with open(filename, "rb") as f:
+			head = f.read(_STL_Header.size)
+		if len(head) == _STL_Header.size:
+			header = _STL_Header.unpack(head)
+			if os.stat(filename).st_size == _STL_Header.size + (header.triangle_count * _STL_Triangle.size):
+				return False
+		return head.lstrip().lower().startswith(b"solid")
 
 	@classmethod
 	def read(cls, filename):
-		stl_file = cls()
+		if cls.is_ascii(filename):
+			return cls.read_ascii(filename)
+		else:
+			return cls.read_binary(filename)
+
+	@classmethod
+	def read_binary(cls, filename):
+		# The file is memory-mapped and facets are a view into it, nothing is
+		# read until it is accessed
+		with open(filename, "rb") as f:
+			file_size = os.fstat(f.fileno()).st_size
+			if file_size < _STL_Header.size:
+				raise MalformedSTLException("Binary STL file is too short for its header: %d bytes." % (file_size))
+			data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		header = _STL_Header.unpack_head(data)
+		if file_size < _STL_Header.size + (header.triangle_count * _STL_Triangle.size):
+			raise MalformedSTLException("Binary STL file of %d bytes is too short for %d facets." % (file_size, header.triangle_count))
+		return cls(_STL_Triangle.unpack_array(data, count = header.triangle_count, offset = _STL_Header.size))
+
+	@classmethod
+	def _parse_ascii_facets(cls, data):
+		# Strip all keywords so that only the numbers remain, which are then
+		# converted by NumPy in one go: the normal and three vertices of
+		# every facet. After removing all other letters, an "e" that
+		# follows a space is a remainder of a keyword, not an exponent.
+		facet_count = data.count(b"endfacet")
+		if b"solid" in data:
+			data = cls._ASCII_SOLID_RE.sub(b" ", data)
+		data = (b" " + data).translate(cls._ASCII_STRIP_TABLE).replace(b" e", b"  ")
+		try:
+			values = numpy.fromstring(data, sep = " ")
+		except ValueError as e:
+			raise MalformedSTLException("ASCII STL data contains invalid values: %s" % (str(e)))
+		if len(values) != facet_count * 12:
+			raise MalformedSTLException("ASCII STL data contains %d values for %d facets, expected %d." % (len(values), facet_count, facet_count * 12))
+		values = values.reshape(-1, 12)
+		facets = numpy.zeros(facet_count, dtype = _STL_Triangle.dtype)
+		geometry = facets.view(_STL_GEOMETRY_DTYPE)
+		geometry["normal"] = values[:, 0 : 3]
+		geometry["vertices"] = values[:, 3 : 12].reshape(-1, 3, 3)
+		return facets
 
+	@classmethod
+	def read_ascii(cls, filename):
+		# The file is read in chunks, each of which is cut after its last
+		# complete facet; the rest is carried over to the next chunk
+		facet_arrays = [ ]
+		remainder = b""
 		with open(filename, "rb") as f:
-			header = _STL_Header.unpack_from_file(f)
-			for i in range(header.triangle_count):
-				triangle = _STL_Triangle.unpack_from_file(f)
-				stl_file.append(triangle)
-		return stl_file
+			while True:
+				chunk = f.read(cls._ASCII_CHUNK_SIZE)
+				data = remainder + chunk.lower()
+				end = data.rfind(b"endfacet")
+				if end == -1:
+					remainder = data
+				else:
+					end += len(b"endfacet")
+					facet_arrays.append(cls._parse_ascii_facets(data[:end]))
+					remainder = data[end:]
+				if len(chunk) == 0:
+					break
+		trailer = remainder.split()
+		if (len(trailer) > 0) and (trailer[0] not in [ b"endsolid", b"solid" ]):
+			raise MalformedSTLException("ASCII STL ends with incomplete facet data.")
+		if len(facet_arrays) == 0:
+			return cls()
+		return cls(numpy.concatenate(facet_arrays))
+
+	@property
+	def facets(self):
+		if len(self._appended) > 0:
+			self._facets = numpy.concatenate([ self._facets, numpy.array(self._appended, dtype = _STL_Triangle.dtype) ])
+			self._appended = [ ]
+		return self._facets
+
+	@property
+	def normals(self):
+		# Shape (n, 3), a view into the facets
+		return self.facets.view(_STL_GEOMETRY_DTYPE)["normal"]
+
+	@property
+	def vertices(self):
+		# Shape (n, 3, 3) indexed by facet, vertex and coordinate, a view into
+		# the facets
+		return self.facets.view(_STL_GEOMETRY_DTYPE)["vertices"]
+
+	def __len__(self):
+		return len(self._facets) + len(self._appended)
 
 	def __iter__(self):
-		return iter(self._triangles)
+		return _STL_Triangle.iter_unpack(self.facets)
+
+	def indexed_mesh(self):
+		# Weld vertices which share the exact same coordinates so that every
+		# vertex is only stored once and faces refer to it by index. Adding
+		# zero turns -0.0 into 0.0 so that both are treated as equal.
+		vertices = numpy.ascontiguousarray(self.vertices.reshape(-1, 3) + numpy.float32(0))
+		if len(vertices) == 0:
+			return self.IndexedMesh(vertices = numpy.zeros((0, 3)), faces = numpy.zeros((0, 3), dtype = numpy.int64))
+
+		# Sort the bit patterns of all coordinates, every change between
+		# consecutive sorted entries starts a new unique vertex
+		bits = vertices.view(numpy.uint32)
+		bits_xy = (bits[:, 0].astype(numpy.uint64) << 32) | bits[:, 1]
+		order = numpy.lexsort((bits[:, 2], bits_xy))
+		(sorted_xy, sorted_z) = (bits_xy[order], bits[order, 2])
+		first = numpy.empty(len(order), dtype = bool)
+		first[0] = True
+		first[1:] = (sorted_xy[1:] != sorted_xy[:-1]) | (sorted_z[1:] != sorted_z[:-1])
+		faces = numpy.empty(len(order), dtype = numpy.int64)
+		faces[order] = numpy.cumsum(first) - 1
+		return self.IndexedMesh(vertices = vertices[order[first]].astype(numpy.float64), faces = faces.reshape(-1, 3))
+
+	def bounding_box(self):
+		vertices = self.vertices.reshape(-1, 3)
+		if len(vertices) == 0:
+			return (numpy.zeros(3), numpy.zeros(3))
+		return (vertices.min(axis = 0).astype(numpy.float64), vertices.max(axis = 0).astype(numpy.float64))
+
+	def _face_cross_products(self):
+		vertices = self.vertices.astype(numpy.float64)
+		return numpy.cross(vertices[:, 1] - vertices[:, 0], vertices[:, 2] - vertices[:, 0])
+
+	def surface_area(self):
+		return float(numpy.linalg.norm(self._face_cross_products(), axis = 1).sum() / 2)
+
+	def signed_volume(self):
+		# Sum of the signed volumes of the tetrahedra spanned by the origin
+		# and every facet; positive for outward facing facets
+		vertices = self.vertices.astype(numpy.float64)
+		return float(numpy.einsum("ij,ij->", vertices[:, 0], numpy.cross(vertices[:, 1], vertices[:, 2])) / 6)
+
+	def non_manifold_edge_count(self):
+		# In a closed manifold mesh, every edge is shared by exactly two
+		# facets
+		mesh = self.indexed_mesh()
+		edges = numpy.sort(mesh.faces[:, [ 0, 1, 1, 2, 2, 0 ]].reshape(-1, 2), axis = 1)
+		edges = edges[edges[:, 0] != edges[:, 1]]
+		(unique_edges, counts) = numpy.unique(edges[:, 0] * len(mesh.vertices) + edges[:, 1], return_counts = True)
+		return int(numpy.count_nonzero(counts != 2))
+
+	@staticmethod
+	def vertex_normals(mesh):
+		# Area-weighted average of the normals of all adjacent faces, which
+		# gives a smooth shading across welded vertices
+		corners = mesh.vertices[mesh.faces]
+		face_normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+		normals = numpy.zeros_like(mesh.vertices)
+		for i in range(3):
+			numpy.add.at(normals, mesh.faces[:, i], face_normals)
+		lengths = numpy.linalg.norm(normals, axis = 1)
+		lengths[lengths == 0] = 1
+		return normals / lengths[:, None]
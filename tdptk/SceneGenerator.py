@@ -0,0 +1,114 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+from .XGCodeFile import XGCodeFile
+from .GCodeInterpreter import GCodeBaseInterpreter, GCodeParser, GCodeInformationHook, GCodePOVRayHook, PrintingRegion
+from .STLFile import STLFile
+from .GeometryFilters import LODGeometryFilter, OcclusionGeometryFilter
+from .MeshDecimation import MeshDecimator
+
+class SceneGenerator():
+	_REGIONS = (PrintingRegion.Shell, PrintingRegion.Infill)
+
+	def __init__(self, input_filename, filetype = "auto", lod_resolution = None, cull_resolution = None, layer_window = None, smooth_normals = False, decimation_mode = None, facet_budget = None, verbosity = 0):
+		self._input_filename = input_filename
+		self._decimation_mode = decimation_mode
+		self._facet_budget = facet_budget
+		self._smooth_normals = smooth_normals
+		self._layer_window = layer_window
+		self._lod_resolution = lod_resolution
+		self._cull_resolution = cull_resolution
+		self._verbosity = verbosity
+		if filetype == "auto":
+			self._filetype = os.path.splitext(input_filename)[1][1:].lower()
+		else:
+			self._filetype = filetype
+		if self._filetype not in [ "gx", "g", "stl" ]:
+			raise NotImplementedError("Unknown input file type: %s" % (self._filetype))
+		self._input_data = None
+
+	@property
+	def filetype(self):
+		return self._filetype
+
+	@property
+	def input_data(self):
+		if self._input_data is None:
+			if self._filetype == "gx":
+				self._input_data = XGCodeFile.read(self._input_filename).gcode_data
+			else:
+				with open(self._input_filename, "rb") as f:
+					self._input_data = f.read()
+		return self._input_data
+
+	def geometry_parameters(self, povray_renderer):
+		if self._filetype in [ "gx", "g" ]:
+			return {
+				"input":				"gcode",
+				"regions":				[ region.value for region in self._REGIONS ],
+				"cylinder_diameter":	povray_renderer.cylinder_diameter,
+				"lod_resolution":		self._lod_resolution,
+				"cull_resolution":		self._cull_resolution,
+				"layer_window":			None if (self._layer_window is None) else str(self._layer_window),
+			}
+		else:
+			return {
+				"input":				self._filetype,
+				"smooth_normals":		self._smooth_normals,
+				"decimation_mode":		None if (self._decimation_mode is None) else self._decimation_mode.value,
+				"facet_budget":			self._facet_budget,
+			}
+
+	def add_geometry(self, povray_renderer):
+		if self._filetype in [ "gx", "g" ]:
+			# Occlusion culling happens last so that it operates on the
+			# geometry which is actually rendered
+			target = povray_renderer
+			if self._cull_resolution is not None:
+				target = OcclusionGeometryFilter(target, resolution = self._cull_resolution, verbosity = self._verbosity)
+			if self._lod_resolution is not None:
+				target = LODGeometryFilter(target, resolution = self._lod_resolution, verbosity = self._verbosity)
+			info = GCodeInformationHook()
+			parser = GCodeParser(GCodeBaseInterpreter(hooks = [ info, GCodePOVRayHook(target, info, regions = self._REGIONS) ], window = self._layer_window))
+			parser.parse_all(self.input_data.decode("ascii"))
+			if target is not povray_renderer:
+				target.flush()
+		elif self._filetype == "stl":
+			stl = STLFile.read(self._input_filename)
+			mesh = stl.indexed_mesh()
+			if self._verbosity >= 1:
+				print("Welded %d facets to %d vertices." % (len(mesh.faces), len(mesh.vertices)))
+			if self._decimation_mode is not None:
+				mesh = MeshDecimator(self._decimation_mode, verbosity = self._verbosity).decimate(mesh, self._facet_budget)
+			if len(mesh.faces) > 0:
+				vertex_normals = STLFile.vertex_normals(mesh) if self._smooth_normals else None
+				povray_renderer.add_mesh(mesh.vertices, mesh.faces, vertex_normals = vertex_normals)
+
+	def geometry_include(self, povray_renderer, cache):
+		# Geometry is only generated when it is not already cached from a
+		# previous rendering of the same input
+		cache_key = cache.key(self.input_data, **self.geometry_parameters(povray_renderer))
+		geometry_include = cache.lookup(cache_key)
+		if geometry_include is None:
+			self.add_geometry(povray_renderer)
+			geometry_include = cache.store(cache_key, povray_renderer)
+		return geometry_include
@@ -0,0 +1,158 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import re
+import time
+import signal
+import asyncio
+import collections
+from .TelemetryStore import TelemetryColumn, TelemetryWriter
+from .PrinterBroker import PrinterBroker
+from .PrinterURI import PrinterURI
+
+class TelemetryPoller():
+	# Codes under which M119 states are stored, unknown states are stored
+	# as 0
+	MACHINE_STATUS = [ "UNKNOWN", "READY", "BUILDING_FROM_SD", "BUILDING_COMPLETED", "PAUSED", "BUSY" ]
+	MOVE_MODE = [ "UNKNOWN", "READY", "MOVING", "PAUSED", "WAIT_ON_TOOL", "HOMING" ]
+
+	SERIES = collections.OrderedDict((
+		("progress", (
+			TelemetryColumn("progress", "u8"),
+			TelemetryColumn("total", "u8"),
+		)),
+		("temperature", (
+			TelemetryColumn("extruder", "f4"),
+			TelemetryColumn("extruder_target", "f4"),
+			TelemetryColumn("bed", "f4"),
+			TelemetryColumn("bed_target", "f4"),
+		)),
+		("position", (
+			TelemetryColumn("x", "f8"),
+			TelemetryColumn("y", "f8"),
+			TelemetryColumn("z", "f8"),
+			TelemetryColumn("a", "f8"),
+			TelemetryColumn("b", "f8"),
+		)),
+		("state", (
+			TelemetryColumn("machine_status", "u1"),
+			TelemetryColumn("move_mode", "u1"),
+		)),
+	))
+	_BACKOFF_INITIAL_SECS = 1
+	_BACKOFF_MAX_SECS = 60
+
+	def __init__(self, directory, uris, intervals, broker_socket = None, default_timeout = 1.0, verbosity = 0):
+		# intervals maps series names to their sampling interval in seconds
+		self._directory = directory
+		self._uris = uris
+		self._intervals = intervals
+		self._broker_socket = broker_socket
+		self._default_timeout = default_timeout
+		self._verbosity = verbosity
+		# Parsed up front so that an invalid URI is reported right away
+		self._printer_names = { uri_str: self.printer_name(uri_str) for uri_str in uris }
+
+	@classmethod
+	def printer_name(cls, uri_str):
+		# ff://host and ff://host:8899 are the same printer and share one
+		# directory
+		uri = PrinterURI.parse(uri_str)
+		return re.sub(r"[^A-Za-z0-9.-]", "_", "%s_%d" % (uri.host, uri.port))
+
+	@classmethod
+	def _code(cls, names, name):
+		return names.index(name) if (name in names) else 0
+
+	async def _sample(self, conn, series):
+		if series == "progress":
+			progress = await conn.get_machine_progress()
+			return (progress.progress, progress.total)
+		elif series == "temperature":
+			return tuple(await conn.get_temperatures())
+		elif series == "position":
+			return tuple(await conn.get_current_position())
+		elif series == "state":
+			state = await conn.get_machine_state()
+			return (self._code(self.MACHINE_STATUS, state.machine_status), self._code(self.MOVE_MODE, state.move_mode))
+		else:
+			raise NotImplementedError(series)
+
+	async def _poll_connection(self, conn, writers, sampled_callback):
+		# Samples every series when it is due. Samples that could not be
+		# taken in time are skipped rather than taken in a burst.
+		loop = asyncio.get_running_loop()
+		next_due = { series: loop.time() for series in self._intervals }
+		while True:
+			series = min(next_due, key = next_due.get)
+			delay = next_due[series] - loop.time()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			values = await self._sample(conn, series)
+			writers[series].append(time.time(), values)
+			sampled_callback()
+			next_due[series] = max(next_due[series] + self._intervals[series], loop.time())
+
+	async def _poll_printer(self, uri_str):
+		printer = self._printer_names[uri_str]
+		writers = { series: TelemetryWriter(self._directory, printer, series, self.SERIES[series]) for series in self._intervals }
+		backoff = self._BACKOFF_INITIAL_SECS
+		def reset_backoff():
+			# Only a printer that delivers samples counts as recovered, not
+			# one that accepts the connection and then sends garbage
+			nonlocal backoff
+			backoff = self._BACKOFF_INITIAL_SECS
+
+		try:
+			while True:
+				try:
+					conn = await PrinterBroker.async_connect_to_printer(uri_str, broker_socket = self._broker_socket, default_timeout = self._default_timeout, log_traffic = self._verbosity >= 2)
+					async with conn:
+						if self._verbosity >= 1:
+							print("%s: polling %s" % (uri_str, ", ".join("%s every %.1f secs" % (series, interval) for (series, interval) in self._intervals.items())))
+						await self._poll_connection(conn, writers, reset_backoff)
+				except Exception as e:
+					# Also unexpected responses that a parser rejects; a single
+					# misbehaving printer must not end its polling for good
+					print("%s: %s: %s, reconnecting in %d secs" % (uri_str, e.__class__.__name__, str(e), backoff))
+					# Samples taken so far must not wait in memory for the
+					# printer to come back
+					for writer in writers.values():
+						writer.flush()
+					await asyncio.sleep(backoff)
+					backoff = min(2 * backoff, self._BACKOFF_MAX_SECS)
+		finally:
+			for writer in writers.values():
+				writer.close()
+
+	async def run(self):
+		stopped = asyncio.Event()
+		loop = asyncio.get_running_loop()
+		for signum in [ signal.SIGINT, signal.SIGTERM ]:
+			loop.add_signal_handler(signum, stopped.set)
+		tasks = [ asyncio.create_task(self._poll_printer(uri_str)) for uri_str in self._uris ]
+		await stopped.wait()
+		for task in tasks:
+			task.cancel()
+		results = await asyncio.gather(*tasks, return_exceptions = True)
+		for (uri_str, result) in zip(self._uris, results):
+			if isinstance(result, Exception):
+				print("%s: polling failed: %s: %s" % (uri_str, result.__class__.__name__, str(result)))
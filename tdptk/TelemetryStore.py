@@ -0,0 +1,223 @@
+#	tdptk - 3d Printing Toolkit
+#	Copyright (C) 2021-2021 Johannes Bauer
+#
+#	This file is part of tdptk.
+#
+#	tdptk is free software; you can redistribute it and/or modify
+#	it under the terms of the GNU General Public License as published by
+#	the Free Software Foundation; this program is ONLY licensed under
+#	version 3 of the License, later versions are explicitly excluded.
+#
+#	tdptk is distributed in the hope that it will be useful,
+#	but WITHOUT ANY WARRANTY; without even the implied warranty of
+#	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#	GNU General Public License for more details.
+#
+#	You should have received a copy of the GNU General Public License
+#	along with tdptk; if not, write to the Free Software
+#	Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+#	Johannes Bauer <JohannesBauer@gmx.de>
+
+import os
+import re
+import collections
+import numpy
+from .NamedStruct import NamedStruct
+from .Exceptions import TelemetryException
+
+TelemetryColumn = collections.namedtuple("TelemetryColumn", [ "name", "dtype" ])
+
+class TelemetrySegmentWriter():
+	# A segment file starts with a header that describes the columns of its
+	# series, followed by blocks. Every block holds a number of samples and
+	# stores them column by column, so that a column of a block can be read
+	# as one contiguous array.
+	_FILE_MAGIC = b"TDTM"
+	_BLOCK_MAGIC = 0x544d424b
+
+	FileHeader = NamedStruct((
+		("4s",	"magic"),
+		("H",	"version"),
+		("H",	"column_count"),
+		("16s",	"series"),
+	))
+
+	ColumnHeader = NamedStruct((
+		("16s",	"name"),
+		("8s",	"dtype"),
+	))
+
+	BlockHeader = NamedStruct((
+		("L",	"magic"),
+		("L",	"sample_count"),
+		("d",	"t_first"),
+		("d",	"t_last"),
+	))
+
+	def __init__(self, filename, series, columns):
+		self._f = open(filename, "xb")
+		self._f.write(self.FileHeader.pack({
+			"magic":		self._FILE_MAGIC,
+			"version":		1,
+			"column_count":	len(columns),
+			"series":		series.encode("ascii"),
+		}))
+		for column in columns:
+			self._f.write(self.ColumnHeader.pack({
+				"name":		column.name.encode("ascii"),
+				"dtype":	numpy.dtype(column.dtype).newbyteorder("<").str.encode("ascii"),
+			}))
+
+	@property
+	def size(self):
+		return self._f.tell()
+
+	def write_block(self, arrays):
+		# The first column is the sample time
+		sample_count = len(arrays[0])
+		self._f.write(self.BlockHeader.pack({
+			"magic":		self._BLOCK_MAGIC,
+			"sample_count":	sample_count,
+			"t_first":		arrays[0][0],
+			"t_last":		arrays[0][-1],
+		}))
+		for array in arrays:
+			self._f.write(array.astype(array.dtype.newbyteorder("<"), copy = False).tobytes())
+		self._f.flush()
+
+	def close(self):
+		self._f.close()
+
+class TelemetryWriter():
+	# Appends samples of one series of one printer. Samples are buffered and
+	# written as one block when the block is full or when the oldest
+	# buffered sample is older than flush_interval. Segments are rotated
+	# once they grow beyond max_segment_size.
+	def __init__(self, directory, printer, series, columns, block_size = 256, flush_interval = 30, max_segment_size = 16 * 1024 * 1024):
+		self._directory = os.path.join(directory, printer)
+		self._series = series
+		self._columns = [ TelemetryColumn("t", "f8") ] + list(columns)
+		self._block_size = block_size
+		self._flush_interval = flush_interval
+		self._max_segment_size = max_segment_size
+		self._buffer = [ numpy.empty(block_size, dtype = column.dtype) for column in self._columns ]
+		self._buffered = 0
+		self._segment = None
+
+	def _open_segment(self):
+		os.makedirs(self._directory, exist_ok = True)
+		segment_no = len(TelemetryStore.segment_filenames(self._directory, self._series))
+		while True:
+			filename = os.path.join(self._directory, "%s-%06d.tdtm" % (self._series, segment_no))
+			try:
+				return TelemetrySegmentWriter(filename, self._series, self._columns)
+			except FileExistsError:
+				segment_no += 1
+
+	def append(self, t, values):
+		assert(len(values) == len(self._columns) - 1)
+		self._buffer[0][self._buffered] = t
+		for (column_buffer, value) in zip(self._buffer[1:], values):
+			column_buffer[self._buffered] = value
+		self._buffered += 1
+		if (self._buffered == self._block_size) or (t - self._buffer[0][0] >= self._flush_interval):
+			self.flush()
+
+	def flush(self):
+		if self._buffered == 0:
+			return
+		if self._segment is None:
+			self._segment = self._open_segment()
+		self._segment.write_block([ column_buffer[:self._buffered] for column_buffer in self._buffer ])
+		self._buffered = 0
+		if self._segment.size >= self._max_segment_size:
+			self._segment.close()
+			self._segment = None
+
+	def close(self):
+		self.flush()
+		if self._segment is not None:
+			self._segment.close()
+			self._segment = None
+
+class TelemetryStore():
+	_SEGMENT_RE = re.compile(r"(?P<series>[a-z_]+)-(?P<segment_no>\d{6})\.tdtm")
+
+	def __init__(self, directory):
+		self._directory = directory
+
+	@classmethod
+	def segment_filenames(cls, printer_directory, series):
+		if not os.path.isdir(printer_directory):
+			return [ ]
+		filenames = [ ]
+		for filename in os.listdir(printer_directory):
+			match = cls._SEGMENT_RE.fullmatch(filename)
+			if (match is not None) and (match["series"] == series):
+				filenames.append((int(match["segment_no"]), os.path.join(printer_directory, filename)))
+		return [ filename for (segment_no, filename) in sorted(filenames) ]
+
+	@property
+	def printers(self):
+		return sorted(name for name in os.listdir(self._directory) if os.path.isdir(os.path.join(self._directory, name)) and (len(self.series(name)) > 0))
+
+	def series(self, printer):
+		printer_directory = os.path.join(self._directory, printer)
+		return sorted(set(match["series"] for match in (self._SEGMENT_RE.fullmatch(filename) for filename in os.listdir(printer_directory)) if match is not None))
+
+	@classmethod
+	def _read_segment(cls, filename, t_from, t_to):
+		with open(filename, "rb") as f:
+			data = f.read()
+		file_header = TelemetrySegmentWriter.FileHeader.unpack_head(data)
+		if file_header.magic != TelemetrySegmentWriter._FILE_MAGIC:
+			raise TelemetryException("Not a telemetry segment: %s" % (filename))
+		offset = TelemetrySegmentWriter.FileHeader.size
+		columns = [ ]
+		for column_header in TelemetrySegmentWriter.ColumnHeader.iter_unpack(data, count = file_header.column_count, offset = offset):
+			columns.append(TelemetryColumn(column_header.name.rstrip(b"\x00").decode("ascii"), numpy.dtype(column_header.dtype.rstrip(b"\x00").decode("ascii"))))
+		offset += file_header.column_count * TelemetrySegmentWriter.ColumnHeader.size
+
+		blocks = [ ]
+		while offset + TelemetrySegmentWriter.BlockHeader.size <= len(data):
+			block_header = TelemetrySegmentWriter.BlockHeader.unpack_head(data[offset : offset + TelemetrySegmentWriter.BlockHeader.size])
+			if block_header.magic != TelemetrySegmentWriter._BLOCK_MAGIC:
+				raise TelemetryException("Corrupt block at offset %d of %s." % (offset, filename))
+			offset += TelemetrySegmentWriter.BlockHeader.size
+			block_size = sum(block_header.sample_count * column.dtype.itemsize for column in columns)
+			if offset + block_size > len(data):
+				# Block was cut short while being written
+				break
+			if ((t_to is None) or (block_header.t_first <= t_to)) and ((t_from is None) or (block_header.t_last >= t_from)):
+				block = collections.OrderedDict()
+				for column in columns:
+					block[column.name] = numpy.frombuffer(data, dtype = column.dtype, count = block_header.sample_count, offset = offset)
+					offset += block_header.sample_count * column.dtype.itemsize
+				blocks.append(block)
+			else:
+				offset += block_size
+		return (columns, blocks)
+
+	def query(self, printer, series, t_from = None, t_to = None):
+		# Returns all samples of a series between both times (inclusive) as a
+		# dictionary of column arrays, ordered by time
+		columns = None
+		blocks = [ ]
+		for filename in self.segment_filenames(os.path.join(self._directory, printer), series):
+			(columns, segment_blocks) = self._read_segment(filename, t_from, t_to)
+			blocks += segment_blocks
+		if columns is None:
+			raise TelemetryException("No '%s' telemetry stored for printer %s." % (series, printer))
+
+		result = collections.OrderedDict()
+		for column in columns:
+			result[column.name] = numpy.concatenate([ block[column.name] for block in blocks ]) if (len(blocks) > 0) else numpy.empty(0, dtype = column.dtype)
+		mask = numpy.ones(len(result["t"]), dtype = bool)
+		if t_from is not None:
+			mask &= result["t"] >= t_from
+		if t_to is not None:
+			mask &= result["t"] <= t_to
+		for (name, values) in result.items():
+			result[name] = values[mask]
+		return result
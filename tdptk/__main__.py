@@ -19,6 +19,7 @@
 #
 #	Johannes Bauer <JohannesBauer@gmx.de>
 
+import os
 import sys
 import contextlib
 from .MultiCommand import MultiCommand
@@ -26,19 +27,25 @@ from .ActionFileInfo import ActionFileInfo
 from .ActionPrinterStatus import ActionPrinterStatus
 from .ActionGerberCommand import ActionGerberCommand
 from .ActionPrinterCommand import ActionPrinterCommand
+from .ActionBroker import ActionBroker
+from .ActionTelemetry import ActionTelemetry
+from .ActionSimulate import ActionSimulate
 from .ActionMergeGX import ActionMergeGX
 from .ActionSplitGX import ActionSplitGX
 from .ActionCreateGX import ActionCreateGX
 from .ActionPrint import ActionPrint
 from .ActionRender import ActionRender
+from .ActionBatchRender import ActionBatchRender
 from .ActionManipulate import ActionManipulate
 ActionModelPlot = None
-ActionModelEstimmate = None
+ActionModelEstimate = None
 with contextlib.suppress(ImportError):
 	from .ActionModelPlot import ActionModelPlot
 with contextlib.suppress(ImportError):
 	from .ActionModelEstimate import ActionModelEstimate
 from .XGCodeFile import XGCodeMaterials
+from .POVRayRenderer import POVRayRenderer
+from .PrinterBroker import PrinterBroker
 
 def _dimensions(text):
 	if "x" in text:
@@ -47,6 +54,38 @@ def _dimensions(text):
 	else:
 		return (int(text), int(text))
 
+def _range(text, conversion):
+	if ":" in text:
+		(first, last) = text.split(":", 1)
+	else:
+		(first, last) = (text, text)
+	first = conversion(first) if (first != "") else None
+	last = conversion(last) if (last != "") else None
+	return (first, last)
+
+def _layer_range(text):
+	return _range(text, int)
+
+def _z_range(text):
+	return _range(text, float)
+
+def _host_port(text):
+	(host, port) = text.rsplit(":", 1) if (":" in text) else ("127.0.0.1", text)
+	return (host, int(port))
+
+def _cpu_slots(text):
+	slots = [ ]
+	for slot_text in text.split(":"):
+		slot = set()
+		for cpu_range in slot_text.split(","):
+			if "-" in cpu_range:
+				(first, last) = cpu_range.split("-")
+				slot |= set(range(int(first), int(last) + 1))
+			else:
+				slot.add(int(cpu_range))
+		slots.append(slot)
+	return slots
+
 def main():
 	mc = MultiCommand()
 
@@ -54,19 +93,27 @@ def main():
 		parser.add_argument("-m", "--model-parameters", metavar = "filename", help = "JSON filename that may contain model parameters to use for simulating the machine execution speed.")
 		parser.add_argument("-s", "--output-speedplot", metavar = "filename", help = "JSON filename that contains detailed time/progress information.")
 		parser.add_argument("-t", "--filetype", choices = [ "auto", "g", "gx", "stl" ], default = "auto", help = "Filetype to assume for the file to be analyzed. Can be any of %(choices)s, defaults to %(default)s. 'auto' guesses the filetype based on the file name extension.")
+		parser.add_argument("--density", metavar = "g/cm³", type = float, default = 1.24, help = "Material density used to estimate the mass of STL models, printed solid. Defaults to %(default).2f g/cm³ (PLA).")
+		parser.add_argument("--filament-diameter", metavar = "mm", type = float, default = 1.75, help = "Filament diameter used to estimate the filament length of STL models. Defaults to %(default).2f mm.")
+		parser.add_argument("--json", action = "store_true", help = "Print the information about all files as JSON instead of text.")
 		parser.add_argument("-f", "--force", action = "store_true", help = "Overwrite output files even if they already exists.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
 		parser.add_argument("filename", nargs = "+", help = "File(s) to analyze")
 	mc.register("fileinfo", "Display information about a file", genparser, action = ActionFileInfo, aliases = [ "info" ])
 
 	def genparser(parser):
+		parser.add_argument("-b", "--broker", metavar = "socket", default = os.environ.get("TDPTK_BROKER"), help = "Send commands through the broker listening on this Unix socket instead of connecting to the printer directly. Defaults to the TDPTK_BROKER environment variable, if set.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
+		parser.add_argument("-c", "--concurrency", metavar = "count", type = int, default = 8, help = "Maximum number of printers that are queried at the same time. Defaults to %(default)d.")
+		parser.add_argument("-d", "--deadline", metavar = "secs", type = float, default = 10, help = "Time after which a printer that has not completed its status query is reported as failed. Defaults to %(default).1f sec.")
+		parser.add_argument("-t", "--timeout", metavar = "secs", type = float, default = 1.0, help = "Command timeout in seconds, defaults to %(default).1f sec")
 		parser.add_argument("uri", nargs = "+", help = "Printer(s) to connect to, using a scheme such as ff://myprinter for the FlashForge protocol")
 	mc.register("status", "Display status of connected printer(s)", genparser, action = ActionPrinterStatus)
 
 	def genparser(parser):
 		parser.add_argument("-t", "--timeout", metavar = "secs", type = float, default = 1.0, help = "Command timeout in seconds, defaults to %(default).1f sec")
 		parser.add_argument("-u", "--uri", metavar = "uri", required = True, help = "Printer to connect to, using a scheme such as ff://myprinter for the FlashForge protocol")
+		parser.add_argument("-b", "--broker", metavar = "socket", default = os.environ.get("TDPTK_BROKER"), help = "Send commands through the broker listening on this Unix socket instead of connecting to the printer directly. Defaults to the TDPTK_BROKER environment variable, if set.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
 		parser.add_argument("commands", nargs = "+", help = "Gerber command(s) to execute")
 	mc.register("gerber", "Directly execute a Gerber command", genparser, action = ActionGerberCommand)
@@ -74,10 +121,43 @@ def main():
 	def genparser(parser):
 		parser.add_argument("-t", "--timeout", metavar = "secs", type = float, default = 1.0, help = "Command timeout in seconds, defaults to %(default).1f sec")
 		parser.add_argument("-u", "--uri", metavar = "uri", required = True, help = "Printer to connect to, using a scheme such as ff://myprinter for the FlashForge protocol")
+		parser.add_argument("-b", "--broker", metavar = "socket", default = os.environ.get("TDPTK_BROKER"), help = "Send commands through the broker listening on this Unix socket instead of connecting to the printer directly. Defaults to the TDPTK_BROKER environment variable, if set.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
 		parser.add_argument("commands", choices = [ "cancel", "pause", "resume", "info", "monitor", "benchmark" ], nargs = "+", help = "Command(s) to execute. Can be one of %(choices)s.")
 	mc.register("command", "Execute a printer command such as stopping the print or querying information", genparser, action = ActionPrinterCommand, aliases = [ "cmd" ])
 
+	def genparser(parser):
+		parser.add_argument("-s", "--socket", metavar = "path", default = PrinterBroker.default_socket_path(), help = "Unix socket to listen on for client requests. Defaults to %(default)s.")
+		parser.add_argument("-i", "--idle-timeout", metavar = "secs", type = float, default = 60, help = "Release control over a printer after it has not been used for this long, so that other software can connect to it. Defaults to %(default).0f secs.")
+		parser.add_argument("-t", "--timeout", metavar = "secs", type = float, default = 1.0, help = "Command timeout in seconds, defaults to %(default).1f sec")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Once logs client requests, twice also the printer traffic.")
+	mc.register("broker", "Keep printer connections open and share them between invocations of gerber, command and status", genparser, action = ActionBroker)
+
+	def genparser(parser):
+		parser.add_argument("--progress-interval", metavar = "secs", type = float, default = 10, help = "Interval in which the print progress (M27) is sampled, 0 disables sampling it. Defaults to %(default).1f secs.")
+		parser.add_argument("--temperature-interval", metavar = "secs", type = float, default = 2, help = "Interval in which temperatures (M105) are sampled, 0 disables sampling them. Defaults to %(default).1f secs.")
+		parser.add_argument("--position-interval", metavar = "secs", type = float, default = 1, help = "Interval in which the position (M114) is sampled, 0 disables sampling it. Defaults to %(default).1f secs.")
+		parser.add_argument("--state-interval", metavar = "secs", type = float, default = 5, help = "Interval in which the machine state (M119) is sampled, 0 disables sampling it. Defaults to %(default).1f secs.")
+		parser.add_argument("-t", "--timeout", metavar = "secs", type = float, default = 1.0, help = "Command timeout in seconds, defaults to %(default).1f sec")
+		parser.add_argument("-b", "--broker", metavar = "socket", default = os.environ.get("TDPTK_BROKER"), help = "Send commands through the broker listening on this Unix socket instead of connecting to the printer directly. Defaults to the TDPTK_BROKER environment variable, if set.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Once logs connections, twice also the printer traffic.")
+		parser.add_argument("output_directory", help = "Directory to store the telemetry in, one subdirectory per printer")
+		parser.add_argument("uri", nargs = "+", help = "Printer(s) to connect to, using a scheme such as ff://myprinter for the FlashForge protocol")
+	mc.register("telemetry", "Continuously record status, temperature and position of printer(s) until interrupted", genparser, action = ActionTelemetry)
+
+	def genparser(parser):
+		parser.add_argument("-l", "--listen", metavar = "host:port", type = _host_port, default = "127.0.0.1:8899", help = "Address to listen on. Defaults to %(default)s.")
+		parser.add_argument("--latency", metavar = "secs", type = float, default = 0.01, help = "Delay before the printer responds to a command. Defaults to %(default).3f secs.")
+		parser.add_argument("--bandwidth", metavar = "kiB/s", type = float, help = "Rate at which the printer receives data. Unlimited by default.")
+		parser.add_argument("--ack-delay", metavar = "secs", type = float, default = 0, help = "Additional delay before a file chunk is acknowledged. Defaults to %(default).3f secs.")
+		parser.add_argument("--ack-mode", choices = [ "index", "plain" ], default = "index", help = "Acknowledge file chunks with their index ('ok N<index>') or with a plain 'ok'. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("--loss", metavar = "probability", type = float, default = 0, help = "Probability with which a response or chunk acknowledgement is dropped. Defaults to %(default).2f.")
+		parser.add_argument("--disconnect", metavar = "probability", type = float, default = 0, help = "Probability with which the printer closes the connection when receiving a command or file chunk. Defaults to %(default).2f.")
+		parser.add_argument("--print-duration", metavar = "secs", type = float, default = 600, help = "Time a simulated print job takes. Defaults to %(default).0f secs.")
+		parser.add_argument("--seed", metavar = "number", type = int, help = "Seed for simulated losses and disconnects, to make them reproducible.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity. Once logs received commands.")
+	mc.register("simulate", "Run a simulated FlashForge printer for testing and benchmarking", genparser, action = ActionSimulate)
+
 	def genparser(parser):
 		parser.add_argument("-f", "--force", action = "store_true", help = "Overwrite output files even if they already exists.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
@@ -99,6 +179,7 @@ def main():
 	def genparser(parser):
 		parser.add_argument("--material-right", metavar = "name", type = XGCodeMaterials, default = XGCodeMaterials.PLA, help = "Material used in right extruder. Can be one of %s. Defaults to PLA." % (", ".join(material.name for material in XGCodeMaterials)))
 		parser.add_argument("--material-left", metavar = "name", type = XGCodeMaterials, default = XGCodeMaterials.PLA, help = "Material used in right extruder. Can be one of %s. Defaults to PLA." % (", ".join(material.name for material in XGCodeMaterials)))
+		parser.add_argument("-p", "--preview", choices = [ "builtin", "povray" ], default = "builtin", help = "Renderer used to create the preview bitmap. 'builtin' rasterizes the G-code in-process, 'povray' uses POV-Ray. Can be one of %(choices)s, defaults to %(default)s.")
 		parser.add_argument("-f", "--force", action = "store_true", help = "Overwrite output file even if it already exists.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
 		parser.add_argument("gcode_filename", help = "G-code instructions filename")
@@ -106,6 +187,8 @@ def main():
 	mc.register("create-gx", "Create a .gx file from Gerber data", genparser, action = ActionCreateGX, aliases = [ "mkgx" ])
 
 	def genparser(parser):
+		parser.add_argument("-r", "--retries", metavar = "count", type = int, default = 5, help = "Number of times to reconnect to the printer when the connection is lost, waiting exponentially longer in between (up to 30 secs). A file that was completely stored on the printer is not uploaded again. Defaults to %(default)d.")
+		parser.add_argument("-w", "--window", metavar = "chunks", type = int, default = 8, help = "Number of file chunks that are sent to the printer before waiting for their acknowledgement. 1 sends stop-and-wait. Defaults to %(default)d.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
 		parser.add_argument("input_filename", help = "Printer filename, can be of different formats (e.g., must be a .gx file for FlashForge)")
 		parser.add_argument("printer_uri", help = "Printer URI to print at")
@@ -117,15 +200,50 @@ def main():
 		parser.add_argument("-d", "--dimensions", metavar = "width x height", type = _dimensions, default = "800x600", help = "Ouptut image dimensions. Defaults to %(default)s.")
 		parser.add_argument("-s", "--style", choices = [ "color", "bw" ], default = "color", help = "Render a particular style. Can be one of %(choices)s, defaults to %(default)s.")
 		parser.add_argument("-o", "--oversample", metavar = "factor", type = float, default = 1, help = "Oversample POV-Ray rendering.")
+		parser.add_argument("--views", metavar = "views", type = POVRayRenderer.parse_views, help = "Comma-separated list of camera views to render from a single scene, written to one output file each with the view name appended. Can be any of iso, top, front, side or turntable:N for N frames rotating around the part. Defaults to iso only.")
 		parser.add_argument("-f", "--force", action = "store_true", help = "Overwrite output file even if it already exists.")
-		parser.add_argument("-t", "--filetype", choices = [ "auto", "g", "gx" ], default = "auto", help = "Filetype to assume for the file to be analyzed. Can be any of %(choices)s, defaults to %(default)s. 'auto' guesses the filetype based on the file name extension.")
+		parser.add_argument("-t", "--filetype", choices = [ "auto", "g", "gx", "stl" ], default = "auto", help = "Filetype to assume for the file to be analyzed. Can be any of %(choices)s, defaults to %(default)s. 'auto' guesses the filetype based on the file name extension.")
+		parser.add_argument("--smooth", action = "store_true", help = "Shade STL meshes smoothly by interpolating vertex normals instead of showing flat facets.")
+		parser.add_argument("--decimate", choices = [ "none", "cluster", "quadric" ], default = "none", help = "Reduce STL meshes to about as many facets as the output has pixels before rendering. 'cluster' merges vertices on a grid, 'quadric' additionally places merged vertices so that edges stay sharp. Can be one of %(choices)s, defaults to %(default)s.")
 		parser.add_argument("--show", action = "store_true", help = "Display the POV-Ray rendering output in a window")
 		parser.add_argument("--no-trim", action = "store_true", help = "By default, the POV-Ray output is trimmed and resized appropriately afterwards. With this option, the POV-Ray output is directly emitted.")
+		parser.add_argument("--lod", action = "store_true", help = "Reduce G-code geometry to the level of detail that is visible at the output resolution. Drops extrusions below pixel size and regions that are enclosed at that resolution.")
+		parser.add_argument("--cull", action = "store_true", help = "Remove G-code extrusions which are hidden behind others when seen from the isometric camera, such as infill inside the part. Only possible when rendering the isometric view.")
+		parser.add_argument("--layers", metavar = "first:last", type = _layer_range, help = "Only render this window of layers, counted from 0. Either end may be omitted. Earlier layers are skipped quickly and parsing stops after the last layer.")
+		parser.add_argument("--z-range", metavar = "min:max", type = _z_range, help = "Only render layers whose height in mm lies within this range. Either end may be omitted.")
+		parser.add_argument("--cache-dir", metavar = "path", help = "Directory in which generated scene geometry is cached so that rendering the same input again (e.g., in a different style or size) skips parsing it. Defaults to ~/.cache/tdptk/povray.")
+		parser.add_argument("--no-cache", action = "store_true", help = "Do not use the scene geometry cache.")
+		parser.add_argument("--strips", metavar = "count", type = int, default = 1, help = "Split the frame into this many horizontal strips that are rendered by concurrent POV-Ray processes and stitched back together. Defaults to %(default)d.")
+		parser.add_argument("--strip-slots", metavar = "cpus", type = _cpu_slots, help = "CPU slots that strip renderings are distributed over, e.g., '0-3:4-7' for two POV-Ray processes pinned to four CPUs each. By default, all available CPUs are split evenly.")
 		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
-		parser.add_argument("input_filename", help = "GCode or GXCode input file")
+		parser.add_argument("input_filename", help = "GCode, GXCode or STL input file")
 		parser.add_argument("output_filename", help = "Output file to write; automatically determines file type based on extension. When .pov is specified, renders the POV-Ray source")
 	mc.register("render", "Do a 3d rendering of GCode using POV-Ray", genparser, action = ActionRender)
 
+	def genparser(parser):
+		parser.add_argument("-M", "--manifest", metavar = "filename", help = "Text file that contains one input file per line, optionally followed by the output file to render it to.")
+		parser.add_argument("-O", "--output-dir", metavar = "path", default = ".", help = "Directory into which output files are rendered unless the manifest specifies them explicitly. Defaults to %(default)s.")
+		parser.add_argument("-e", "--extension", metavar = "ext", default = "png", help = "File extension of output files unless the manifest specifies them explicitly. Defaults to %(default)s.")
+		parser.add_argument("-j", "--jobs", metavar = "count", type = int, default = os.cpu_count() or 1, help = "Number of POV-Ray processes to run concurrently. Defaults to %(default)d.")
+		parser.add_argument("-T", "--threads", metavar = "count", type = int, default = 1, help = "Number of render threads each POV-Ray process uses. Defaults to %(default)d.")
+		parser.add_argument("-P", "--parse-jobs", metavar = "count", type = int, default = os.cpu_count() or 1, help = "Number of processes that parse input files and generate scenes concurrently. Defaults to %(default)d.")
+		parser.add_argument("-m", "--mode", choices = [ "fast", "default" ], default = "default", help = "Rendering modes. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-p", "--povray", metavar = "option", action = "append", default = [ ], help = "Pass this option to the POV-Ray renderer verbatim. Can be specified multiple times.")
+		parser.add_argument("-d", "--dimensions", metavar = "width x height", type = _dimensions, default = "800x600", help = "Ouptut image dimensions. Defaults to %(default)s.")
+		parser.add_argument("-s", "--style", choices = [ "color", "bw" ], default = "color", help = "Render a particular style. Can be one of %(choices)s, defaults to %(default)s.")
+		parser.add_argument("-o", "--oversample", metavar = "factor", type = float, default = 1, help = "Oversample POV-Ray rendering.")
+		parser.add_argument("--views", metavar = "views", type = POVRayRenderer.parse_views, help = "Comma-separated list of camera views to render from a single scene, written to one output file each with the view name appended. Can be any of iso, top, front, side or turntable:N for N frames rotating around the part. Defaults to iso only.")
+		parser.add_argument("-f", "--force", action = "store_true", help = "Overwrite output files even if they already exist.")
+		parser.add_argument("-t", "--filetype", choices = [ "auto", "g", "gx", "stl" ], default = "auto", help = "Filetype to assume for the input files. Can be any of %(choices)s, defaults to %(default)s. 'auto' guesses the filetype based on the file name extension.")
+		parser.add_argument("--no-trim", action = "store_true", help = "By default, the POV-Ray output is trimmed and resized appropriately afterwards. With this option, the POV-Ray output is directly emitted.")
+		parser.add_argument("--lod", action = "store_true", help = "Reduce G-code geometry to the level of detail that is visible at the output resolution. Drops extrusions below pixel size and regions that are enclosed at that resolution.")
+		parser.add_argument("--cull", action = "store_true", help = "Remove G-code extrusions which are hidden behind others when seen from the isometric camera, such as infill inside the part. Only possible when rendering the isometric view.")
+		parser.add_argument("--cache-dir", metavar = "path", help = "Directory in which generated scene geometry is cached. Defaults to ~/.cache/tdptk/povray.")
+		parser.add_argument("--no-cache", action = "store_true", help = "Do not use the scene geometry cache.")
+		parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
+		parser.add_argument("input_filename", nargs = "*", help = "GCode, GXCode or STL input file(s)")
+	mc.register("batch-render", "Render many files concurrently using POV-Ray", genparser, action = ActionBatchRender)
+
 	def genparser(parser):
 		parser.add_argument("--remove-extrusion", action = "store_true", help = "Remove all extrusion and heating code.")
 		parser.add_argument("--insert-timing-markers", action = "store_true", help = "Insert timing markers for the extrusion axis. Will only do anything when --remove-extrusion is given as well.")
@@ -138,18 +256,20 @@ def main():
 
 	if ActionModelPlot is not None:
 		def genparser(parser):
+			parser.add_argument("-p", "--printer", metavar = "name", help = "When reading a telemetry directory, use the position telemetry of this printer. Only needed if the directory holds telemetry of more than one printer.")
 			parser.add_argument("-m", "--model", metavar = "filename", help = "Use the model parameters from this input file instead of defaults.")
 			parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
 			parser.add_argument("gcode_filename", help = "GCode used for benchmarking")
-			parser.add_argument("benchmark_filename", help = "Captured benchmarking measurement results")
+			parser.add_argument("benchmark_filename", help = "Captured benchmarking measurement results, either a file written by the benchmark command or a telemetry directory")
 		mc.register("model-plot", "Use Bokeh to serve an application which plots a model estimate against real output", genparser, action = ActionModelPlot)
 
 	if ActionModelEstimate is not None:
 		def genparser(parser):
+			parser.add_argument("-p", "--printer", metavar = "name", help = "When reading a telemetry directory, use the position telemetry of this printer. Only needed if the directory holds telemetry of more than one printer.")
 			parser.add_argument("-f", "--force", action = "store_true", help = "Overwrite output file even if it already exists.")
 			parser.add_argument("-v", "--verbose", action = "count", default = 0, help = "Increase verbosity during the importing process.")
 			parser.add_argument("gcode_filename", help = "GCode used for benchmarking")
-			parser.add_argument("benchmark_filename", help = "Captured benchmarking measurement results")
+			parser.add_argument("benchmark_filename", help = "Captured benchmarking measurement results, either a file written by the benchmark command or a telemetry directory")
 			parser.add_argument("parameter_output_filename", help = "Write best approximation of model parameters to this file")
 		mc.register("model-estimate", "Use a differntial evolution approach in SciPy to estimate model parameters", genparser, action = ActionModelEstimate)
 